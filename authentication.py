@@ -36,6 +36,28 @@ class Authentication(MetaObject):
             """
             pass
 
+        @property
+        def signature_length(self):
+            """
+            The number of bytes at the end of a packet that are used for signatures.
+            @rtype: int
+            """
+            return 0
+
+        def get_signature_checks(self, payload, allow_empty_signature=False):
+            """
+            Returns the signatures that must be verified for PAYLOAD to be correctly signed.
+
+            The checks are returned as a list with (Member, data, signature) tuples, or None when PAYLOAD can not be
+            correctly signed regardless of the outcome of any check.
+            @rtype: list containing (Member, string, string) tuples or None
+            """
+            return []
+
+        def has_valid_signature_for(self, placeholder, payload):
+            checks = self.get_signature_checks(payload, placeholder.allow_empty_signature)
+            return checks is not None and all(member.verify(data, signature) for member, data, signature in checks)
+
         def setup(self, message_impl):
             from .message import Message
             assert isinstance(message_impl, Message.Implementation)
@@ -76,9 +98,6 @@ class NoAuthentication(Authentication):
         def sign(self, payload):
             return ""
 
-        def has_valid_signature_for(self, placeholder, payload):
-            return True
-
 
 class MemberAuthentication(Authentication):
 
@@ -146,15 +165,19 @@ class MemberAuthentication(Authentication):
         def is_signed(self):
             return bool(self._signature)
 
+        @property
+        def signature_length(self):
+            return self._member.signature_length
+
         def sign(self, payload):
             if self._is_sig_empty():
                 self._signature = self._member.sign(payload)
             return self._signature
 
-        def has_valid_signature_for(self, placeholder, payload):
-            if placeholder.allow_empty_signature and self._is_sig_empty():
-                return True
-            return self._member.verify(payload, self._signature)
+        def get_signature_checks(self, payload, allow_empty_signature=False):
+            if allow_empty_signature and self._is_sig_empty():
+                return []
+            return [(self._member, payload, self._signature)]
 
         def _is_sig_empty(self):
             return self._signature == "" or self._signature == "\x00" * self._member.signature_length
@@ -281,6 +304,10 @@ class DoubleMemberAuthentication(Authentication):
             """
             return self._members[0]
 
+        @property
+        def signature_length(self):
+            return sum(member.signature_length for member in self._members)
+
         @property
         def members(self):
             """
@@ -324,15 +351,17 @@ class DoubleMemberAuthentication(Authentication):
                         self._signatures[i] = "\x00" * self._members[i].signature_length
             return "".join(self._signatures)
 
-        def has_valid_signature_for(self, placeholder, payload):
-            payloads = self._meta.split_payload_func(payload)
+        def get_signature_checks(self, payload, allow_empty_signature=False):
+            checks = []
+            # PAYLOAD may be a buffer when it is being decoded, SPLIT_PAYLOAD_FUNC expects a str
+            payloads = self._meta.split_payload_func(str(payload))
             for signature, member, payload in zip(self._signatures, self._members, payloads):
                 if self._is_sig_empty(signature, member):
-                    if not placeholder.allow_empty_signature:
-                        return False
-                elif not member.verify(payload, signature):
-                    return False
-            return True
+                    if not allow_empty_signature:
+                        return None
+                else:
+                    checks.append((member, payload, signature))
+            return checks
 
         def _is_sig_empty(self, signature, member):
             return signature == "" or signature == "\x00" * member.signature_length
@@ -17,19 +17,37 @@ larger the probability of false positives.
 Initial Bloomfilter implementation based on pybloom by Jay Baird <jay@mochimedia.com> and Bob
 Ippolito <bob@redivi.com>.  Simplified, and optimized to use just python code.
 
+The bits are stored in a bytearray where bit I is stored in byte I / 8 at position I % 8 (least
+significant bit first).  This results in the exact same binary representation as the original
+implementation that stored all bits in a single python long, while allowing bits to be set and
+tested without allocating new (large) integers.
+
+The bit positions of a key are derived from the salted key itself (mode u"plain") or from the salted
+sha1 digest of the key (mode u"digest").  The latter allows the digests of large keys, i.e. packets,
+to be computed once and cached, while the prefix still changes for every bloom filter.
+
 @author: Boudewijn Schoon
 @organization: Technical University Delft
 @contact: dispersy@frayja.com
 """
 
+from binascii import hexlify, unhexlify
 from hashlib import sha1, sha256, sha384, sha512, md5
 from math import ceil, log
 from struct import Struct
-from binascii import hexlify, unhexlify
 import logging
 
 logger = logging.getLogger(__name__)
 
+# _BIT_MASK[i] is the mask for bit i within a byte, i.e. 1 << i
+_BIT_MASK = tuple(1 << i for i in xrange(8))
+
+# _BIT_COUNT[b] is the number of bits set in byte b
+_BIT_COUNT = tuple(bin(b).count("1") for b in xrange(256))
+
+# the supported ways to derive the bit positions of a key
+MODES = (u"plain", u"digest")
+
 
 class BloomFilter(object):
 
@@ -43,18 +61,18 @@ class BloomFilter(object):
     The BloomFilter constructor takes parameters that are interpreted differently, depending on their type.  The
     following type combination, and their interpretations, are possible:
 
-    - BloomFilter(int:m_size, float:f_error_rate, str:prefix="")
+    - BloomFilter(int:m_size, float:f_error_rate, str:prefix="", unicode:mode=u"plain")
 
       Will create a BloomFilter instance that is m_size bits large with approximately f_error_rate chance for false
       positives.  Typically this is used to create a bloom filter where the size it can occupy is limited or fixed.
       Note that m_size must be a multiple of 8.
 
-    - BloomFilter(float:f_error_rate, int:n_capacity, str:prefix="")
+    - BloomFilter(float:f_error_rate, int:n_capacity, str:prefix="", unicode:mode=u"plain")
 
       Will create a BloomFilter instance with approximately f_error_rate chance for false positives when n_capacity keys
       are added.  The m_size, i.e. bits required for storage, is approximated from the f_error_rate and n_capacity.
 
-    - BloomFilter(str:bytes, int:k_functions, str:prefix="")
+    - BloomFilter(str:bytes, int:k_functions, str:prefix="", unicode:mode=u"plain")
 
       Will create a BloomFilter instance from a binary string and a number of functions.  Typically this is used to
       retrieve a bloom filter that was serialised.  For example:
@@ -64,6 +82,10 @@ class BloomFilter(object):
       storage = (original.bytes, original.functions, original.prefix)
       # storage can be written to disk, socket, etc
       clone = BloomFilter(storage[0], storage[1], storage[2])
+
+    The optional MODE keyword argument chooses how the bit positions of a key are derived, either from the key itself
+    (u"plain") or from the sha1 digest of the key (u"digest").  In u"digest" mode add_digests and not_filter_digests
+    can be used when the sha1 digests of the keys are already known.
     """
 
     @staticmethod
@@ -84,7 +106,7 @@ class BloomFilter(object):
             prefix = kargs.get("prefix", args[2] if len(args) >= 3 else "")
             assert 0 < len(bytes_), len(bytes_)
             logger.debug("bloom filter based on %d bytes and k_functions %d", len(bytes_), k_functions)
-            filter_ = long(hexlify(bytes_[::-1]), 16)
+            filter_ = bytearray(bytes_)
 
         # matches: BloomFilter(int:m_size, float:f_error_rate, str:prefix="")
         elif len(args) >= 2 and isinstance(args[0], int) and isinstance(args[1], float):
@@ -96,7 +118,7 @@ class BloomFilter(object):
             assert 0.0 < f_error_rate < 1.0, f_error_rate
             logger.debug("constructing bloom filter based on m_size %d bits and f_error_rate %f", m_size, f_error_rate)
             k_functions = cls._get_k_functions(m_size, cls._get_n_capacity(m_size, f_error_rate))
-            filter_ = 0
+            filter_ = bytearray(m_size / 8)
 
         # matches: BloomFilter(float:f_error_rate, int:n_capacity, str:prefix="")
         elif len(args) >= 2 and isinstance(args[0], float) and isinstance(args[1], int):
@@ -109,18 +131,19 @@ class BloomFilter(object):
                          n_capacity)
             m_size = int(ceil(abs((n_capacity * log(f_error_rate)) / (log(2) ** 2)) / 8.0) * 8)
             k_functions = cls._get_k_functions(m_size, n_capacity)
-            filter_ = 0
+            filter_ = bytearray(m_size / 8)
 
         else:
             raise RuntimeError("Unknown combination of argument types %s" % str([type(arg) for arg in args]))
 
-        return m_size, k_functions, prefix, filter_
+        mode = kargs.get("mode", u"plain")
+        return m_size, k_functions, prefix, mode, filter_
 
     def __init__(self, *args, **kargs):
         self._logger = logging.getLogger(self.__class__.__name__)
 
         # get constructor arguments required to build the bloom filter
-        self._m_size, self._k_functions, self._prefix, self._filter = self._overload_constructor_arguments(args, kargs)
+        self._m_size, self._k_functions, self._prefix, self._mode, self._filter = self._overload_constructor_arguments(args, kargs)
 
         assert isinstance(self._m_size, int), type(self._m_size)
         assert 0 < self._m_size, self._m_size
@@ -129,7 +152,9 @@ class BloomFilter(object):
         assert 0 < self._k_functions <= self._m_size, [self._k_functions, self._m_size]
         assert isinstance(self._prefix, str), type(self._prefix)
         assert 0 <= len(self._prefix) < 256, len(self._prefix)
-        assert isinstance(self._filter, (int, long)), type(self._filter)
+        assert self._mode in MODES, self._mode
+        assert isinstance(self._filter, bytearray), type(self._filter)
+        assert len(self._filter) * 8 == self._m_size, [len(self._filter), self._m_size]
 
         # determine hash function
         if self._m_size >= (1 << 31):
@@ -164,21 +189,41 @@ class BloomFilter(object):
         """
         Add KEY to the BloomFilter.
         """
+        if self._mode == u"digest":
+            key = sha1(key).digest()
+
         filter_ = self._filter
+        m_size = self._m_size
+        bit_mask = _BIT_MASK
         hash_ = self._salt.copy()
         hash_.update(key)
         for pos in self._fmt_unpack(hash_.digest()):
-            filter_ |= 1 << (pos % self._m_size)
-        self._filter = filter_
+            pos %= m_size
+            filter_[pos >> 3] |= bit_mask[pos & 7]
 
     def add_keys(self, keys):
         """
         Add a sequence of KEYS to the BloomFilter.
         """
+        if self._mode == u"digest":
+            keys = (sha1(key).digest() for key in keys)
+        self._add_keys(keys)
+
+    def add_digests(self, digests):
+        """
+        Add a sequence of keys, given by their sha1 DIGESTS, to the BloomFilter.
+
+        Only available in u"digest" mode.
+        """
+        assert self._mode == u"digest", self._mode
+        self._add_keys(digests)
+
+    def _add_keys(self, keys):
         filter_ = self._filter
         salt_copy = self._salt.copy
         m_size = self._m_size
         fmt_unpack = self._fmt_unpack
+        bit_mask = _BIT_MASK
 
         for key in keys:
             assert isinstance(key, str)
@@ -189,25 +234,47 @@ class BloomFilter(object):
             # while generators are more memory efficient, this list will be relatively short.
             # 07/05/12 Niels: using no list at all is even more efficient/faster
             for pos in fmt_unpack(hash_.digest()):
-                filter_ |= 1 << (pos % m_size)
-
-        self._filter = filter_
+                pos %= m_size
+                filter_[pos >> 3] |= bit_mask[pos & 7]
 
     def clear(self):
         """
         Set all bits in the filter to zero.
         """
-        self._filter = 0
+        self._filter = bytearray(self._m_size / 8)
+
+    def merge(self, *others):
+        """
+        Set all bits that are set in any of the OTHERS BloomFilters.
+
+        All OTHERS must have the same size, number of functions, prefix, and mode as this BloomFilter.
+        """
+        assert all(isinstance(other, BloomFilter) for other in others)
+        assert all(other.size == self._m_size for other in others), [other.size for other in others]
+        assert all(other.functions == self._k_functions for other in others), [other.functions for other in others]
+        assert all(other.prefix == self._prefix for other in others), [other.prefix for other in others]
+        assert all(other.mode == self._mode for other in others), [other.mode for other in others]
+        if others:
+            # OR-ing the filters as python longs is much faster than OR-ing them byte by byte
+            value = long(hexlify(self._filter), 16)
+            for other in others:
+                value |= long(hexlify(other._filter), 16)
+            self._filter = bytearray(unhexlify("%0*x" % (len(self._filter) * 2, value)))
 
     def __contains__(self, key):
+        if self._mode == u"digest":
+            key = sha1(key).digest()
+
         filter_ = self._filter
-        m_size_ = self._m_size
+        m_size = self._m_size
+        bit_mask = _BIT_MASK
 
         hash_ = self._salt.copy()
         hash_.update(key)
 
         for pos in self._fmt_unpack(hash_.digest()):
-            if not filter_ & (1 << (pos % m_size_)):
+            pos %= m_size
+            if not filter_[pos >> 3] & bit_mask[pos & 7]:
                 return False
         return True
 
@@ -216,10 +283,26 @@ class BloomFilter(object):
         Yields all tuples in iterator where the first element in the tuple is NOT in the bloom
         filter.
         """
+        if self._mode == u"digest":
+            return (tup for _, tup in self._not_filter((sha1(tup[0]).digest(), tup) for tup in iterator))
+        return self._not_filter(iterator)
+
+    def not_filter_digests(self, iterator):
+        """
+        Yields all tuples in iterator where the first element in the tuple, the sha1 digest of a
+        key, is NOT in the bloom filter.
+
+        Only available in u"digest" mode.
+        """
+        assert self._mode == u"digest", self._mode
+        return self._not_filter(iterator)
+
+    def _not_filter(self, iterator):
         filter_ = self._filter
         salt_copy = self._salt.copy
         m_size = self._m_size
         fmt_unpack = self._fmt_unpack
+        bit_mask = _BIT_MASK
 
         for tup in iterator:
             assert isinstance(tup, tuple)
@@ -232,7 +315,8 @@ class BloomFilter(object):
             # while generators are more memory efficient, this list will be relatively short.
             # 07/05/12 Niels: using no list at all is even more efficient/faster
             for pos in fmt_unpack(hash_.digest()):
-                if not filter_ & (1 << (pos % m_size)):
+                pos %= m_size
+                if not filter_[pos >> 3] & bit_mask[pos & 7]:
                     yield tup
                     break
 
@@ -260,7 +344,8 @@ class BloomFilter(object):
         The number of bits in the bloom filter that are set.
         @rtype: int
         """
-        return sum(1 if self._filter & (1 << i) else 0 for i in range(self._m_size))
+        bit_count = _BIT_COUNT
+        return sum(bit_count[byte] for byte in self._filter)
 
     @property
     def size(self):
@@ -285,6 +370,14 @@ class BloomFilter(object):
         """
         return self._prefix
 
+    @property
+    def mode(self):
+        """
+        How the bit positions of a key are derived, either u"plain" or u"digest".
+        @rtype: unicode
+        """
+        return self._mode
+
     @property
     def bytes(self):
         """
@@ -292,7 +385,4 @@ class BloomFilter(object):
         bytes as well as the number of functions are required.
         @rtype: string
         """
-        # hex should be m_size/4, hex is 16 instead of 8 -> hence half the number of "hexes" in m_size
-        hex_ = '%x' % self._filter
-        padding = '0' * (self._m_size / 4 - len(hex_))
-        return unhexlify(padding + hex_)[::-1]
+        return str(self._filter)
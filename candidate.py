@@ -1,8 +1,11 @@
 import logging
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush
 
 from .member import Member, DummyMember
 from .util import is_valid_address
 
+logger = logging.getLogger(__name__)
 
 # delay and lifetime values are chosen to ensure that a candidate will not exceed 60.0 or 30.0
 # seconds.  However, taking into account round trip time and processing delay we to use smaller
@@ -26,11 +29,13 @@ assert isinstance(CANDIDATE_LIFETIME, float)
 
 class Candidate(object):
 
+    # a tracker can hold hundreds of thousands of candidates, hence the slots
+    __slots__ = ("_sock_addr", "_tunnel", "_association")
+
     def __init__(self, sock_addr, tunnel):
         assert self.is_valid_address(sock_addr), sock_addr
         assert isinstance(tunnel, bool), type(tunnel)
         super(Candidate, self).__init__()
-        self._logger = logging.getLogger(self.__class__.__name__)
 
         self._sock_addr = sock_addr
         self._tunnel = tunnel
@@ -122,6 +127,9 @@ class WalkCandidate(Candidate):
       after the introduction-response message (talking about the candidate) was received.
     """
 
+    __slots__ = ("_lan_address", "_wan_address", "_connection_type", "_registry", "_last_walk_reply", "_last_walk",
+                 "_last_stumble", "_last_intro", "_last_discovered", "_global_time")
+
     def __init__(self, sock_addr, tunnel, lan_address, wan_address, connection_type):
         assert is_valid_address(sock_addr), sock_addr
         assert isinstance(tunnel, bool), type(tunnel)
@@ -134,6 +142,10 @@ class WalkCandidate(Candidate):
         self._wan_address = wan_address
         self._connection_type = connection_type
 
+        # the CandidateRegistry that contains this candidate, it must be told when the addresses or the associated
+        # member change
+        self._registry = None
+
         # properties to determine the category
         self._last_walk_reply = 0.0
         self._last_walk = 0.0
@@ -146,8 +158,8 @@ class WalkCandidate(Candidate):
 
         if __debug__:
             if not (self.sock_addr == self._lan_address or self.sock_addr == self._wan_address):
-                self._logger.error("Either LAN %s or the WAN %s should be SOCK_ADDR %s",
-                                   self._lan_address, self._wan_address, self.sock_addr)
+                logger.error("Either LAN %s or the WAN %s should be SOCK_ADDR %s",
+                             self._lan_address, self._wan_address, self.sock_addr)
                 assert False
 
     @property
@@ -162,9 +174,21 @@ class WalkCandidate(Candidate):
     def connection_type(self):
         return self._connection_type
 
+    def associate(self, member):
+        super(WalkCandidate, self).associate(member)
+        if self._registry is not None:
+            self._registry.reindex(self)
+
+    def disassociate(self, member):
+        super(WalkCandidate, self).disassociate(member)
+        if self._registry is not None:
+            self._registry.reindex(self)
+
     def merge(self, other):
         if other.get_member():
             self._association = other.get_member()
+            if self._registry is not None:
+                self._registry.reindex(self)
 
         if isinstance(other, WalkCandidate):
             self._last_walk_reply = max(self._last_walk_reply, other._last_walk_reply)
@@ -172,6 +196,11 @@ class WalkCandidate(Candidate):
             self._last_stumble = max(self._last_stumble, other._last_stumble)
             self._last_intro = max(self._last_intro, other._last_intro)
             self._global_time = max(self._global_time, other._global_time)
+            self._recategorize()
+
+    def _recategorize(self):
+        if self._registry is not None:
+            self._registry.recategorize(self)
 
     @property
     def global_time(self):
@@ -210,11 +239,10 @@ class WalkCandidate(Candidate):
         """
         Returns True when this candidate is eligible for taking a step.
 
-        A candidate is eligible when:
-        - SELF is either walk, stumble, or intro; and
-        - the previous step is more than CANDIDATE_ELIGIBLE_DELAY ago.
+        A candidate is eligible when the previous step is more than CANDIDATE_ELIGIBLE_DELAY ago.  The category is
+        not checked, the walker only considers candidates from the walk, stumble, intro, and discovered categories.
         """
-        return (self._last_walk + CANDIDATE_ELIGIBLE_DELAY <= now and self.get_category(now) != u"none")
+        return self._last_walk + CANDIDATE_ELIGIBLE_DELAY <= now
 
     @property
     def last_walk(self):
@@ -259,6 +287,31 @@ class WalkCandidate(Candidate):
 
         return None
 
+    def get_category_expiry(self, now):
+        """
+        Returns a (category, expiry) tuple, where category is what get_category(NOW) returns and expiry is the time
+        at which this category ends.  Expiry is None when category is None.
+        """
+        assert isinstance(now, float), type(now)
+
+        expiry = self._last_walk_reply + CANDIDATE_WALK_LIFETIME
+        if now < expiry:
+            return u"walk", expiry
+
+        expiry = self._last_stumble + CANDIDATE_STUMBLE_LIFETIME
+        if now < expiry:
+            return u"stumble", expiry
+
+        expiry = self._last_intro + CANDIDATE_INTRO_LIFETIME
+        if now < expiry:
+            return u"intro", expiry
+
+        expiry = self._last_discovered + CANDIDATE_DISCOVERED_LIFETIME
+        if now < expiry:
+            return u"discovered", expiry
+
+        return None, None
+
     def walk(self, now):
         """
         Called when we are about to send an introduction-request to this candidate.
@@ -273,6 +326,7 @@ class WalkCandidate(Candidate):
         assert isinstance(now, float), type(now)
         assert now == -1.0 or self._last_walk_reply <= now, self._last_walk_reply
         self._last_walk_reply = now
+        self._recategorize()
 
     def stumble(self, now):
         """
@@ -280,6 +334,7 @@ class WalkCandidate(Candidate):
         """
         assert isinstance(now, float), type(now)
         self._last_stumble = now
+        self._recategorize()
 
     def intro(self, now):
         """
@@ -287,6 +342,7 @@ class WalkCandidate(Candidate):
         """
         assert isinstance(now, float), type(now)
         self._last_intro = now
+        self._recategorize()
 
     def discovered(self, now):
         """
@@ -294,6 +350,7 @@ class WalkCandidate(Candidate):
         """
         assert isinstance(now, float), type(now)
         self._last_discovered = now
+        self._recategorize()
 
     def update(self, tunnel, lan_address, wan_address, connection_type):
         assert isinstance(tunnel, bool), tunnel
@@ -309,11 +366,13 @@ class WalkCandidate(Candidate):
         # someone can also reset from a known connection_type to unknown (i.e. it now believes it is
         # no longer public nor symmetric NAT)
         self._connection_type = u"public" if connection_type == u"unknown" and lan_address == wan_address else connection_type
+        if self._registry is not None:
+            self._registry.reindex(self)
 
         if __debug__:
             if not (self.sock_addr == self._lan_address or self.sock_addr == self._wan_address):
-                self._logger.error("Either LAN %s or the WAN %s should be SOCK_ADDR %s",
-                                   self._lan_address, self._wan_address, self.sock_addr)
+                logger.error("Either LAN %s or the WAN %s should be SOCK_ADDR %s",
+                             self._lan_address, self._wan_address, self.sock_addr)
 
     def __str__(self):
         if self._sock_addr == self._lan_address == self._wan_address:
@@ -325,7 +384,213 @@ class WalkCandidate(Candidate):
             return "{%s:%d %s:%d %s:%d}" % (self._sock_addr[0], self._sock_addr[1], self._lan_address[0], self._lan_address[1], self._wan_address[0], self._wan_address[1])
 
 
+class CandidateRegistry(OrderedDict):
+
+    """
+    Ordered dictionary containing sock_addr:WalkCandidate pairs, with secondary indexes on the host of the sock_addr,
+    on the (WAN host, LAN address) pair, and on the associated member.
+
+    The indexes keep the order in which the candidates were added.  WalkCandidate instances report changes to their
+    addresses or associated member using reindex.
+
+    WalkCandidate instances are also kept in one set per category.  The sets are valid at the most recent time that
+    the registry was queried with, every candidate has an expiry time at which its category ends.  When the registry
+    is queried with a later time only the candidates whose category expired in the meantime are moved to another set.
+    WalkCandidate instances report changes to their walk, stumble, intro, and discovered times using recategorize.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # host: OrderedDict(sock_addr: candidate)
+        self._by_host = {}
+        # (wan host, lan address): OrderedDict(sock_addr: candidate)
+        self._by_wan_lan = {}
+        # member: OrderedDict(sock_addr: candidate)
+        self._by_member = {}
+        # sock_addr: ((wan host, lan address), member) as currently indexed
+        self._indexed = {}
+        # category: OrderedDict(sock_addr: candidate), valid at self._categorized_at
+        self._by_category = dict((category, OrderedDict()) for category in (u"walk", u"stumble", u"intro",
+                                                                              u"discovered", None))
+        # sock_addr: (category, expiry) as currently categorized
+        self._categorized = {}
+        # heap with (expiry, sock_addr) tuples, entries that no longer match self._categorized are skipped
+        self._expiries = []
+        self._categorized_at = 0.0
+        super(CandidateRegistry, self).__init__(*args, **kwargs)
+
+    @staticmethod
+    def _add_to_index(index, key, sock_addr, candidate):
+        if key is not None:
+            index.setdefault(key, OrderedDict())[sock_addr] = candidate
+
+    @staticmethod
+    def _remove_from_index(index, key, sock_addr):
+        if key is not None:
+            candidates = index.get(key)
+            if candidates is not None:
+                candidates.pop(sock_addr, None)
+                if not candidates:
+                    del index[key]
+
+    @staticmethod
+    def _index_keys(candidate):
+        if isinstance(candidate, WalkCandidate):
+            wan_lan = (candidate.wan_address[0], candidate.lan_address)
+        else:
+            wan_lan = None
+        return wan_lan, candidate.get_member()
+
+    def _index(self, sock_addr, candidate):
+        self._add_to_index(self._by_host, sock_addr[0], sock_addr, candidate)
+        wan_lan, member = self._indexed[sock_addr] = self._index_keys(candidate)
+        self._add_to_index(self._by_wan_lan, wan_lan, sock_addr, candidate)
+        self._add_to_index(self._by_member, member, sock_addr, candidate)
+        if isinstance(candidate, WalkCandidate):
+            candidate._registry = self
+            self._categorize(sock_addr, candidate)
+
+    def _unindex(self, sock_addr, candidate):
+        self._remove_from_index(self._by_host, sock_addr[0], sock_addr)
+        wan_lan, member = self._indexed.pop(sock_addr)
+        self._remove_from_index(self._by_wan_lan, wan_lan, sock_addr)
+        self._remove_from_index(self._by_member, member, sock_addr)
+        if sock_addr in self._categorized:
+            category, _ = self._categorized.pop(sock_addr)
+            del self._by_category[category][sock_addr]
+        if isinstance(candidate, WalkCandidate) and candidate._registry is self:
+            candidate._registry = None
+
+    def _categorize(self, sock_addr, candidate):
+        category, expiry = candidate.get_category_expiry(self._categorized_at)
+        previous = self._categorized.get(sock_addr)
+        if previous is not None:
+            if previous == (category, expiry):
+                return
+            if previous[0] != category:
+                del self._by_category[previous[0]][sock_addr]
+
+        self._categorized[sock_addr] = (category, expiry)
+        self._by_category[category][sock_addr] = candidate
+        if expiry is not None:
+            heappush(self._expiries, (expiry, sock_addr))
+
+            # every update pushes a new entry, drop the outdated ones once they outnumber the valid ones
+            if len(self._expiries) > 2 * len(self._categorized) + 64:
+                self._expiries = [(expiry, sock_addr) for sock_addr, (_, expiry) in self._categorized.iteritems()
+                                  if expiry is not None]
+                heapify(self._expiries)
+
+    def _advance(self, now):
+        """
+        Moves the candidates whose category expired at NOW to their new category.
+
+        Returns False when NOW is before the time the categories are valid at, the categories can not be used in that
+        case.
+        """
+        assert isinstance(now, float), type(now)
+        if now < self._categorized_at:
+            return False
+
+        self._categorized_at = now
+        while self._expiries and self._expiries[0][0] <= now:
+            expiry, sock_addr = heappop(self._expiries)
+            categorized = self._categorized.get(sock_addr)
+            if categorized is not None and categorized[1] == expiry:
+                self._categorize(sock_addr, self[sock_addr])
+        return True
+
+    def __setitem__(self, sock_addr, candidate):
+        if sock_addr in self:
+            self._unindex(sock_addr, self[sock_addr])
+        super(CandidateRegistry, self).__setitem__(sock_addr, candidate)
+        self._index(sock_addr, candidate)
+
+    def __delitem__(self, sock_addr):
+        candidate = self[sock_addr]
+        super(CandidateRegistry, self).__delitem__(sock_addr)
+        self._unindex(sock_addr, candidate)
+
+    def clear(self):
+        for candidate in self.itervalues():
+            if isinstance(candidate, WalkCandidate) and candidate._registry is self:
+                candidate._registry = None
+        super(CandidateRegistry, self).clear()
+        self._by_host.clear()
+        self._by_wan_lan.clear()
+        self._by_member.clear()
+        self._indexed.clear()
+        for candidates in self._by_category.itervalues():
+            candidates.clear()
+        self._categorized.clear()
+        self._expiries = []
+
+    def reindex(self, candidate):
+        """
+        Updates the indexes after the addresses or the associated member of CANDIDATE changed.
+        """
+        sock_addr = candidate.sock_addr
+        if self.get(sock_addr) is not candidate:
+            return
+
+        old_wan_lan, old_member = self._indexed[sock_addr]
+        new_wan_lan, new_member = self._indexed[sock_addr] = self._index_keys(candidate)
+        if old_wan_lan != new_wan_lan:
+            self._remove_from_index(self._by_wan_lan, old_wan_lan, sock_addr)
+            self._add_to_index(self._by_wan_lan, new_wan_lan, sock_addr, candidate)
+        if old_member is not new_member:
+            self._remove_from_index(self._by_member, old_member, sock_addr)
+            self._add_to_index(self._by_member, new_member, sock_addr, candidate)
+
+    def recategorize(self, candidate):
+        """
+        Updates the category of CANDIDATE after its walk, stumble, intro, or discovered time changed.
+        """
+        sock_addr = candidate.sock_addr
+        if self.get(sock_addr) is candidate:
+            self._categorize(sock_addr, candidate)
+
+    def get_by_host(self, host):
+        """
+        Returns the candidates whose sock_addr has HOST, in the order they were added.
+        """
+        candidates = self._by_host.get(host)
+        return candidates.values() if candidates else []
+
+    def get_by_wan_lan(self, wan_host, lan_address):
+        """
+        Returns the candidates with WAN_HOST as their WAN host and LAN_ADDRESS as their LAN address.
+        """
+        candidates = self._by_wan_lan.get((wan_host, lan_address))
+        return candidates.values() if candidates else []
+
+    def get_by_member(self, member):
+        """
+        Returns the candidates that are associated with MEMBER.
+        """
+        candidates = self._by_member.get(member)
+        return candidates.values() if candidates else []
+
+    def get_by_category(self, category, now):
+        """
+        Returns the candidates for which candidate.get_category(NOW) returns CATEGORY.
+        """
+        if self._advance(now):
+            return self._by_category[category].values()
+        return [candidate for candidate in self.itervalues() if candidate.get_category(now) == category]
+
+    def get_category(self, candidate, now):
+        """
+        Returns the same as candidate.get_category(NOW), without recomputing it when CANDIDATE is in the registry.
+        """
+        if self._advance(now):
+            categorized = self._categorized.get(candidate.sock_addr)
+            if categorized is not None and self.get(candidate.sock_addr) is candidate:
+                return categorized[0]
+        return candidate.get_category(now)
+
+
 class LoopbackCandidate(Candidate):
+    __slots__ = ()
     __loopback_sock_addr = ("localhost", 0)
 
     def __init__(self):
@@ -8,22 +8,24 @@ Community instance.
 @contact: dispersy@frayja.com
 """
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict, OrderedDict
-from itertools import islice, groupby
+from collections import defaultdict
+from heapq import heappush, heappop
+from itertools import islice, groupby, count
 import logging
 from math import ceil
 from random import random, Random, randint, shuffle, uniform
 from time import time
 
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import Deferred, inlineCallbacks, maybeDeferred
 from twisted.internet.task import LoopingCall, deferLater
 from twisted.python.threadable import isInIOThread
 
 from .authentication import NoAuthentication, MemberAuthentication, DoubleMemberAuthentication
 from .bloomfilter import BloomFilter
-from .candidate import Candidate, WalkCandidate
+from .candidate import Candidate, CandidateRegistry, WalkCandidate
 from .conversion import BinaryConversion, DefaultConversion, Conversion
+from .database import get_in_placeholders
 from .destination import CommunityDestination, CandidateDestination
 from .distribution import (SyncDistribution, GlobalTimePruning, LastSyncDistribution, DirectDistribution,
                            FullSyncDistribution)
@@ -38,6 +40,7 @@ from .payload import (AuthorizePayload, RevokePayload, UndoPayload, DestroyCommu
 from .requestcache import RequestCache, SignatureRequestCache, IntroductionRequestCache
 from .resolution import PublicResolution, LinearResolution, DynamicResolution
 from .statistics import CommunityStatistics
+from .syncfilter import SyncFilterManager
 from .taskmanager import TaskManager
 from .timeline import Timeline
 from .util import runtime_duration_warning, attach_runtime_statistics, deprecated, is_valid_address
@@ -49,11 +52,98 @@ FAST_WALKER_MAX_NEW_ELIGIBLE_CANDIDATES = 10
 FAST_WALKER_STEPS = 15
 FAST_WALKER_STEP_INTERVAL = 2.0
 PERIODIC_CLEANUP_INTERVAL = 5.0
+
+# the maximum number of packets that are pruned from the sync table at once
+PRUNE_CHUNK_SIZE = 1000
 TAKE_STEP_INTERVAL = 5
 
 logger = logging.getLogger(__name__)
 
 
+_bloomfilter_sub_selects = {
+    u"ASC": u"""
+ SELECT * FROM
+  (SELECT sync.packet, sync.id FROM sync
+   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
+   ORDER BY sync.global_time ASC)""",
+    u"DESC": u"""
+ SELECT * FROM
+  (SELECT sync.packet, sync.id FROM sync
+   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
+   ORDER BY sync.global_time DESC)""",
+    u"RANDOM": u"""
+ SELECT * FROM
+  (SELECT sync.packet, sync.id FROM sync
+   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
+   ORDER BY RANDOM())"""}
+
+# (direction, ...):statement pairs, communities whose syncable messages have the same directions share the statement
+_bloomfilter_statements = {}
+
+
+def _get_bloomfilter_statement(directions):
+    """
+    Returns the multi-part SQL statement that selects the packets for syncable messages with DIRECTIONS.
+
+    The statement only depends on DIRECTIONS, the meta messages are given as arguments.  Hence it is built once and
+    its compiled form is reused for every Bloomfilter request.
+    """
+    sql = _bloomfilter_statements.get(directions)
+    if sql is None:
+        for direction in directions:
+            if not direction in _bloomfilter_sub_selects:
+                raise RuntimeError("Unknown synchronization_direction [%s]" % direction)
+        sql = _bloomfilter_statements[directions] = "".join(
+            (u"SELECT * FROM (", " UNION ALL ".join(_bloomfilter_sub_selects[direction] for direction in directions), ")"))
+    return sql
+
+
+def _select_missing_packets(execute, sql, sql_arguments, bloom_filter, byte_limit, get_digests=None):
+    """
+    Returns the packets selected by SQL that are not in BLOOM_FILTER, up to BYTE_LIMIT bytes.
+
+    Runs on a DatabaseExecutor reader thread, unless GET_DIGESTS is given.  GET_DIGESTS provides the cached digests in
+    u"digest" mode and may only be used on the reactor thread.
+    """
+    rows = ((str(packet), packet_id) for packet, packet_id in execute(sql, sql_arguments))
+    if bloom_filter.mode == u"digest" and get_digests:
+        missing = (packet for _, packet in bloom_filter.not_filter_digests(get_digests(rows)))
+    else:
+        missing = (packet for packet, _ in bloom_filter.not_filter(rows))
+
+    packets = []
+    for packet in missing:
+        packets.append(packet)
+        byte_limit -= len(packet)
+        if byte_limit <= 0:
+            logger.debug("bandwidth throttle")
+            break
+    return packets
+
+
+def _select_sequence_packets(execute, ranges, byte_limit):
+    """
+    Returns the packets for the (member_id, message_id, sequence_low, sequence_high) tuples in RANGES, up to
+    BYTE_LIMIT bytes.
+
+    Runs on a DatabaseExecutor reader thread.
+    """
+    packets = []
+    for member_id, message_id, range_min, range_max in ranges:
+        for packet, in execute(u"SELECT packet FROM sync "
+                               u"WHERE member = ? AND meta_message = ? AND sequence BETWEEN ? AND ? "
+                               u"ORDER BY sequence",
+                               (member_id, message_id, range_min, range_max)):
+            packet = str(packet)
+            packets.append(packet)
+
+            byte_limit -= len(packet)
+            if byte_limit <= 0:
+                logger.debug("Bandwidth throttle.  byte_limit:%d", byte_limit)
+                return packets
+    return packets
+
+
 class SyncCache(object):
 
     def __init__(self, time_low, time_high, modulo, offset, bloom_filter):
@@ -266,7 +356,7 @@ class Community(TaskManager):
         self._my_member = my_member
 
         self._global_time = 0
-        self._candidates = OrderedDict()
+        self._candidates = CandidateRegistry()
 
         self._statistics = CommunityStatistics(self)
 
@@ -275,19 +365,38 @@ class Community(TaskManager):
         # batch caching incoming packets
         self._batch_cache = {}
 
+        # mid:Member pairs, or mid:None for members without a dispersy-identity message, for the batch that is
+        # currently being decoded
+        self._prefetched_members = {}
+
+        # a (keys, stored) tuple with the result of Dispersy._get_stored_sync_packets for the batch that is currently
+        # being processed, where keys are the (member_database_id, global_time) pairs that were selected
+        self._batch_stored_packets = None
+
         # delayed list for incoming packet/messages which are delayed
         self._delayed_key = defaultdict(list)
 
         self._delayed_value = defaultdict(list)
 
+        # the number of keys in _delayed_key per wildcard pattern, i.e. a tuple of booleans telling which fields of
+        # the key are set.  a received message is matched by projecting its key onto each pattern
+        self._delayed_patterns = defaultdict(int)
+
+        # heap with (timestamp, counter, delay) entries, entries for delays that are no longer in _delayed_value are
+        # skipped when popped
+        self._delayed_timeouts = []
+        self._delayed_counter = count()
+
         self.meta_message_cache = {}
         self._meta_messages = {}
 
         self._conversions = []
 
-        self._nrsyncpackets = 0
+        self._sync_filters = SyncFilterManager(self)
 
         self._do_pruning = False
+        # meta message database id: the global time up to which the packets of this meta message have been pruned
+        self._pruned_global_times = {}
 
         self._sync_cache_skip_count = 0
 
@@ -430,6 +539,8 @@ class Community(TaskManager):
         self._do_pruning = any(isinstance(meta.distribution, SyncDistribution) and
                                isinstance(meta.distribution.pruning, GlobalTimePruning)
                                for meta in self._meta_messages.itervalues())
+        if self._do_pruning:
+            self.register_task("periodic pruning", LoopingCall(self.prune_sync_table)).start(PERIODIC_CLEANUP_INTERVAL, now=False)
 
         try:
             # check if we have already created the identity message
@@ -470,6 +581,14 @@ class Community(TaskManager):
         """
         return self._request_cache
 
+    @property
+    def sync_filters(self):
+        """
+        The sync filter manager that keeps track of the syncable packets and their bloom filters.
+        @rtype: SyncFilterManager
+        """
+        return self._sync_filters
+
     @property
     def statistics(self):
         """
@@ -524,8 +643,9 @@ class Community(TaskManager):
                 self._logger.warning("unable to load permissions from database [could not obtain %s]", name)
 
         if mapping:
-            for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync WHERE meta_message IN (" + ", ".join("?" for _ in mapping) + ") ORDER BY global_time, packet",
-                                                                mapping.keys())):
+            placeholders, bindings = get_in_placeholders(mapping.iterkeys())
+            for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync WHERE meta_message IN (" + placeholders + ") ORDER BY global_time, packet",
+                                                                bindings)):
                 message = self._dispersy.convert_packet_to_message(str(packet), self, verify=False)
                 if message:
                     self._logger.debug("processing %s", message.name)
@@ -669,6 +789,18 @@ class Community(TaskManager):
     def dispersy_sync_bloom_filter_strategy(self):
         return self._dispersy_claim_sync_bloom_filter_largest
 
+    @property
+    def dispersy_sync_bloom_filter_mode(self):
+        """
+        How the bit positions of the packets in our sync bloom filters are derived, either u"plain" or u"digest".
+
+        Peers running an older version ignore the mode, they will only understand our bloom filters when u"plain" is
+        used.  Hence u"digest" should only be used by communities where all peers understand it, for instance when
+        introducing a new community version.
+        @rtype: unicode
+        """
+        return u"plain"
+
     @property
     def dispersy_sync_skip_enable(self):
         return True  # _sync_skip_
@@ -726,7 +858,7 @@ class Community(TaskManager):
 
                     self._logger.debug("%s reuse #%d (packets received: %d; %s)",
                                        self._cid.encode("HEX"), cache.times_used, cache.responses_received,
-                                       hex(cache.bloom_filter._filter))
+                                       cache.bloom_filter.bytes.encode("HEX"))
                     return cache.time_low, cache.time_high, cache.modulo, cache.offset, cache.bloom_filter
 
             elif self._sync_cache.times_used == 0:
@@ -745,6 +877,10 @@ class Community(TaskManager):
                 self._sync_cache = None
                 return None
 
+        if self._do_pruning:
+            # the pruned packets that prune_sync_table did not remove yet must not be claimed
+            self._sync_filters.prune(self._get_pruned_global_times())
+
         sync = self.dispersy_sync_bloom_filter_strategy(request_cache)
         if sync:
             self._sync_cache = SyncCache(*sync)
@@ -764,13 +900,13 @@ class Community(TaskManager):
         if __debug__:
             t1 = time()
 
-        syncable_messages = u", ".join(unicode(meta.database_id) for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
-        if syncable_messages:
+        syncable_meta_ids = [meta.database_id for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32]
+        if syncable_meta_ids:
             if __debug__:
                 t2 = time()
 
             acceptable_global_time = self.acceptable_global_time
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+            bloom = self._sync_filters.create_bloom_filter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, self.dispersy_sync_bloom_filter_mode)
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
             desired_mean = self.global_time / 2.0
@@ -779,14 +915,14 @@ class Community(TaskManager):
             if from_gbtime < 1:
                 from_gbtime = int(self._random.random() * self.global_time)
 
-            if from_gbtime > 1 and self._nrsyncpackets >= capacity:
+            if from_gbtime > 1 and len(self._sync_filters) >= capacity:
                 # use from_gbtime -1/+1 to include from_gbtime
-                right, rightdata = self._select_bloomfilter_range(request_cache, syncable_messages, from_gbtime - 1, capacity, True)
+                right, rightdata = self._select_bloomfilter_range(request_cache, from_gbtime - 1, capacity, True)
 
                 # if right did not get to capacity, then we have less than capacity items in the database
                 # skip left
                 if right[2] == capacity:
-                    left, leftdata = self._select_bloomfilter_range(request_cache, syncable_messages, from_gbtime + 1, capacity, False)
+                    left, leftdata = self._select_bloomfilter_range(request_cache, from_gbtime + 1, capacity, False)
                     left_range = (left[1] or self.global_time) - left[0]
                     right_range = (right[1] or self.global_time) - right[0]
 
@@ -809,25 +945,26 @@ class Community(TaskManager):
 
                 bloomfilter_range = [1, acceptable_global_time]
 
-                data, fixed = self._select_and_fix(request_cache, syncable_messages, 0, capacity, True)
+                data, fixed = self._select_and_fix(request_cache, 0, capacity, True)
                 if len(data) > 0 and fixed:
-                    bloomfilter_range[1] = data[-1][0]
-                    self._nrsyncpackets = capacity + 1
+                    bloomfilter_range[1] = data[-1]
 
             if __debug__:
                 t4 = time()
 
             if len(data) > 0:
-                bloom.add_keys(str(packet) for _, packet in data)
+                time_low = min(bloomfilter_range[0], acceptable_global_time)
+                time_high = min(bloomfilter_range[1], acceptable_global_time)
+                self._sync_filters.fill(bloom, time_low, time_high)
 
                 if __debug__:
                     self._logger.debug("%s syncing %d-%d, nr_packets = %d, capacity = %d, packets %d-%d, pivot = %d",
                                  self.cid.encode("HEX"), bloomfilter_range[0], bloomfilter_range[1],
-                                 len(data), capacity, data[0][0], data[-1][0], from_gbtime)
+                                 len(data), capacity, data[0], data[-1], from_gbtime)
                     self._logger.debug("%s took %f (fakejoin %f, rangeselect %f, dataselect %f, bloomfill, %f",
                                  self.cid.encode("HEX"), time() - t1, t2 - t1, t3 - t2, t4 - t3, time() - t4)
 
-                return (min(bloomfilter_range[0], acceptable_global_time), min(bloomfilter_range[1], acceptable_global_time), 1, 0, bloom)
+                return (time_low, time_high, 1, 0, bloom)
 
             if __debug__:
                 self._logger.debug("%s no messages to sync", self.cid.encode("HEX"))
@@ -836,8 +973,8 @@ class Community(TaskManager):
             self._logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
         return (1, acceptable_global_time, 1, 0, BloomFilter(8, 0.1, prefix='\x00'))
 
-    def _select_bloomfilter_range(self, request_cache, syncable_messages, global_time, to_select, higher=True):
-        data, fixed = self._select_and_fix(request_cache, syncable_messages, global_time, to_select, higher)
+    def _select_bloomfilter_range(self, request_cache, global_time, to_select, higher=True):
+        data, fixed = self._select_and_fix(request_cache, global_time, to_select, higher)
 
         lowerfixed = True
         higherfixed = True
@@ -848,13 +985,13 @@ class Community(TaskManager):
             to_select = to_select - len(data)
             if to_select > 25:
                 if higher:
-                    lowerdata, lowerfixed = self._select_and_fix(request_cache, syncable_messages, global_time + 1, to_select, False)
+                    lowerdata, lowerfixed = self._select_and_fix(request_cache, global_time + 1, to_select, False)
                     data = lowerdata + data
                 else:
-                    higherdata, higherfixed = self._select_and_fix(request_cache, syncable_messages, global_time - 1, to_select, True)
+                    higherdata, higherfixed = self._select_and_fix(request_cache, global_time - 1, to_select, True)
                     data = data + higherdata
 
-        bloomfilter_range = [data[0][0], data[-1][0], len(data)]
+        bloomfilter_range = [data[0], data[-1], len(data)]
         # we can use the global_time as a min or max value for lower and upper bound
         if higher:
             # we selected items higher than global_time, make sure bloomfilter_range[0] is at least as low a global_time + 1
@@ -878,23 +1015,17 @@ class Community(TaskManager):
 
         return bloomfilter_range, data
 
-    def _select_and_fix(self, request_cache, syncable_messages, global_time, to_select, higher=True):
-        assert isinstance(syncable_messages, unicode)
-        if higher:
-            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time > ? ORDER BY global_time ASC LIMIT ?" % (syncable_messages),
-                       (global_time, to_select + 1)))
-        else:
-            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time < ? ORDER BY global_time DESC LIMIT ?" % (syncable_messages),
-                       (global_time, to_select + 1)))
+    def _select_and_fix(self, request_cache, global_time, to_select, higher=True):
+        data = self._sync_filters.select(global_time, to_select + 1, higher)
 
         fixed = False
         if len(data) > to_select:
             fixed = True
 
             # if last 2 packets are equal, then we need to drop those
-            global_time = data[-1][0]
+            global_time = data[-1]
             del data[-1]
-            while data and data[-1][0] == global_time:
+            while data and data[-1] == global_time:
                 del data[-1]
 
         if not higher:
@@ -906,27 +1037,28 @@ class Community(TaskManager):
     @runtime_duration_warning(0.5)
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
     def _dispersy_claim_sync_bloom_filter_modulo(self, request_cache):
-        syncable_messages = u", ".join(unicode(meta.database_id) for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
-        if syncable_messages:
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+        syncable_meta_ids = [meta.database_id for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32]
+        if syncable_meta_ids:
+            acceptable_global_time = self.acceptable_global_time
+            bloom = self._sync_filters.create_bloom_filter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, self.dispersy_sync_bloom_filter_mode)
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
-            self._nrsyncpackets = list(self._dispersy.database.execute(u"SELECT count(*) FROM sync WHERE meta_message IN (%s) AND undone = 0 LIMIT 1" % (syncable_messages)))[0][0]
-            modulo = int(ceil(self._nrsyncpackets / float(capacity)))
+            nrsyncpackets = len(self._sync_filters)
+            modulo = int(ceil(nrsyncpackets / float(capacity)))
             if modulo > 1:
                 offset = randint(0, modulo - 1)
-                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0 AND (sync.global_time + ?) %% ? = 0" % syncable_messages, (offset, modulo)))
+                placeholders, bindings = get_in_placeholders(syncable_meta_ids)
+                # the sync filters no longer contain the pruned packets that are still in the database
+                bloom.add_keys(str(packet) for packet, packet_id in self._dispersy.database.execute(u"SELECT sync.packet, sync.id FROM sync WHERE meta_message IN (%s) AND sync.undone = 0 AND (sync.global_time + ?) %% ? = 0" % placeholders, bindings + [offset, modulo]) if packet_id in self._sync_filters)
             else:
                 offset = 0
                 modulo = 1
-                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0" % syncable_messages))
-
-            bloom.add_keys(packets)
+                self._sync_filters.fill(bloom, 1, acceptable_global_time)
 
             self._logger.debug("%s syncing %d-%d, nr_packets = %d, capacity = %d, totalnr = %d",
-                         self.cid.encode("HEX"), modulo, offset, self._nrsyncpackets, capacity, self._nrsyncpackets)
+                         self.cid.encode("HEX"), modulo, offset, nrsyncpackets, capacity, nrsyncpackets)
 
-            return (1, self.acceptable_global_time, modulo, offset, bloom)
+            return (1, acceptable_global_time, modulo, offset, bloom)
 
         else:
             self._logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
@@ -1064,6 +1196,7 @@ class Community(TaskManager):
 
         self.purge_batch_cache()
 
+        self._dispersy.walk_scheduler.stop_walking(self)
         self.cancel_all_pending_tasks()
 
         self._request_cache.clear()
@@ -1087,13 +1220,56 @@ class Community(TaskManager):
             self._logger.debug("updating global time %d -> %d", self._global_time, global_time)
             self._global_time = global_time
 
-            if self._do_pruning:
-                # Check for messages that need to be pruned because the global time changed.
-                for meta in self._meta_messages.itervalues():
-                    if isinstance(meta.distribution, SyncDistribution) and isinstance(meta.distribution.pruning, GlobalTimePruning):
-                         self._dispersy.database.execute(
-                            u"DELETE FROM sync WHERE meta_message = ? AND global_time <= ?",
-                            (meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold))
+            # packets that become pruned because the global time changed are removed by prune_sync_table
+
+    def prune_sync_table(self, limit=PRUNE_CHUNK_SIZE):
+        """
+        Removes at most LIMIT packets that have been pruned from the sync table.
+
+        Packets become pruned when the global time increases.  Instead of removing them immediately, this method is
+        called periodically and removes them in chunks.  Until then, pruned packets are not offered to other peers
+        because _get_packets_for_bloomfilters only selects packets above the prune threshold, on_missing_message skips
+        them, and they are removed from the sync filters before a sync bloom filter is claimed.
+
+        Returns True when all pruned packets have been removed.
+        """
+        if not self._do_pruning:
+            return True
+
+        execute = self._dispersy.database.execute
+        for meta in self._meta_messages.itervalues():
+            if isinstance(meta.distribution, SyncDistribution) and isinstance(meta.distribution.pruning, GlobalTimePruning):
+                global_time = self._global_time - meta.distribution.pruning.prune_threshold
+                if self._pruned_global_times.get(meta.database_id, -1) >= global_time:
+                    continue
+
+                rows = list(execute(u"SELECT id, global_time, member FROM sync WHERE meta_message = ? AND global_time <= ? LIMIT ?",
+                                    (meta.database_id, global_time, limit)))
+                items = [row[:2] for row in rows]
+                if items:
+                    self._logger.debug("pruning %d %s packets", len(items), meta.name)
+                    self._sync_filters.remove(items, set((member, meta.database_id) for _, _, member in rows))
+                    self._dispersy.database.executemany(u"DELETE FROM sync WHERE id = ?",
+                                                        [(packet_id,) for packet_id, _ in items])
+                    self._statistics.increase_msg_count(u"pruned", meta.name, len(items))
+
+                if len(items) < limit:
+                    self._pruned_global_times[meta.database_id] = global_time
+                limit -= len(items)
+                if limit <= 0:
+                    return False
+
+        return True
+
+    def _get_pruned_global_times(self):
+        """
+        Returns meta message database id: global time pairs, the packets of these meta messages with a global time
+        lower or equal to this global time are pruned.
+        @rtype: dict
+        """
+        return dict((meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold)
+                    for meta in self._meta_messages.itervalues()
+                    if isinstance(meta.distribution, SyncDistribution) and isinstance(meta.distribution.pruning, GlobalTimePruning))
 
     def dispersy_check_database(self):
         """
@@ -1164,10 +1340,9 @@ class Community(TaskManager):
 
         def switch_to_normal_walking():
             """
-            Start walking towards eligible candidates regularly, stopping the fast walker if it's still running.
+            Start walking towards eligible candidates regularly, replacing the fast walker if it's still running.
             """
-            self.cancel_pending_task("take fast steps")
-            self.register_task("take step", LoopingCall(self.take_step)).start(TAKE_STEP_INTERVAL, now=True)
+            self._dispersy.walk_scheduler.start_walking(self, self.take_step, TAKE_STEP_INTERVAL)
 
         def take_fast_steps():
             """
@@ -1198,11 +1373,10 @@ class Community(TaskManager):
                 if self._fast_steps_taken >= FAST_WALKER_STEPS:
                     switch_to_normal_walking()
 
+        # the steps of all communities are taken by the walk scheduler of Dispersy
         if self.dispersy_enable_fast_candidate_walker:
             self._fast_steps_taken = 0
-            self.register_task("take fast steps",
-                               LoopingCall(take_fast_steps)
-            ).start(FAST_WALKER_STEP_INTERVAL, now=True)
+            self._dispersy.walk_scheduler.start_walking(self, take_fast_steps, FAST_WALKER_STEP_INTERVAL)
         else:
             switch_to_normal_walking()
 
@@ -1224,62 +1398,32 @@ class Community(TaskManager):
         # strict=True will ensure both candidate.lan_address and candidate.wan_address are not
         # 0.0.0.0:0
         while True:
-            index = 0
             has_result = False
-            keys = self._candidates.keys()
 
-            while index < len(keys):
-                now = time()
-                key = keys[index]
-                candidate = self._candidates.get(key)
-
-                if (candidate and
-                    candidate.get_category(now) == category and
+            # candidates that are added while iterating are yielded in the next round
+            for candidate in self._candidates.values():
+                if (self._candidates.get(candidate.sock_addr) is candidate and
+                    self._candidates.get_category(candidate, time()) == category and
                         not (strict and (candidate.lan_address == ("0.0.0.0", 0) or candidate.wan_address == ("0.0.0.0", 0)))):
 
                     yield candidate
                     has_result = True
 
-                    keys = self._candidates.keys()
-                    try:
-                        if keys[index] != key:
-                            # a key has been removed from self._candidates
-                            index = keys.index(key)
-                    except (IndexError, ValueError):
-                        index -= 1
-
-                index += 1
-
             if not has_result:
                 yield None
 
     def _iter_categories(self, categories, once=False):
         while True:
-            index = 0
             has_result = False
-            keys = self._candidates.keys()
 
-            while index < len(keys):
-                now = time()
-                key = keys[index]
-                candidate = self._candidates.get(key)
-
-                if (candidate and
-                        candidate.get_category(now) in categories):
+            # candidates that are added while iterating are yielded in the next round
+            for candidate in self._candidates.values():
+                if (self._candidates.get(candidate.sock_addr) is candidate and
+                        self._candidates.get_category(candidate, time()) in categories):
 
                     yield candidate
                     has_result = True
 
-                    keys = self._candidates.keys()
-                    try:
-                        if keys[index] != key:
-                            # a key has been removed from self._candidates
-                            index = keys.index(key)
-                    except (IndexError, ValueError):
-                        index -= 1
-
-                index += 1
-
             if once:
                 break
             elif not has_result:
@@ -1293,7 +1437,8 @@ class Community(TaskManager):
         returned only once each.
         """
         now = time()
-        candidates = [candidate for candidate in self._candidates.itervalues() if candidate.get_category(now) in (u"walk", u"stumble", u"intro")]
+        candidates = [candidate for category in (u"walk", u"stumble", u"intro")
+                      for candidate in self._candidates.get_by_category(category, now)]
         shuffle(candidates)
         return iter(candidates)
 
@@ -1305,7 +1450,8 @@ class Community(TaskManager):
         once each.
         """
         now = time()
-        candidates = [candidate for candidate in self._candidates.itervalues() if candidate.get_category(now) in (u"walk", u"stumble")]
+        candidates = [candidate for category in (u"walk", u"stumble")
+                      for candidate in self._candidates.get_by_category(category, now)]
         shuffle(candidates)
         return iter(candidates)
 
@@ -1379,21 +1525,15 @@ class Community(TaskManager):
         categories = [(maxsize, None), (maxsize, None), (maxsize, None), (maxsize, None)]
         category_sizes = [0, 0, 0, 0]
 
-        for candidate in self._candidates.itervalues():
-            if candidate.is_eligible_for_walk(now):
-                category = candidate.get_category(now)
-                if category == u"walk":
-                    categories[0] = min(categories[0], (candidate.last_walk, candidate))
-                    category_sizes[0] += 1
-                elif category == u"stumble":
-                    categories[1] = min(categories[1], (candidate.last_stumble, candidate))
-                    category_sizes[1] += 1
-                elif category == u"intro":
-                    categories[2] = min(categories[2], (candidate.last_intro, candidate))
-                    category_sizes[2] += 1
-                elif category == u"discovered":
-                    categories[3] = min(categories[3], (candidate.last_discovered, candidate))
-                    category_sizes[3] += 1
+        # the categories are maintained by the candidate registry, only the eligibility is checked here
+        for index, (category, attribute) in enumerate(((u"walk", "last_walk"),
+                                                       (u"stumble", "last_stumble"),
+                                                       (u"intro", "last_intro"),
+                                                       (u"discovered", "last_discovered"))):
+            for candidate in self._candidates.get_by_category(category, now):
+                if candidate.is_eligible_for_walk(now):
+                    categories[index] = min(categories[index], (getattr(candidate, attribute), candidate))
+                    category_sizes[index] += 1
 
         walk, stumble, intro, discovered = [candidate for _, candidate in categories]
 
@@ -1444,7 +1584,7 @@ class Community(TaskManager):
         candidate = self._candidates.get(sock_addr)
         if candidate is None:
             # find matching candidate with the same host but a different port (symmetric NAT)
-            for candidate in self._candidates.itervalues():
+            for candidate in self._candidates.get_by_host(sock_addr[0]):
                 if (candidate.connection_type == "symmetric-NAT" and
                     candidate.sock_addr[0] == sock_addr[0] and
                         candidate.lan_address in (("0.0.0.0", 0), lan_address)):
@@ -1521,7 +1661,7 @@ class Community(TaskManager):
     def get_candidate_mid(self, mid):
         member = self._dispersy.get_member(mid=mid)
         if member:
-            for candidate in self._candidates.itervalues():
+            for candidate in self._candidates.get_by_member(member):
                 if candidate.is_associated(member):
                     return candidate
 
@@ -1537,11 +1677,7 @@ class Community(TaskManager):
         lan_address = candidate.lan_address
 
         # find existing candidates that are likely to be the same candidate
-        others = [other
-                  for other
-                  in self._candidates.itervalues()
-                  if (other.wan_address[0] == wan_address[0] and
-                      other.lan_address == lan_address)]
+        others = self._candidates.get_by_wan_lan(wan_address[0], lan_address)
 
         if others:
             # merge and remove existing candidates in favor of the new CANDIDATE
@@ -1565,7 +1701,7 @@ class Community(TaskManager):
         Returns the number of candidates that were removed.
         """
         now = time()
-        obsolete_candidates = [(key, candidate) for key, candidate in self._candidates.iteritems() if candidate.get_category(now) is None]
+        obsolete_candidates = [(candidate.sock_addr, candidate) for candidate in self._candidates.get_by_category(None, now)]
         for key, candidate in obsolete_candidates:
             self._logger.debug("removing obsolete candidate %s", candidate)
             del self._candidates[key]
@@ -1846,6 +1982,9 @@ class Community(TaskManager):
         assert not public_key or self._dispersy.crypto.is_valid_public_bin(public_key)
         assert not private_key or self._dispersy.crypto.is_valid_private_bin(private_key)
 
+        if mid in self._prefetched_members:
+            return self._prefetched_members[mid]
+
         member = self._dispersy.get_member(mid=mid, public_key=public_key, private_key=private_key)
         # We only need to check if this member has an identity message in this community if we still don't have the full
         # public key
@@ -1915,6 +2054,11 @@ class Community(TaskManager):
             if (unwrapped_key not in self._delayed_key) and (delay not in self._delayed_value):
                 send_request = True
 
+            if unwrapped_key not in self._delayed_key:
+                self._delayed_patterns[tuple(k is not None for k in unwrapped_key)] += 1
+            if delay not in self._delayed_value:
+                heappush(self._delayed_timeouts, (delay.timestamp, next(self._delayed_counter), delay))
+
             self._delayed_key[unwrapped_key].append(delay)
             self._delayed_value[delay].append(unwrapped_key)
 
@@ -1944,8 +2088,10 @@ class Community(TaskManager):
         new_messages = defaultdict(set)
         new_packets = set()
         for received_key in received_keys:
-            for key in self._delayed_key.keys():
-                if all(k is None or k == rk for k, rk in zip(key, received_key)):
+            for pattern in self._delayed_patterns.keys():
+                key = tuple(rk if is_set else None for rk, is_set in zip(received_key, pattern))
+                if key in self._delayed_key:
+                    self._remove_delayed_pattern(key)
                     for delayed in self._delayed_key.pop(key):
                         delayed_keys = self._delayed_value[delayed]
                         delayed_keys.remove(key)
@@ -1974,13 +2120,21 @@ class Community(TaskManager):
             self._delayed_key[key].remove(delayed)
             if len(self._delayed_key[key]) == 0:
                 del self._delayed_key[key]
+                self._remove_delayed_pattern(key)
 
         del self._delayed_value[delayed]
 
+    def _remove_delayed_pattern(self, key):
+        pattern = tuple(k is not None for k in key)
+        self._delayed_patterns[pattern] -= 1
+        if self._delayed_patterns[pattern] == 0:
+            del self._delayed_patterns[pattern]
+
     def _periodically_clean_delayed(self):
-        now = time()
-        for delayed in self._delayed_value.keys():
-            if now > delayed.timestamp + 10:
+        deadline = time() - 10
+        while self._delayed_timeouts and self._delayed_timeouts[0][0] < deadline:
+            _, _, delayed = heappop(self._delayed_timeouts)
+            if delayed in self._delayed_value:
                 self._logger.error("DROP PACKET: %d byte packet %s from %s", len(delayed.delayed), "timed out", delayed.candidate)
                 self._remove_delayed(delayed)
                 delayed.on_timeout()
@@ -2062,10 +2216,15 @@ class Community(TaskManager):
 
          1. All duplicate binary packets are removed.
 
-         2. All binary packets are converted into Message.Implementation instances.  Some packets
+         2. The members that the packets refer to are retrieved at once.
+
+         3. All binary packets are converted into Message.Implementation instances.  Some packets
             are dropped or delayed at this stage.
 
-         3. All remaining messages are passed to on_message_batch.
+         4. The signatures of all messages are verified at once.  Messages with an invalid signature
+            are dropped.
+
+         5. All remaining messages are passed to on_message_batch.
         """
         # convert binary packets into Message.Implementation instances
         messages = []
@@ -2075,26 +2234,166 @@ class Community(TaskManager):
         assert all(isinstance(x, tuple) for x in batch)
         assert all(len(x) == 4 for x in batch)
 
-        for candidate, packet, conversion, source in batch:
-            assert isinstance(candidate, Candidate)
-            assert isinstance(packet, str)
-            assert isinstance(conversion, Conversion)
-            try:
-                # convert binary data to internal Message
-                messages.append(conversion.decode_message(candidate, packet, source=source))
+        # resolve the members that the packets refer to before decoding them one by one
+        self._prefetched_members = self._prefetch_members(batch)
+        try:
+            for candidate, packet, conversion, source in batch:
+                assert isinstance(candidate, Candidate)
+                assert isinstance(packet, str)
+                assert isinstance(conversion, Conversion)
+                try:
+                    # convert binary data to internal Message, the signatures are verified below
+                    messages.append(conversion.decode_message(candidate, packet, verify=False, source=source))
 
-            except DropPacket as drop:
-                self._drop(drop, packet, candidate)
+                except DropPacket as drop:
+                    self._drop(drop, packet, candidate)
 
-            except DelayPacket as delay:
-                self._dispersy._delay(delay, packet, candidate)
+                except DelayPacket as delay:
+                    self._dispersy._delay(delay, packet, candidate)
+        finally:
+            self._prefetched_members = {}
 
         assert all(isinstance(message, Message.Implementation) for message in messages), "convert_batch_into_messages must return only Message.Implementation instances"
         assert all(message.meta == meta for message in messages), "All Message.Implementation instances must be in the same batch"
 
-        # handle the incoming messages
+        # verify the signatures of all messages
+        if messages:
+            stored = self._select_stored_packets(messages)
+            result = self._verify_signatures(messages, stored[1])
+            if isinstance(result, Deferred):
+                # the signatures are verified by the worker processes, other batches may be stored in the meantime
+                result.addCallback(self._on_verified_batch, None)
+                result.addErrback(self._log_verification_failure, meta)
+                return result
+            self._on_verified_batch(result, stored)
+
+    def _on_verified_batch(self, messages, stored):
+        """
+        Handle the MESSAGES of a batch whose signatures have been verified.
+
+        STORED is the result of _select_stored_packets for the batch, or None when it must be selected again.
+        """
         if messages:
-            self.on_messages(messages)
+            if stored is None:
+                if self._dispersy._communities.get(self._cid) is not self:
+                    # the community was unloaded while the signatures were verified
+                    return
+                stored = self._select_stored_packets(messages)
+
+            # the distribution check reuses the stored packets that were selected for the signature verification
+            self._batch_stored_packets = stored
+            try:
+                self.on_messages(messages)
+            finally:
+                self._batch_stored_packets = None
+
+    def _log_verification_failure(self, failure, meta):
+        self._logger.error("unable to verify the signatures of a %s batch: %s", meta.name, failure.getTraceback())
+
+    def _prefetch_members(self, batch):
+        """
+        Returns a {mid: member} dictionary for all member identifiers in the packets of BATCH.
+
+        The values are what get_member(mid=mid) would return, i.e. None for members without a dispersy-identity
+        message in this community.  The members and their identities are retrieved using at most a few queries for
+        the whole batch.
+        """
+        mids = set()
+        for _, packet, conversion, _ in batch:
+            mids.update(conversion.decode_member_ids(packet))
+        if not mids:
+            return {}
+
+        members = self._dispersy.get_members(mids)
+
+        # find the members that have a dispersy-identity message that we did not see yet
+        unknown = dict((member.database_id, member) for member in members.itervalues()
+                       if isinstance(member, Member) and not member.has_identity(self))
+        if unknown:
+            meta_message_id = self.get_meta_message(u"dispersy-identity").database_id
+            database_ids = sorted(unknown)
+            for offset in xrange(0, len(database_ids), 256):
+                placeholders, chunk = get_in_placeholders(database_ids[offset:offset + 256])
+                for database_id, in self._dispersy.database.execute(
+                        u"SELECT DISTINCT member FROM sync WHERE meta_message = ? AND member IN (%s)" % placeholders,
+                        [meta_message_id] + chunk):
+                    unknown[database_id].add_identity(self)
+
+        return dict((mid, member if isinstance(member, Member) and member.has_identity(self) else None)
+                    for mid, member in members.iteritems())
+
+    def _verify_signatures(self, messages, stored):
+        """
+        Returns the MESSAGES that are correctly signed, the others are dropped.  A Deferred firing these MESSAGES is
+        returned when the signatures are verified by the worker processes of the SignatureVerifier.
+
+        STORED is the result of Dispersy._get_stored_sync_packets for MESSAGES.  Stored packets have been verified
+        before they were stored, hence binary duplicates do not need to be verified again.
+        """
+        verifier = self._dispersy.signature_verifier
+        stored = set(packet for _, packet, _ in stored.itervalues())
+
+        checks = []
+        ranges = []
+        for message in messages:
+            # a buffer avoids copying the signed part of every packet, the SignatureVerifier makes a str copy only
+            # for checks that are sent to its worker processes
+            payload = buffer(message.packet, 0, len(message.packet) - message.authentication.signature_length)
+            message_checks = message.authentication.get_signature_checks(payload)
+            if message_checks is None:
+                ranges.append(None)
+            elif message.packet in stored or verifier.is_verified(message.packet, message_checks):
+                # exact duplicate of a packet that we verified before
+                ranges.append((len(checks), len(checks)))
+            else:
+                ranges.append((len(checks), len(checks) + len(message_checks)))
+                checks.extend(message_checks)
+
+        def on_verified(results):
+            verified = []
+            for message, check_range in zip(messages, ranges):
+                if check_range is not None and all(results[check_range[0]:check_range[1]]):
+                    if check_range[0] < check_range[1]:
+                        verifier.set_verified(message.packet, checks[check_range[0]:check_range[1]])
+                    verified.append(message)
+                else:
+                    self._drop(DropPacket("Invalid signature"), message.packet, message.candidate)
+            return verified
+
+        results = verifier.verify_async(checks)
+        if isinstance(results, Deferred):
+            return results.addCallback(on_verified)
+        return on_verified(results)
+
+    def _select_stored_packets(self, messages):
+        """
+        Returns a (keys, stored) tuple, where stored is the result of Dispersy._get_stored_sync_packets for MESSAGES
+        and keys are the (member_database_id, global_time) pairs of MESSAGES.  Stored is empty when MESSAGES are not
+        stored in the sync table.
+        """
+        meta = messages[0].meta
+        if not isinstance(meta.distribution, SyncDistribution) or \
+                not isinstance(meta.authentication, (MemberAuthentication, DoubleMemberAuthentication)):
+            return set(), {}
+
+        keys = set((message.authentication.member.database_id, message.distribution.global_time)
+                   for message in messages)
+        return keys, self._dispersy._get_stored_sync_packets(messages)
+
+    def _pop_batch_stored_packets(self, messages):
+        """
+        Returns the stored packets that were selected for the batch that is currently being processed, or None when
+        they do not cover all MESSAGES.  The stored packets are returned at most once, subsequent calls return None.
+        """
+        if self._batch_stored_packets is None:
+            return None
+
+        keys, stored = self._batch_stored_packets
+        self._batch_stored_packets = None
+        if all((message.authentication.member.database_id, message.distribution.global_time) in keys
+               for message in messages):
+            return stored
+        return None
 
     def purge_batch_cache(self):
         """
@@ -2553,23 +2852,22 @@ class Community(TaskManager):
                 messages_with_sync.append((message, time_low, time_high, offset, modulo))
 
         if messages_with_sync:
-            for message, generator in self._get_packets_for_bloomfilters(messages_with_sync, include_inactive=False):
-                payload = message.payload
+            executor = self._dispersy.database_executor
+            for message, time_low, time_high, offset, modulo in messages_with_sync:
+                sql, sql_arguments = self._get_bloomfilter_query(time_low, time_high, offset, modulo, include_inactive=False)
+                bloom_filter = message.payload.bloom_filter
                 # we limit the response by byte_limit bytes
-                byte_limit = self.dispersy_sync_response_limit
-
-                packets = []
-                for packet, in payload.bloom_filter.not_filter(generator):
-                    packets.append(packet)
-                    byte_limit -= len(packet)
-                    if byte_limit <= 0:
-                        self._logger.debug("bandwidth throttle")
-                        break
-
-                if packets:
-                    self._logger.debug("syncing %d packets (%d bytes) to %s",
-                                       len(packets), sum(len(packet) for packet in packets), message.candidate)
-                    self._dispersy._send_packets([message.candidate], packets, self, "-caused by sync-")
+                if bloom_filter.mode == u"digest":
+                    # the cached packet digests may only be used on the reactor thread, hence digest mode filters are
+                    # answered on the reactor thread where most packets need no hashing
+                    deferred = maybeDeferred(_select_missing_packets, self._dispersy.database.execute, sql,
+                                             sql_arguments, bloom_filter, self.dispersy_sync_response_limit,
+                                             self._sync_filters.get_digests)
+                else:
+                    deferred = executor.run_interaction(_select_missing_packets, sql, sql_arguments, bloom_filter,
+                                                        self.dispersy_sync_response_limit)
+                deferred.addCallback(self._send_missing_packets, message.candidate, "-caused by sync-")
+                deferred.addErrback(self._log_database_failure)
 
     def check_introduction_response(self, messages):
         identifiers_seen = {}
@@ -2691,7 +2989,7 @@ class Community(TaskManager):
                     # verify that the bloom filter is correct
                     try:
                         _, packets = self._get_packets_for_bloomfilters([[None, time_low, self.global_time if time_high == 0 else time_high, offset, modulo]], include_inactive=True).next()
-                        packets = [packet for packet, in packets]
+                        packets = [packet for packet, _ in packets]
 
                     except OverflowError:
                         self._logger.error("time_low:  %d", time_low)
@@ -2702,7 +3000,7 @@ class Community(TaskManager):
                         assert False
 
                     # BLOOM_FILTER must be the same after transmission
-                    test_bloom_filter = BloomFilter(bloom_filter.bytes, bloom_filter.functions, prefix=bloom_filter.prefix)
+                    test_bloom_filter = BloomFilter(bloom_filter.bytes, bloom_filter.functions, prefix=bloom_filter.prefix, mode=bloom_filter.mode)
                     assert bloom_filter.bytes == test_bloom_filter.bytes, "problem with the long <-> binary conversion"
                     assert list(bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set before transmission"
                     assert list(test_bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set after transmission"
@@ -2754,38 +3052,28 @@ class Community(TaskManager):
         @param include_inactive: When False only active packets (due to pruning) are returned
         @type include_inactive: bool
 
-        @return: An generator yielding the original request and a generator consisting of the packets matching the request
+        @return: An generator yielding the original request and a generator consisting of (packet, packet_id) tuples
+         for the packets matching the request
         """
 
         assert isinstance(requests, list)
         assert all(isinstance(request, (list, tuple)) for request in requests)
         assert all(len(request) == 5 for request in requests)
 
-        def get_sub_select(meta):
-            direction = meta.distribution.synchronization_direction
-            if direction == u"ASC":
-                return u"""
- SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY sync.global_time ASC)"""
-
-            if direction == u"DESC":
-                return u"""
- SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY sync.global_time DESC)"""
+        for message, time_low, time_high, offset, modulo in requests:
+            sql, sql_arguments = self._get_bloomfilter_query(time_low, time_high, offset, modulo, include_inactive)
+            yield message, ((str(packet), packet_id) for packet, packet_id in self._dispersy._database.execute(sql, sql_arguments))
 
-            if direction == u"RANDOM":
-                return u"""
- SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY RANDOM())"""
+    def _get_bloomfilter_query(self, time_low, time_high, offset, modulo, include_inactive=True):
+        """
+        Return the SQL statement and its arguments that select the (packet, packet_id) rows matching a Bloomfilter
+        request.
 
-            raise RuntimeError("Unknown synchronization_direction [%d]" % direction)
+        @param include_inactive: When False only active packets (due to pruning) are selected
+        @type include_inactive: bool
 
+        @rtype: (unicode, list)
+        """
         # obtain all available messages for this community
         meta_messages = sorted([meta
                                 for meta
@@ -2793,22 +3081,35 @@ class Community(TaskManager):
                                 if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32],
                                key=lambda meta: meta.distribution.priority,
                                reverse=True)
-        # build multi-part SQL statement from meta_messages
-        sql = "".join((u"SELECT * FROM (", " UNION ALL ".join(get_sub_select(meta) for meta in meta_messages), ")"))
+        sql = _get_bloomfilter_statement(tuple(meta.distribution.synchronization_direction for meta in meta_messages))
         self._logger.debug(sql)
 
-        for message, time_low, time_high, offset, modulo in requests:
-            sql_arguments = []
-            for meta in meta_messages:
-                if include_inactive:
-                    _time_low = time_low
-                else:
-                    _time_low = min(max(time_low, self.global_time - meta.distribution.pruning.inactive_threshold + 1), 2 ** 63 - 1) if isinstance(meta.distribution.pruning, GlobalTimePruning) else time_low
+        sql_arguments = []
+        for meta in meta_messages:
+            if not isinstance(meta.distribution.pruning, GlobalTimePruning):
+                _time_low = time_low
+            elif include_inactive:
+                # pruned packets may remain in the database until prune_sync_table removes them
+                _time_low = min(max(time_low, self.global_time - meta.distribution.pruning.prune_threshold + 1), 2 ** 63 - 1)
+            else:
+                _time_low = min(max(time_low, self.global_time - meta.distribution.pruning.inactive_threshold + 1), 2 ** 63 - 1)
 
-                sql_arguments.extend((meta.database_id, _time_low, time_high, offset, modulo))
-            self._logger.debug("%s", sql_arguments)
+            sql_arguments.extend((meta.database_id, _time_low, time_high, offset, modulo))
+        self._logger.debug("%s", sql_arguments)
 
-            yield message, ((str(packet),) for packet, in self._dispersy._database.execute(sql, sql_arguments))
+        return sql, sql_arguments
+
+    def _send_missing_packets(self, packets, candidate, msg_type):
+        """
+        Send PACKETS, selected by the DatabaseExecutor, to CANDIDATE.
+        """
+        if packets and self._dispersy.has_community(self._cid):
+            self._logger.debug("syncing %d packets (%d bytes) to %s",
+                               len(packets), sum(len(packet) for packet in packets), candidate)
+            self._dispersy._send_packets([candidate], packets, self, msg_type)
+
+    def _log_database_failure(self, failure):
+        self._logger.error("unable to answer from the database: %s", failure.getTraceback())
 
     def check_puncture_request(self, messages):
         for message in messages:
@@ -2896,6 +3197,9 @@ class Community(TaskManager):
         self._dispersy._forward([request])
 
     def on_missing_message(self, messages):
+        # pruned packets may remain in the database until prune_sync_table removes them
+        pruned_global_times = self._get_pruned_global_times() if self._do_pruning else {}
+
         for message in messages:
 
             responses = []
@@ -2903,9 +3207,10 @@ class Community(TaskManager):
             member_database_id = message.payload.member.database_id
             for global_time in message.payload.global_times:
                 try:
-                    packet, = self._dispersy._database.execute(u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ?",
-                                                              (self.database_id, member_database_id, global_time)).next()
-                    responses.append(str(packet))
+                    packet, meta_message_id = self._dispersy._database.execute(u"SELECT packet, meta_message FROM sync WHERE community = ? AND member = ? AND global_time = ?",
+                                                                               (self.database_id, member_database_id, global_time)).next()
+                    if global_time > pruned_global_times.get(meta_message_id, -1):
+                        responses.append(str(packet))
                 except StopIteration:
                     pass
 
@@ -3046,11 +3351,8 @@ class Community(TaskManager):
                     cur_low, cur_high = low, high
             yield (cur_low, cur_high)
 
-        def fetch_packets(member_id, message_id, candidate, requests):
-            # We limit the response by byte_limit bytes per incoming candidate
-            byte_limit = self.dispersy_missing_sequence_response_limit
-
-            packets = []
+        def get_ranges(candidate, requests):
+            ranges = []
             for (member_id, message_id), sequences in requests.iteritems():
                 if not sequences:
                     # empty set will fail min(...) and max(...)
@@ -3058,19 +3360,21 @@ class Community(TaskManager):
 
                 self._logger.debug("fetching member:%d message:%d packets from database for %s",
                                    member_id, message_id, candidate)
-                for range_min, range_max in merge_ranges(sequences):
-                    for packet, in self._dispersy._database.execute(
-                            u"SELECT packet FROM sync "
-                            u"WHERE member = ? AND meta_message = ? AND sequence BETWEEN ? AND ? "
-                            u"ORDER BY sequence",
-                            (member_id, message_id, range_min, range_max)):
-                        packet = str(packet)
-                        packets.append(packet)
-
-                        byte_limit -= len(packet)
-                        if byte_limit <= 0:
-                            self._logger.debug("Bandwidth throttle.  byte_limit:%d", byte_limit)
-                            return packets
+                ranges.extend((member_id, message_id, range_min, range_max)
+                              for range_min, range_max in merge_ranges(sequences))
+            return ranges
+
+        def check_packets(packets, candidate):
+            # ensure we are sending the correct sequence numbers back
+            for packet in packets:
+                msg = self._dispersy.convert_packet_to_message(packet, self)
+                assert msg
+                self._logger.debug("syncing %d bytes, member:%d message:%d sequence:%d to %s",
+                             len(packet),
+                             msg.authentication.member.database_id,
+                             msg.database_id,
+                             msg.distribution.sequence_number,
+                             candidate)
             return packets
 
         sources = defaultdict(lambda: defaultdict(list))
@@ -3085,20 +3389,14 @@ class Community(TaskManager):
 
         for candidate, member_message_requests in sources.iteritems():
             assert isinstance(candidate, Candidate), type(candidate)
-            packets = fetch_packets(member_id, message_id, candidate, member_message_requests)
+            # We limit the response by byte_limit bytes per incoming candidate
+            deferred = self._dispersy.database_executor.run_interaction(
+                _select_sequence_packets, get_ranges(candidate, member_message_requests),
+                self.dispersy_missing_sequence_response_limit)
             if __debug__:
-                # ensure we are sending the correct sequence numbers back
-                for packet in packets:
-                    msg = self._dispersy.convert_packet_to_message(packet, self)
-                    assert msg
-                    self._logger.debug("syncing %d bytes, member:%d message:%d sequence:%d to %s",
-                                 len(packet),
-                                 msg.authentication.member.database_id,
-                                 msg.database_id,
-                                 msg.distribution.sequence_number,
-                                 candidate)
-
-            self._dispersy._send_packets([candidate], packets, self, u"-sequence-")
+                deferred.addCallback(check_packets, candidate)
+            deferred.addCallback(self._send_missing_packets, candidate, u"-sequence-")
+            deferred.addErrback(self._log_database_failure)
 
     def create_missing_proof(self, candidate, message):
         meta = self.get_meta_message(u"dispersy-missing-proof")
@@ -3106,25 +3404,28 @@ class Community(TaskManager):
         self._dispersy._forward([request])
 
     def on_missing_proof(self, messages):
-        for message in messages:
-            try:
-                packet, = self._dispersy._database.execute(u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ? LIMIT 1",
-                                                          (self.database_id, message.payload.member.database_id, message.payload.global_time)).next()
-
-            except StopIteration:
+        def send_proof(row, candidate):
+            if row is None:
                 self._logger.warning("someone asked for proof for a message that we do not have")
 
-            else:
-                packet = str(packet)
+            elif self._dispersy.has_community(self._cid):
+                packet = str(row[0])
                 msg = self._dispersy.convert_packet_to_message(packet, self, verify=False)
                 allowed, proofs = self.timeline.check(msg)
                 if allowed and proofs:
-                    self._logger.debug("we found %d packets containing proof for %s", len(proofs), message.candidate)
-                    self._dispersy._send_packets([message.candidate], [proof.packet for proof in proofs], self, "-caused by missing-proof-")
+                    self._logger.debug("we found %d packets containing proof for %s", len(proofs), candidate)
+                    self._dispersy._send_packets([candidate], [proof.packet for proof in proofs], self, "-caused by missing-proof-")
 
                 else:
                     self._logger.debug("unable to give %s missing proof.  allowed:%s.  proofs:%d packets",
-                                       message.candidate, allowed, len(proofs))
+                                       candidate, allowed, len(proofs))
+
+        for message in messages:
+            deferred = self._dispersy.database_executor.fetchone(
+                u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ? LIMIT 1",
+                (self.database_id, message.payload.member.database_id, message.payload.global_time))
+            deferred.addCallback(send_proof, message.candidate)
+            deferred.addErrback(self._log_database_failure)
 
     def create_authorize(self, permission_triplets, sign_with_master=False, store=True, update=True, forward=True):
         """
@@ -3463,6 +3764,7 @@ class Community(TaskManager):
         # We first need to extract the DispersyDuplicatedUndo objects from the messages list and deal with them
         real_messages = []
         parameters = []
+        undone = []
         for message in messages:
             if isinstance(message, DispersyDuplicatedUndo):
                 # Flag the higher undo message as undone by the lower one
@@ -3470,14 +3772,17 @@ class Community(TaskManager):
                                    self.database_id,
                                    message.high_message.authentication.member.database_id,
                                    message.high_message.distribution.global_time))
+                undone.append((message.high_message.packet_id, message.high_message.distribution.global_time))
 
             elif isinstance(message, Message.Implementation) and message.payload.process_undo:
                 # That's a normal undo message
                 parameters.append((message.packet_id, self.database_id, message.payload.member.database_id, message.payload.global_time))
+                undone.append((message.payload.packet.packet_id, message.payload.global_time))
                 real_messages.append(message)
 
         self._dispersy._database.executemany(u"UPDATE sync SET undone = ? "
                                              u"WHERE community = ? AND member = ? AND global_time = ?", parameters)
+        self._sync_filters.remove(undone)
 
         for meta, sub_messages in groupby(real_messages, key=lambda x: x.payload.packet.meta):
             meta.undo_callback([(message.payload.member, message.payload.global_time, message.payload.packet) for message in sub_messages])
@@ -3576,6 +3881,7 @@ class Community(TaskManager):
                 # 2. cleanup sync table.  everything except what we need to tell others this
                 # community is no longer available
                 self._dispersy._database.execute(u"DELETE FROM sync WHERE community = ? AND id NOT IN (" + u", ".join(u"?" for _ in packet_ids) + ")", [self.database_id] + list(packet_ids))
+                self._sync_filters.reset()
 
             self._dispersy.reclassify_community(self, new_classification)
 
@@ -3633,6 +3939,7 @@ class Community(TaskManager):
 
         if undo:
             executemany(u"UPDATE sync SET undone = 1 WHERE id = ?", ((message.packet_id,) for message in undo))
+            self._sync_filters.remove((message.packet_id, message.distribution.global_time) for message in undo)
             meta.undo_callback([(message.authentication.member, message.distribution.global_time, message) for message in undo])
 
             # notify that global times have changed
@@ -3640,6 +3947,7 @@ class Community(TaskManager):
 
         if redo:
             executemany(u"UPDATE sync SET undone = 0 WHERE id = ?", ((message.packet_id,) for message in redo))
+            self._sync_filters.add(redo)
             meta.handle_callback(redo)
 
     def _claim_master_member_sequence_number(self, meta):
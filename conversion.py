@@ -105,6 +105,16 @@ class Conversion(object):
         """
         assert self.can_decode_message(data)
 
+    def decode_member_ids(self, data):
+        """
+        Returns the member identifiers, i.e. the 20 byte sha1 digests, that DATA is authenticated with, without
+        decoding the rest of DATA.
+
+        An empty list is returned when DATA does not contain member identifiers, for instance when it contains public
+        keys instead.
+        """
+        return []
+
     @abstractmethod
     def can_encode_message(self, message):
         """
@@ -138,6 +148,11 @@ class NoDefBinaryConversion(Conversion):
 
     This conversion is intended to be as space efficient as possible.
     All data is encoded in a binary form.
+
+    When DECODE_FROM_BUFFER is True the payload decoders and the signature verification receive a buffer over the
+    received packet instead of a copy of the signed part.  Slicing a buffer returns a str, hence only the fields that
+    the decoders keep are copied.  This is opt-in: a subclass sets it to True once all its payload decoders, including
+    the ones it inherits, only slice DATA, take its length or pass it to struct.unpack_from.
     """
 
     class Placeholder(object):
@@ -178,6 +193,8 @@ class NoDefBinaryConversion(Conversion):
             self.destination = destination
             self.payload = payload
 
+    decode_from_buffer = False
+
     def __init__(self, community, community_version):
         Conversion.__init__(self, community, "\x00", community_version)
 
@@ -208,7 +225,11 @@ class NoDefBinaryConversion(Conversion):
         # reserve 3rd bit for enable/disable tunnel (02/05/12)
         self._encode_tunnel_map = {True: int("100", 2), False: int("000", 2)}
         self._decode_tunnel_map = dict((value, key) for key, value in self._encode_tunnel_map.iteritems())
-        # 4th, 5th and 6th bits are currently unused
+        # reserve 4th bit for the bloom filter mode, i.e. how bit positions are derived from the
+        # packets.  older versions ignore this bit and always use u"plain" (16/10/26)
+        self._encode_bloom_filter_mode_map = {u"plain": int("0000", 2), u"digest": int("1000", 2)}
+        self._decode_bloom_filter_mode_map = dict((value, key) for key, value in self._encode_bloom_filter_mode_map.iteritems())
+        # 5th and 6th bits are currently unused
         # reserve 7th and 8th bits for connection type
         self._encode_connection_type_map = {u"unknown": int("00000000", 2), u"public": int("10000000", 2), u"symmetric-NAT": int("11000000", 2)}
         self._decode_connection_type_map = dict((value, key) for key, value in self._encode_connection_type_map.iteritems())
@@ -715,7 +736,8 @@ class NoDefBinaryConversion(Conversion):
         data = [inet_aton(payload.destination_address[0]), self._struct_H.pack(payload.destination_address[1]),
                 inet_aton(payload.source_lan_address[0]), self._struct_H.pack(payload.source_lan_address[1]),
                 inet_aton(payload.source_wan_address[0]), self._struct_H.pack(payload.source_wan_address[1]),
-                self._struct_B.pack(self._encode_advice_map[payload.advice] | self._encode_connection_type_map[payload.connection_type] | self._encode_sync_map[payload.sync]),
+                self._struct_B.pack(self._encode_advice_map[payload.advice] | self._encode_connection_type_map[payload.connection_type] | self._encode_sync_map[payload.sync] |
+                                    (self._encode_bloom_filter_mode_map[payload.bloom_filter.mode] if payload.sync else 0)),
                 self._struct_H.pack(payload.identifier)]
 
         # add optional sync
@@ -763,6 +785,9 @@ class NoDefBinaryConversion(Conversion):
             if len(data) < offset + 24:
                 raise DropPacket("Insufficient packet size")
 
+            # both values of the mode bit are valid modes
+            mode = self._decode_bloom_filter_mode_map[flags & int("1000", 2)]
+
             time_low, time_high, modulo, modulo_offset, functions, size = self._struct_QQHHBH.unpack_from(data, offset)
             offset += 23
 
@@ -788,7 +813,7 @@ class NoDefBinaryConversion(Conversion):
             if not length == len(data) - offset:
                 raise DropPacket("Invalid number of bytes available")
 
-            bloom_filter = BloomFilter(data[offset:offset + length], functions, prefix=prefix)
+            bloom_filter = BloomFilter(data[offset:offset + length], functions, prefix=prefix, mode=mode)
             offset += length
 
             sync = (time_low, time_high, modulo, modulo_offset, bloom_filter)
@@ -1173,6 +1198,25 @@ class NoDefBinaryConversion(Conversion):
 
         return self._decode_message_map[data[22]].meta
 
+    def decode_member_ids(self, data):
+        assert isinstance(data, str), type(data)
+        if not self.can_decode_message(data):
+            return []
+
+        authentication = self._decode_message_map[data[22]].meta.authentication
+        if isinstance(authentication, MemberAuthentication):
+            count = 1
+        elif isinstance(authentication, DoubleMemberAuthentication):
+            count = 2
+        else:
+            return []
+
+        if self.__get_authentication_encoding(authentication) != "sha1" or len(data) < 23 + 20 * count:
+            return []
+
+        # the authentication directly follows the 23 byte header
+        return [data[offset:offset + 20] for offset in xrange(23, 23 + 20 * count, 20)]
+
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {return_value}")
     def decode_message(self, candidate, data, verify=True, allow_empty_signature=False, source="unknown"):
         """
@@ -1215,7 +1259,10 @@ class NoDefBinaryConversion(Conversion):
         assert isinstance(placeholder.distribution, Distribution.Implementation)
 
         # payload
-        payload = placeholder.data[:placeholder.first_signature_offset]
+        if self.decode_from_buffer:
+            payload = buffer(placeholder.data, 0, placeholder.first_signature_offset)
+        else:
+            payload = placeholder.data[:placeholder.first_signature_offset]
         placeholder.offset, placeholder.payload = decode_functions.payload(placeholder, placeholder.offset, payload)
         if placeholder.offset != placeholder.first_signature_offset:
             self._logger.warning("invalid packet size for %s data:%d; offset:%d",
@@ -1225,9 +1272,17 @@ class NoDefBinaryConversion(Conversion):
         assert isinstance(placeholder.payload, Payload.Implementation), type(placeholder.payload)
         assert isinstance(placeholder.offset, (int, long))
 
-        # verify payload
-        if placeholder.verify and not placeholder.authentication.has_valid_signature_for(placeholder, payload):
-            raise DropPacket("Invalid signature")
+        # verify payload, unless we recently verified the same packet
+        if placeholder.verify:
+            checks = placeholder.authentication.get_signature_checks(payload, placeholder.allow_empty_signature)
+            if checks is None:
+                raise DropPacket("Invalid signature")
+
+            verifier = self._community.dispersy.signature_verifier
+            if checks and not verifier.is_verified(data, checks):
+                if not all(member.verify(signed, signature) for member, signed, signature in checks):
+                    raise DropPacket("Invalid signature")
+                verifier.set_verified(data, checks)
 
         return placeholder.meta.Implementation(placeholder.meta, placeholder.authentication, placeholder.resolution, placeholder.distribution, placeholder.destination, placeholder.payload, conversion=self, candidate=candidate, source=source, packet=placeholder.data)
 
@@ -1292,5 +1347,7 @@ class DefaultConversion(BinaryConversion):
     replaced by a Community specific conversion that also supplies
     payload conversion for the Community specific messages.
     """
+    decode_from_buffer = True
+
     def __init__(self, community):
         super(DefaultConversion, self).__init__(community, "\x00")
@@ -1,9 +1,11 @@
+from collections import OrderedDict
 from hashlib import sha1
 from math import ceil
 from struct import Struct
 import logging
 
 from M2Crypto import EC, BIO
+from twisted.internet.threads import deferToThread
 
 # Add libnacl submodule to the python path
 import sys
@@ -17,6 +19,9 @@ from libnacl.encode import hex_encode
 
 _STRUCT_L = Struct(">L")
 
+# the maximum number of verified packets that a SignatureVerifier remembers
+MAX_VERIFIED_PACKETS = 16384
+
 # Allow all available curves.
 # Niels: 16-12-2013, if it starts with NID_
 _CURVES = dict((unicode(curve), (getattr(EC, curve), "M2Crypto")) for curve in dir(EC) if curve.startswith("NID_"))
@@ -203,7 +208,7 @@ class ECCrypto(DispersyCrypto):
         Returns True when SIGNATURE matches the DIGEST made using EC.
         """
         assert isinstance(ec, DispersyKey), ec
-        assert isinstance(data, str), type(data)
+        assert isinstance(data, (str, buffer)), type(data)
         assert isinstance(signature, str), type(signature)
         assert len(signature) == self.get_signature_length(ec), [len(signature), self.get_signature_length(ec)]
 
@@ -391,7 +396,8 @@ class LibNaCLPK(DispersyKey):
 
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
     def verify(self, signature, msg):
-        return self.veri.verify(signature + msg)
+        # MSG may be a buffer, which can not be concatenated to a str
+        return self.veri.verify(signature + str(msg))
 
     def key_to_bin(self):
         return "LibNaCLPK:" + self.key.pk + self.veri.vk
@@ -422,3 +428,156 @@ class LibNaCLSK(LibNaCLPK):
 
     def key_to_bin(self):
         return "LibNaCLSK:" + self.key.sk + self.key.seed
+
+
+# the crypto instance and the public keys used by the processes of a SignatureVerifier pool
+_worker_crypto = None
+_worker_keys = {}
+
+
+def _initialize_verification_worker(crypto):
+    global _worker_crypto
+    _worker_crypto = crypto
+    _worker_keys.clear()
+
+
+def _verify_signature(check):
+    public_key, data, signature = check
+    key = _worker_keys.get(public_key)
+    if key is None:
+        if len(_worker_keys) > 10000:
+            _worker_keys.clear()
+        key = _worker_keys[public_key] = _worker_crypto.key_from_public_bin(public_key)
+    return _worker_crypto.is_valid_signature(key, data, signature)
+
+
+class SignatureVerifier(object):
+    """
+    Verifies the signatures of a batch of messages at once.
+
+    When PROCESSES is larger than zero, batches with at least THRESHOLD signatures are verified in parallel by a pool
+    of PROCESSES worker processes.  The pool is started by open(), which must be called before the process starts
+    any threads or opens any sockets or databases.  Smaller batches, or all batches when PROCESSES is zero or the
+    pool is not running, are verified on the calling thread.
+
+    The SignatureVerifier also remembers which packets were recently verified, and by which members, allowing the
+    verification of duplicate packets to be skipped.
+    """
+
+    def __init__(self, crypto, processes=0, threshold=16):
+        assert isinstance(crypto, DispersyCrypto), type(crypto)
+        assert isinstance(processes, int), type(processes)
+        assert processes >= 0, processes
+        assert isinstance(threshold, int), type(threshold)
+        super(SignatureVerifier, self).__init__()
+        self._crypto = crypto
+        self._processes = processes
+        self._threshold = threshold
+        self._pool = None
+
+        # sha1 digest: member database ids pairs, in least recently used order
+        self._verified = OrderedDict()
+
+    @property
+    def processes(self):
+        return self._processes
+
+    def open(self):
+        """
+        Starts the pool of worker processes, when PROCESSES is larger than zero.
+
+        The worker processes are forked from the current process.  Forking after other threads have started, or
+        while sqlite and socket file descriptors are open, may leave the workers with locks that are never released.
+        @rtype: bool
+        """
+        if self._processes and self._pool is None:
+            from multiprocessing import Pool
+            self._pool = Pool(self._processes, _initialize_verification_worker, (self._crypto,))
+        return True
+
+    def _split_checks(self, checks):
+        """
+        Returns a (results, indexes) tuple, where RESULTS contains False for the CHECKS that can not be valid and
+        INDEXES are the indexes of the CHECKS that must still be verified.
+        """
+        results = [bool(member.public_key) and member.signature_length == len(signature)
+                   for member, _, signature in checks]
+        return results, [index for index, result in enumerate(results) if result]
+
+    def _use_pool(self, indexes):
+        return self._pool is not None and len(indexes) >= self._threshold
+
+    def _map_pool(self, checks, indexes):
+        # buffers can not be pickled, the data is sent to the worker processes as a str
+        return self._pool.map(_verify_signature,
+                              [(checks[index][0].public_key, str(checks[index][1]), checks[index][2])
+                               for index in indexes],
+                              max(1, len(indexes) // (self._processes * 4)))
+
+    @staticmethod
+    def _merge_results(verified, results, indexes):
+        for index, result in zip(indexes, verified):
+            results[index] = bool(result)
+        return results
+
+    def verify(self, checks):
+        """
+        Verify (Member, data, signature) tuples, as returned by Authentication.Implementation.get_signature_checks.
+
+        Blocks until all signatures have been verified.  Use verify_async on the reactor thread.
+        @rtype: [bool]
+        """
+        results, indexes = self._split_checks(checks)
+
+        if self._use_pool(indexes):
+            verified = self._map_pool(checks, indexes)
+        else:
+            verified = [checks[index][0].verify(checks[index][1], checks[index][2]) for index in indexes]
+
+        return self._merge_results(verified, results, indexes)
+
+    def verify_async(self, checks):
+        """
+        Verify (Member, data, signature) tuples, as returned by Authentication.Implementation.get_signature_checks.
+
+        Batches that are verified by the worker processes are waited for on a thread from the reactor thread pool,
+        allowing the reactor to continue in the meantime, and a Deferred firing the results is returned.  Smaller
+        batches are verified immediately and the results are returned directly.
+        @rtype: [bool] or Deferred
+        """
+        results, indexes = self._split_checks(checks)
+
+        if self._use_pool(indexes):
+            deferred = deferToThread(self._map_pool, checks, indexes)
+            deferred.addCallback(self._merge_results, results, indexes)
+            return deferred
+
+        return self._merge_results([checks[index][0].verify(checks[index][1], checks[index][2]) for index in indexes],
+                                   results, indexes)
+
+    def is_verified(self, packet, checks):
+        """
+        Returns True when PACKET was recently verified, using the same members, with set_verified.
+        """
+        digest = sha1(packet).digest()
+        member_ids = self._verified.pop(digest, None)
+        if member_ids is None:
+            return False
+        self._verified[digest] = member_ids
+        return member_ids == tuple(member.database_id for member, _, _ in checks)
+
+    def set_verified(self, packet, checks):
+        """
+        Remember that all CHECKS for PACKET are valid.
+        """
+        digest = sha1(packet).digest()
+        self._verified.pop(digest, None)
+        if len(self._verified) >= MAX_VERIFIED_PACKETS:
+            self._verified.popitem(last=False)
+        self._verified[digest] = tuple(member.database_id for member, _, _ in checks)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -6,14 +6,35 @@ This module provides basic database functionalty and simple version control.
 @contact: dispersy@frayja.com
 """
 import logging
+import re
 import sys
 import thread
+from Queue import Queue
 from abc import ABCMeta, abstractmethod
+from itertools import chain, count, imap, islice, izip
+from operator import itemgetter
 from sqlite3 import Connection
+from threading import Thread
+from time import time
 
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.python.failure import Failure
+
+from .statistics import StatementStatistic, _runtime_statistics
 from .util import attach_runtime_statistics
 
 
+# the number of compiled statements that the sqlite3 module keeps for every connection
+STATEMENT_CACHE_SIZE = 512
+
+# the maximum number of distinct statements that a Database keeps statistics for
+MAX_STATEMENT_STATISTICS = 4096
+
+_placeholder_list = re.compile(ur"\?(?:\s*,\s*\?)+")
+_whitespace = re.compile(ur"\s+")
+
+
 if "--explain-query-plan" in getattr(sys, "argv", []):
     _explain_query_plan_logger = logging.getLogger("explain-query-plan")
     _explain_query_plan = set()
@@ -37,6 +58,127 @@ else:
         return func
 
 
+def get_in_placeholders(values):
+    """
+    Returns the placeholders and the bindings for an IN (...) clause containing VALUES.
+
+    The number of placeholders is rounded up to a power of two by repeating the last value.  Queries with a varying
+    number of values therefore use only a few distinct statements, allowing the compiled statements to be reused.
+
+    >>> placeholders, bindings = get_in_placeholders([1, 2, 3])
+    >>> database.execute(u"SELECT * FROM sync WHERE id IN (%s)" % placeholders, bindings)
+
+    @rtype: (unicode, list)
+    """
+    bindings = list(values)
+    assert bindings, "VALUES may not be empty"
+    size = 1
+    while size < len(bindings):
+        size *= 2
+    bindings.extend(bindings[-1:] * (size - len(bindings)))
+    return u", ".join(u"?" * size), bindings
+
+
+def normalize_statement(statement):
+    """
+    Returns STATEMENT with all whitespace collapsed and every list of placeholders replaced by '?...'.
+    """
+    return _whitespace.sub(u" ", _placeholder_list.sub(u"?...", statement)).strip()
+
+
+class _StatementRun(object):
+
+    """
+    Adds the duration and the rows of one execution of a statement to its StatementStatistic, once, when the
+    execution is finished.
+    """
+
+    __slots__ = ("_statistic", "_start", "_rows", "_counter", "_finished")
+
+    def __init__(self, statistic, start, rows=0):
+        self._statistic = statistic
+        self._start = start
+        self._rows = rows
+        self._counter = count()
+        self._finished = False
+
+    def count(self, rows):
+        " Returns an iterator over ROWS that counts the rows without a Python call per row. "
+        return imap(itemgetter(0), izip(rows, self._counter))
+
+    def finish(self):
+        if not self._finished:
+            self._finished = True
+            self._statistic.increment(time() - self._start)
+            self._statistic.add_rows(self._rows + next(self._counter))
+
+    def on_exhausted(self):
+        " An empty generator that finishes the execution once the rows before it are exhausted. "
+        self.finish()
+        return
+        yield
+
+    def __del__(self):
+        # the rows were not exhausted and the cursor was not closed
+        self.finish()
+
+
+class StatementCursor(object):
+
+    """
+    Wraps the sqlite3 cursor returned by Database.execute and Database.executemany.
+
+    The execution is added to the statement's StatementStatistic once, when all rows have been read, the cursor is
+    closed, or the cursor is no longer referenced.  Its duration therefore includes stepping through the rows that
+    were read.  Statements that do not return rows, such as INSERT, UPDATE and DELETE, are finished immediately and
+    count the rows they changed.
+    """
+
+    __slots__ = ("_cursor", "_run", "_rows")
+
+    def __init__(self, cursor, statistic, start):
+        self._cursor = cursor
+        if cursor.description is None:
+            self._run = _StatementRun(statistic, start, max(cursor.rowcount, 0))
+            self._run.finish()
+            self._rows = iter(())
+        else:
+            self._run = _StatementRun(statistic, start)
+            self._rows = chain(self._run.count(cursor), self._run.on_exhausted())
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def __iter__(self):
+        return self._rows
+
+    def next(self):
+        return next(self._rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=None):
+        return list(islice(self._rows, self._cursor.arraysize if size is None else size))
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        " Finishes the execution, the remaining rows are not read.  The shared sqlite3 cursor remains open. "
+        self._run.finish()
+        self._rows = iter(())
+
+
 class IgnoreCommits(Exception):
 
     """
@@ -84,6 +226,9 @@ class Database(object):
         # when _pending_commits > 0.  A commit is required when _pending_commits > 1.
         self._pending_commits = 0
 
+        # (function_name, statement):StatementStatistic pairs
+        self._statement_statistics = {}
+
         if __debug__:
             self._debug_thread_ident = 0
 
@@ -113,7 +258,7 @@ class Database(object):
         return True
 
     def _connect(self):
-        self._connection = Connection(self._file_path)
+        self._connection = Connection(self._file_path, cached_statements=STATEMENT_CACHE_SIZE)
         self._cursor = self._connection.cursor()
 
     def _initial_statements(self):
@@ -149,10 +294,12 @@ class Database(object):
         #
         # PRAGMA journal_mode = DELETE | TRUNCATE | PERSIST | MEMORY | WAL | OFF
         # http://www.sqlite.org/pragma.html#pragma_page_size
+        # The locking_mode is left at NORMAL, allowing the connections of a DatabaseExecutor to read the database
+        # concurrently.  Previously EXCLUSIVE was only set in the session that converted the database to WAL, every
+        # later session already used NORMAL.
         #
         if not (journal_mode == u"WAL" or self._file_path == u":memory:"):
             self._logger.debug("PRAGMA journal_mode = WAL (previously: %s) [%s]", journal_mode, self._file_path)
-            self._cursor.execute(u"PRAGMA locking_mode = EXCLUSIVE")
             self._cursor.execute(u"PRAGMA journal_mode = WAL")
 
         else:
@@ -247,8 +394,26 @@ class Database(object):
             # returning False to let Python reraise the exception.
             return False
 
+    def _get_statement_statistic(self, function_name, statement):
+        """
+        Returns the StatementStatistic for STATEMENT, it is registered in the runtime statistics under the normalized
+        statement.
+        """
+        key = (function_name, statement)
+        statistic = self._statement_statistics.get(key)
+        if statistic is None:
+            if len(self._statement_statistics) >= MAX_STATEMENT_STATISTICS:
+                self._statement_statistics.clear()
+
+            entry = u"%s.%s %s [%s]" % (self.__class__.__name__, function_name, normalize_statement(statement),
+                                        self._file_path)
+            statistic = _runtime_statistics.get(entry)
+            if not isinstance(statistic, StatementStatistic):
+                statistic = _runtime_statistics[entry] = StatementStatistic()
+            self._statement_statistics[key] = statistic
+        return statistic
+
     @attach_explain_query_plan
-    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1} [{0.file_path}]")
     def execute(self, statement, bindings=(), get_lastrowid=False):
         """
         Execute one SQL statement.
@@ -270,7 +435,7 @@ class Database(object):
         @param bindings: the values that must be set to the placeholders in statement.
         @type bindings: list, tuple, dict, or set
 
-        @returns: unknown
+        @returns: the lastrowid when get_lastrowid is True, otherwise a StatementCursor over the resulting rows
         @raise sqlite.Error: unknown
         """
         if __debug__:
@@ -290,10 +455,17 @@ class Database(object):
             assert all(tests), "Bindings may not be strings.  Provide unicode for TEXT and buffer(...) for BLOB\n%s" % (statement,)
 
         self._logger.log(logging.NOTSET, "%s <-- %s [%s]", statement, bindings, self._file_path)
-        result = self._cursor.execute(statement, bindings)
+        statistic = self._get_statement_statistic(u"execute", statement)
+        start = time()
+        try:
+            cursor = StatementCursor(self._cursor.execute(statement, bindings), statistic, start)
+        except Exception:
+            statistic.increment(time() - start)
+            raise
+
         if get_lastrowid:
-            result = self._cursor.lastrowid
-        return result
+            return cursor.lastrowid
+        return cursor
 
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1} [{0.file_path}]")
     def executescript(self, statements):
@@ -307,7 +479,6 @@ class Database(object):
         return self._cursor.executescript(statements)
 
     @attach_explain_query_plan
-    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1} [{0.file_path}]")
     def executemany(self, statement, sequenceofbindings):
         """
         Execute one SQL statement several times.
@@ -332,7 +503,7 @@ class Database(object):
 
         @type sequenceofbindings: list, tuple, set or generator
 
-        @returns: unknown
+        @returns: a StatementCursor
         @raise sqlite.Error: unknown
         """
         assert self._cursor is not None, "Database.close() has been called or Database.open() has not been called"
@@ -364,7 +535,13 @@ class Database(object):
                 sequenceofbindings = iter(sequenceofbindings)
 
         self._logger.log(logging.NOTSET, "%s [%s]", statement, self._file_path)
-        return self._cursor.executemany(statement, sequenceofbindings)
+        statistic = self._get_statement_statistic(u"executemany", statement)
+        start = time()
+        try:
+            return StatementCursor(self._cursor.executemany(statement, sequenceofbindings), statistic, start)
+        except Exception:
+            statistic.increment(time() - start)
+            raise
 
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} [{0.file_path}]")
     def commit(self, exiting=False):
@@ -415,3 +592,160 @@ class Database(object):
     def detach_commit_callback(self, func):
         assert func in self._commit_callbacks
         self._commit_callbacks.remove(func)
+
+
+class DatabaseExecutor(object):
+
+    """
+    Executes reads on the file of a Database outside the reactor thread.
+
+    Reads are executed by a pool of READERS threads, each with its own read-only connection.  Because the database
+    uses WAL, these readers do not block, and are not blocked by, the reactor thread connection.  The readers see the
+    database as it was at the most recent commit of the reactor thread connection, hence Dispersy._store commits every
+    stored batch when the DatabaseExecutor is threaded.  All writes remain on the reactor thread connection.
+
+    Every method returns a Deferred that fires on the reactor thread.
+
+    An in-memory database can not be shared between connections.  For such a database all operations run on the
+    reactor thread connection and the returned Deferreds have already fired.
+    """
+
+    def __init__(self, database, readers=2, busy_timeout=60.0):
+        """
+        @param database: the database whose file the operations run on.
+        @type database: Database
+
+        @param readers: the number of reader threads.
+        @type readers: int
+
+        @param busy_timeout: the number of seconds a thread waits for a lock held by another connection.
+        @type busy_timeout: float
+        """
+        assert isinstance(database, Database), type(database)
+        assert isinstance(readers, int), type(readers)
+        assert readers > 0, readers
+        assert isinstance(busy_timeout, float), type(busy_timeout)
+        super(DatabaseExecutor, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._database = database
+        self._readers = readers
+        self._busy_timeout = busy_timeout
+
+        # _READ_QUEUE AND _THREADS are set during open(...) when the database is not in memory
+        self._read_queue = None
+        self._threads = []
+
+    @property
+    def threaded(self):
+        """
+        True when operations run outside the reactor thread.
+        """
+        return bool(self._threads)
+
+    def open(self):
+        assert not self._threads, "DatabaseExecutor.open() has already been called"
+        if self._database.file_path == u":memory:":
+            self._logger.debug("in-memory database, operations run on the reactor thread")
+            return True
+
+        self._read_queue = Queue()
+        self._threads = [Thread(target=self._reader_loop, name="DatabaseReader-%d" % index)
+                         for index in xrange(self._readers)]
+        for thread_ in self._threads:
+            thread_.daemon = True
+            thread_.start()
+
+        self._logger.debug("started %d reader threads [%s]", self._readers, self._database.file_path)
+        return True
+
+    def close(self):
+        """
+        Stops the threads after they have finished the operations queued before this call.
+        """
+        if self._threads:
+            for _ in xrange(self._readers):
+                self._read_queue.put(None)
+            for thread_ in self._threads:
+                thread_.join()
+            self._threads = []
+            self._logger.debug("stopped all threads [%s]", self._database.file_path)
+        return True
+
+    def run_interaction(self, func, *args, **kargs):
+        """
+        Calls FUNC(execute, *ARGS, **KARGS) on a reader thread.
+
+        EXECUTE has the signature of Database.execute.  FUNC must not access any other state that is used by the
+        reactor thread.  Cursors that FUNC did not exhaust are closed when it returns.
+
+        @return: A Deferred that fires with the value returned by FUNC.
+        """
+        assert callable(func), type(func)
+        if not self._threads:
+            try:
+                return succeed(func(self._database.execute, *args, **kargs))
+            except Exception:
+                return fail()
+
+        deferred = Deferred()
+        self._read_queue.put((deferred, func, args, kargs))
+        return deferred
+
+    def fetchall(self, statement, bindings=()):
+        """
+        Executes one SQL statement on a reader thread.
+
+        @return: A Deferred that fires with a list containing all rows.
+        """
+        return self.run_interaction(_fetchall, statement, bindings)
+
+    def fetchone(self, statement, bindings=()):
+        """
+        Executes one SQL statement on a reader thread.
+
+        @return: A Deferred that fires with the first row, or None when there are no rows.
+        """
+        return self.run_interaction(_fetchone, statement, bindings)
+
+    def _connect(self):
+        return Connection(self._database.file_path, timeout=self._busy_timeout, isolation_level=None,
+                          cached_statements=STATEMENT_CACHE_SIZE)
+
+    def _reader_loop(self):
+        connection = self._connect()
+        connection.execute(u"PRAGMA query_only = ON")
+        try:
+            while True:
+                task = self._read_queue.get()
+                if task is None:
+                    break
+
+                deferred, func, args, kargs = task
+                cursors = []
+
+                def execute(statement, bindings=()):
+                    cursor = connection.cursor()
+                    cursors.append(cursor)
+                    return cursor.execute(statement, bindings)
+
+                try:
+                    result = func(execute, *args, **kargs)
+                except Exception:
+                    reactor.callFromThread(deferred.errback, Failure())
+                else:
+                    reactor.callFromThread(deferred.callback, result)
+                finally:
+                    # an unfinished cursor keeps its WAL snapshot, preventing checkpoints
+                    for cursor in cursors:
+                        cursor.close()
+        finally:
+            connection.close()
+
+
+def _fetchall(execute, statement, bindings):
+    return execute(statement, bindings).fetchall()
+
+
+def _fetchone(execute, statement, bindings):
+    return execute(statement, bindings).fetchone()
@@ -6,6 +6,8 @@ from ..conversion import BinaryConversion
 
 
 class DiscoveryConversion(BinaryConversion):
+    decode_from_buffer = True
+
     def __init__(self, community):
         super(DiscoveryConversion, self).__init__(community, "\x02")
         self.define_meta_message(chr(1), community.get_meta_message(u"similarity-request"), self._encode_similarity_request, self._decode_similarity_request)
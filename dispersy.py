@@ -42,6 +42,7 @@ from collections import defaultdict, Iterable, OrderedDict
 from hashlib import sha1
 from itertools import groupby, count
 from pprint import pformat
+from random import randint
 from socket import inet_aton, error as socket_error
 from struct import unpack_from
 from time import time
@@ -56,7 +57,8 @@ from twisted.python.threadable import isInIOThread
 from .authentication import MemberAuthentication, DoubleMemberAuthentication
 from .candidate import LoopbackCandidate, WalkCandidate, Candidate
 from .community import Community
-from .crypto import DispersyCrypto, ECCrypto
+from .crypto import DispersyCrypto, ECCrypto, SignatureVerifier
+from .database import DatabaseExecutor, get_in_placeholders
 from .destination import CommunityDestination, CandidateDestination
 from .discovery.community import DiscoveryCommunity
 from .dispersydatabase import DispersyDatabase
@@ -69,6 +71,7 @@ from .message import (Message, DropMessage, DelayMessageBySequence,
                       DropPacket, DelayPacket)
 from .statistics import DispersyStatistics, _runtime_statistics
 from .taskmanager import TaskManager
+from .walkscheduler import WalkScheduler
 from .util import attach_runtime_statistics, init_instrumentation, blocking_call_on_reactor_thread, is_valid_address
 
 
@@ -77,6 +80,7 @@ init_instrumentation()
 
 FLUSH_DATABASE_INTERVAL = 60.0
 STATS_DETAILED_CANDIDATES_INTERVAL = 5.0
+MEMBER_CACHE_SIZE = 1024
 
 
 class Dispersy(TaskManager):
@@ -86,7 +90,9 @@ class Dispersy(TaskManager):
     outgoing data for, possibly, multiple communities.
     """
 
-    def __init__(self, endpoint, working_directory, database_filename=u"dispersy.db", crypto=ECCrypto()):
+    def __init__(self, endpoint, working_directory, database_filename=u"dispersy.db", crypto=ECCrypto(),
+                 verification_processes=0, member_cache_size=MEMBER_CACHE_SIZE, database_readers=2,
+                 walker_packets_per_second=None):
         """
         Initialise a Dispersy instance.
 
@@ -98,11 +104,34 @@ class Dispersy(TaskManager):
 
         @param database_filename: The database filename or u":memory:"
         @type database_filename: unicode
+
+        @param verification_processes: The number of processes used to verify the signatures of large incoming
+         batches, or 0 to verify all signatures on the reactor thread.
+        @type verification_processes: int
+
+        @param member_cache_size: The maximum number of members, and separately the maximum number of members
+         without a known public key, that are kept in memory.
+        @type member_cache_size: int
+
+        @param database_readers: The number of threads that execute expensive database reads outside the reactor
+         thread.  Not used for a u":memory:" database.
+        @type database_readers: int
+
+        @param walker_packets_per_second: The maximum number of introduction requests that the walkers of all
+         communities send per second, or None for no limit.
+        @type walker_packets_per_second: int or None
         """
         assert isinstance(endpoint, Endpoint), type(endpoint)
         assert isinstance(working_directory, unicode), type(working_directory)
         assert isinstance(database_filename, unicode), type(database_filename)
         assert isinstance(crypto, DispersyCrypto), type(crypto)
+        assert isinstance(verification_processes, int), type(verification_processes)
+        assert isinstance(member_cache_size, int), type(member_cache_size)
+        assert member_cache_size > 0, member_cache_size
+        assert isinstance(database_readers, int), type(database_readers)
+        assert database_readers > 0, database_readers
+        assert walker_packets_per_second is None or isinstance(walker_packets_per_second, int), \
+            type(walker_packets_per_second)
         super(Dispersy, self).__init__()
         self._logger = logging.getLogger(self.__class__.__name__)
 
@@ -116,7 +145,11 @@ class Dispersy(TaskManager):
 
         self._discovery_community = None
 
+        # mid:Member pairs, the least recently used member first
         self._member_cache_by_hash = OrderedDict()
+        # mid:DummyMember pairs for members without a known public key, the least recently used member first
+        self._dummy_member_cache_by_hash = OrderedDict()
+        self._member_cache_size = member_cache_size
 
         # our data storage
         if not database_filename == u":memory:":
@@ -125,8 +158,13 @@ class Dispersy(TaskManager):
                 os.makedirs(database_directory)
             database_filename = os.path.join(database_directory, database_filename)
         self._database = DispersyDatabase(database_filename)
+        self._database_executor = DatabaseExecutor(self._database, database_readers)
 
         self._crypto = crypto
+        self._signature_verifier = SignatureVerifier(crypto, verification_processes)
+
+        # takes the walker steps of all communities
+        self._walk_scheduler = WalkScheduler(self, walker_packets_per_second)
 
         # indicates what our connection type is.  currently it can be u"unknown", u"public", or
         # u"symmetric-NAT"
@@ -339,6 +377,14 @@ class Dispersy(TaskManager):
         """
         return self._database
 
+    @property
+    def database_executor(self):
+        """
+        Executes expensive database operations outside the reactor thread.
+        @rtype: DatabaseExecutor
+        """
+        return self._database_executor
+
     @property
     def crypto(self):
         """
@@ -347,6 +393,22 @@ class Dispersy(TaskManager):
         """
         return self._crypto
 
+    @property
+    def signature_verifier(self):
+        """
+        Verifies the signatures of incoming message batches.
+        @rtype: SignatureVerifier
+        """
+        return self._signature_verifier
+
+    @property
+    def walk_scheduler(self):
+        """
+        Takes the walker steps of all communities.
+        @rtype: WalkScheduler
+        """
+        return self._walk_scheduler
+
     @property
     def statistics(self):
         """
@@ -456,9 +518,10 @@ class Dispersy(TaskManager):
                 _key = self.crypto.key_from_private_bin(private_key)
                 mid = self.crypto.key_to_hash(_key.pub())
 
-        member = self._member_cache_by_hash.get(mid)
-        if member:
+        member = self._get_cached_member(mid, allow_dummy=not (public_key or private_key))
+        if member is not None:
             return member
+        self._statistics.member_cache_miss_count += 1
 
         if private_key:
             key = self.crypto.key_from_private_bin(private_key)
@@ -500,7 +563,7 @@ class Dispersy(TaskManager):
                     key = self.crypto.key_from_public_bin(public_key_from_db)
 
                 else:
-                    return DummyMember(self, database_id, mid)
+                    return self._cache_member(DummyMember(self, database_id, mid))
 
         # the member is not in the database, insert it
         elif public_key or private_key:
@@ -512,18 +575,103 @@ class Dispersy(TaskManager):
                 (buffer(mid), buffer(public_key), buffer(private_key)), get_lastrowid=True)
         else:
             # We could't find the key on the DB, nothing else to do
-            database_id = self.database.execute(u"INSERT INTO member (mid) VALUES (?)",
-                (buffer(mid),), get_lastrowid=True)
-            return DummyMember(self, database_id, mid)
+            return self._insert_dummy_member(mid)
+
+        return self._cache_member(Member(self, key, database_id, mid))
 
-        member = Member(self, key, database_id, mid)
+    def _insert_dummy_member(self, mid):
+        """
+        Inserts MID, which is not in the database, and returns the cached DummyMember for it.
+        """
+        database_id = self.database.execute(u"INSERT INTO member (mid) VALUES (?)",
+            (buffer(mid),), get_lastrowid=True)
+        return self._cache_member(DummyMember(self, database_id, mid))
 
-        # store in cache
-        self._member_cache_by_hash[member.mid] = member
+    def get_members(self, mids):
+        """
+        Returns a {mid: member} dictionary with the Member or DummyMember instance for every mid in MIDS.
 
-        # limit cache length
-        if len(self._member_cache_by_hash) > 1024:
-            self._member_cache_by_hash.popitem(False)
+        This is equivalent to calling get_member(mid=mid) for every mid, but all mids that are not cached are
+        retrieved from the database at once.
+        """
+        assert all(isinstance(mid, str) and len(mid) == 20 for mid in mids), mids
+        members = {}
+        missing = []
+        for mid in set(mids):
+            member = self._get_cached_member(mid, allow_dummy=True)
+            if member is None:
+                missing.append(mid)
+            else:
+                members[mid] = member
+
+        # stay below the SQLite limit on the number of variables in a query
+        for index in xrange(0, len(missing), 500):
+            chunk = missing[index:index + 500]
+            self._statistics.member_cache_miss_count += len(chunk)
+            placeholders, bindings = get_in_placeholders(buffer(mid) for mid in chunk)
+            rows = self.database.execute(
+                u"SELECT id, mid, public_key, private_key FROM member WHERE mid IN (%s) ORDER BY id" % placeholders,
+                bindings).fetchall()
+            for database_id, mid, public_key, private_key in rows:
+                mid = str(mid)
+                # like get_member, use the first row when a mid occurs more than once
+                if mid in members:
+                    continue
+
+                if private_key:
+                    key = self.crypto.key_from_private_bin(str(private_key))
+                elif public_key:
+                    key = self.crypto.key_from_public_bin(str(public_key))
+                else:
+                    members[mid] = self._cache_member(DummyMember(self, database_id, mid))
+                    continue
+                members[mid] = self._cache_member(Member(self, key, database_id, mid))
+
+        # unknown mids are inserted into the database, these were already counted as cache misses above
+        for mid in missing:
+            if mid not in members:
+                members[mid] = self._insert_dummy_member(mid)
+
+        return members
+
+    def _get_cached_member(self, mid, allow_dummy):
+        """
+        Returns the cached Member for MID, or None.  When ALLOW_DUMMY is True a cached DummyMember may be returned.
+        """
+        member = self._member_cache_by_hash.pop(mid, None)
+        if member is not None:
+            # move to the end, i.e. make it the most recently used member
+            self._member_cache_by_hash[mid] = member
+            self._statistics.member_cache_hit_count += 1
+            return member
+
+        if allow_dummy:
+            member = self._dummy_member_cache_by_hash.pop(mid, None)
+            if member is not None:
+                self._dummy_member_cache_by_hash[mid] = member
+                self._statistics.dummy_member_cache_hit_count += 1
+                return member
+
+        return None
+
+    def _cache_member(self, member):
+        """
+        Stores MEMBER as the most recently used member, evicting the least recently used member when the cache is full.
+
+        Returns MEMBER.
+        """
+        if isinstance(member, Member):
+            # the public key is known now
+            self._dummy_member_cache_by_hash.pop(member.mid, None)
+            cache = self._member_cache_by_hash
+        else:
+            cache = self._dummy_member_cache_by_hash
+
+        cache.pop(member.mid, None)
+        cache[member.mid] = member
+        while len(cache) > self._member_cache_size:
+            cache.popitem(False)
+            self._statistics.member_cache_eviction_count += 1
 
         return member
 
@@ -828,10 +976,42 @@ class Dispersy(TaskManager):
         else:
             set_connection_type(u"unknown")
 
-    def _is_duplicate_sync_message(self, message):
+    def _get_stored_sync_packets(self, messages):
+        """
+        Returns the stored packets that have the same community, member, and global time as one of MESSAGES.
+
+        All MESSAGES must belong to the same community.  The packets are selected with one query for every 256
+        (member, global time) pairs instead of one query per message.
+
+        @return: A {(member_database_id, global_time): (packet_id, packet, undone)} dictionary.
+        @rtype: dict
+        """
+        community = messages[0].community
+        keys = set((message.authentication.member.database_id, message.distribution.global_time)
+                   for message in messages)
+        ordered_keys = sorted(keys)
+        stored = {}
+        for offset in xrange(0, len(ordered_keys), 256):
+            chunk = ordered_keys[offset:offset + 256]
+            member_placeholders, members = get_in_placeholders(sorted(set(member_database_id for member_database_id, _ in chunk)))
+            global_time_placeholders, global_times = get_in_placeholders(sorted(set(global_time for _, global_time in chunk)))
+            for packet_id, member_database_id, global_time, packet, undone in self._database.execute(
+                    u"SELECT id, member, global_time, packet, undone FROM sync "
+                    u"WHERE community = ? AND member IN (%s) AND global_time IN (%s)" %
+                    (member_placeholders, global_time_placeholders),
+                    [community.database_id] + members + global_times):
+                # the IN lists select every member^global_time combination, only KEYS are relevant
+                if (member_database_id, global_time) in keys:
+                    stored[(member_database_id, global_time)] = (packet_id, str(packet), undone)
+        return stored
+
+    def _is_duplicate_sync_message(self, message, stored=None):
         """
         Returns True when this message is a duplicate, otherwise the message must be processed.
 
+        STORED is the result of _get_stored_sync_packets for the batch that contains MESSAGE.  When STORED is None the
+        stored packet is selected from the database.
+
         === Problem: duplicate message ===
         The simplest reason to drop an incoming message is when we already have it, based on the
         community, member, and global time.  No further action is performed.
@@ -864,16 +1044,18 @@ class Dispersy(TaskManager):
         until the bloom filter is synced with the database again.
         """
         community = message.community
-        # fetch the duplicate binary packet from the database
+        key = (message.authentication.member.database_id, message.distribution.global_time)
+        if stored is None:
+            # fetch the duplicate binary packet from the database
+            stored = self._get_stored_sync_packets([message])
+
         try:
-            have_packet, undone = self._database.execute(u"SELECT packet, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?",
-                                                        (community.database_id, message.authentication.member.database_id, message.distribution.global_time)).next()
-        except StopIteration:
+            packet_id, have_packet, undone = stored[key]
+        except KeyError:
             self._logger.debug("this message is not a duplicate")
             return False
 
         else:
-            have_packet = str(have_packet)
             if have_packet == message.packet:
                 # exact binary duplicate, do NOT process the message
                 self._logger.warning("received identical message %s %d@%d from %s %s",
@@ -906,6 +1088,8 @@ class Dispersy(TaskManager):
                         # replace our current message with the other one
                         self._database.execute(u"UPDATE sync SET packet = ? WHERE community = ? AND member = ? AND global_time = ?",
                                                (buffer(message.packet), community.database_id, message.authentication.member.database_id, message.distribution.global_time))
+                        community.sync_filters.invalidate(packet_id, message.distribution.global_time)
+                        stored[key] = (packet_id, message.packet, undone)
 
                         # notify that global times have changed
                         # community.update_sync_range(message.meta, [message.distribution.global_time])
@@ -951,15 +1135,20 @@ class Dispersy(TaskManager):
         # refuse messages where the global time is unreasonably high
         acceptable_global_time = messages[0].community.acceptable_global_time
 
+        # incoming batches mostly contain messages that we already have, select all stored packets at once unless
+        # they were already selected for the signature verification of this batch
+        stored = messages[0].community._pop_batch_stored_packets(messages)
+        if stored is None:
+            stored = self._get_stored_sync_packets(messages)
+
         if enable_sequence_number:
-            # obtain the highest sequence_number from the database
+            # obtain the highest sequence_number, the sync filters cache these between batches
+            sync_filters = messages[0].community.sync_filters
             highest = {}
             for message in messages:
                 if not message.authentication.member.database_id in highest:
-                    last_global_time, last_seq, count = execute(u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
-                                                    (message.authentication.member.database_id, message.database_id)).next()
-                    highest[message.authentication.member.database_id] = (last_global_time or 0, last_seq or 0)
-                    assert last_seq or 0 == count, [last_seq, count, message.name]
+                    highest[message.authentication.member.database_id] = sync_filters.get_sequence_number(
+                        message.authentication.member.database_id, message.database_id)
 
             # all messages must follow the sequence_number order
             for message in messages:
@@ -983,8 +1172,8 @@ class Dispersy(TaskManager):
                     # we already have this message (drop)
 
                     # fetch the corresponding packet from the database (it should be binary identical)
-                    global_time, packet = execute(u"SELECT global_time, packet FROM sync WHERE member = ? AND meta_message = ? ORDER BY global_time, packet LIMIT 1 OFFSET ?",
-                                                  (message.authentication.member.database_id, message.database_id, message.distribution.sequence_number - 1)).next()
+                    global_time, packet = execute(u"SELECT global_time, packet FROM sync WHERE member = ? AND meta_message = ? AND sequence = ?",
+                                                  (message.authentication.member.database_id, message.database_id, message.distribution.sequence_number)).next()
                     packet = str(packet)
                     if message.packet == packet:
                         yield DropMessage(message, "duplicate message by binary packet")
@@ -1003,14 +1192,18 @@ class Dispersy(TaskManager):
 
                         else:
                             # TODO we should undo the messages that we are about to remove (when applicable)
+                            message.community.sync_filters.remove(list(execute(
+                                u"SELECT id, global_time FROM sync WHERE member = ? AND meta_message = ? AND global_time >= ?",
+                                (message.authentication.member.database_id, message.database_id, global_time))),
+                                [(message.authentication.member.database_id, message.database_id)])
                             execute(u"DELETE FROM sync WHERE member = ? AND meta_message = ? AND global_time >= ?",
                                     (message.authentication.member.database_id, message.database_id, global_time))
+                            stored = self._get_stored_sync_packets(messages)
 
                             # by deleting messages we changed SEQ and the HIGHEST cache
-                            last_global_time, last_seq, count = execute(u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
-                                                           (message.authentication.member.database_id, message.database_id)).next()
-                            highest[message.authentication.member.database_id] = (last_global_time or 0, last_seq or 0)
-                            assert last_seq or 0 == count, [last_seq, count, message.name]
+                            last_global_time, seq = sync_filters.get_sequence_number(
+                                message.authentication.member.database_id, message.database_id)
+                            highest[message.authentication.member.database_id] = (last_global_time, seq)
                             # we can allow MESSAGE to be processed
 
                 elif seq + 1 != message.distribution.sequence_number:
@@ -1020,7 +1213,7 @@ class Dispersy(TaskManager):
 
                 # we have the previous message, check for duplicates based on community,
                 # member, and global_time
-                if self._is_duplicate_sync_message(message):
+                if self._is_duplicate_sync_message(message, stored):
                     # we have the previous message (drop)
                     yield DropMessage(message, "duplicate message by global_time (1)")
                     continue
@@ -1054,7 +1247,7 @@ class Dispersy(TaskManager):
                 unique.add(key)
 
                 # check for duplicates based on community, member, and global_time
-                if self._is_duplicate_sync_message(message):
+                if self._is_duplicate_sync_message(message, stored):
                     # we have the previous message (drop)
                     yield DropMessage(message, "duplicate message by global_time (2)")
                     continue
@@ -1230,6 +1423,8 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                                     # replace our current message with the other one
                                     self._database.execute(u"UPDATE sync SET member = ?, packet = ? WHERE id = ?",
                                                            (message.authentication.member.database_id, buffer(message.packet), packet_id))
+                                    message.community.sync_filters.invalidate(packet_id, message.distribution.global_time,
+                                                                              [(message.authentication.member.database_id, message.database_id)])
 
                                     return DropMessage(message, "replaced existing packet with other packet with the same payload")
 
@@ -1517,34 +1712,45 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
             self._logger.debug("%s %d@%d", message.name,
                                message.authentication.member.database_id, message.distribution.global_time)
 
-            # add packet to database
-            message.packet_id = self._database.execute(
-                u"INSERT INTO sync (community, member, global_time, meta_message, packet, sequence) "
-                u"VALUES (?, ?, ?, ?, ?, ?)",
-               (message.community.database_id,
-                message.authentication.member.database_id,
-                message.distribution.global_time,
-                message.database_id,
-                buffer(message.packet),
-                (message.distribution.sequence_number if
-                 isinstance(meta.distribution, FullSyncDistribution)
-                 and message.distribution.enable_sequence_number else None)
-                ), get_lastrowid=True)
-
-            # ensure that we can reference this packet
-            self._logger.debug("stored message %s in database at row %d", message.name, message.packet_id)
-
-            if is_double_member_authentication:
-                member1 = message.authentication.members[0].database_id
-                member2 = message.authentication.members[1].database_id
-                self._database.execute(u"INSERT INTO double_signed_sync (sync, member1, member2) VALUES (?, ?, ?)",
-                                       (message.packet_id, member1, member2) if member1 < member2 else (message.packet_id, member2, member1))
-
             # update global time
             highest_global_time = max(highest_global_time, message.distribution.global_time)
             if isinstance(meta.distribution, FullSyncDistribution) and message.distribution.enable_sequence_number:
                 highest_sequence_number[message.authentication.member.database_id] = max(highest_sequence_number[message.authentication.member.database_id], message.distribution.sequence_number)
 
+        # add packets to database.  the sync table uses AUTOINCREMENT and we are the only writer, hence all rows with
+        # an id higher than the current maximum belong to MESSAGES
+        community_database_id = meta.community.database_id
+        last_packet_id, = self._database.execute(u"SELECT MAX(id) FROM sync").next()
+        self._database.executemany(
+            u"INSERT INTO sync (community, member, global_time, meta_message, packet, sequence) "
+            u"VALUES (?, ?, ?, ?, ?, ?)",
+            [(community_database_id,
+              message.authentication.member.database_id,
+              message.distribution.global_time,
+              message.database_id,
+              buffer(message.packet),
+              (message.distribution.sequence_number if
+               isinstance(meta.distribution, FullSyncDistribution)
+               and message.distribution.enable_sequence_number else None))
+             for message in messages])
+
+        # ensure that we can reference these packets
+        packet_ids = dict(((member_database_id, global_time), packet_id)
+                          for packet_id, member_database_id, global_time
+                          in self._database.execute(u"SELECT id, member, global_time FROM sync WHERE id > ?",
+                                                    (last_packet_id or 0,)))
+        assert len(packet_ids) == len(messages), [len(packet_ids), len(messages)]
+        for message in messages:
+            message.packet_id = packet_ids[(message.authentication.member.database_id, message.distribution.global_time)]
+        self._logger.debug("stored %d %s messages in database at rows %d-%d",
+                           len(messages), meta.name, min(packet_ids.itervalues()), max(packet_ids.itervalues()))
+
+        if is_double_member_authentication:
+            order = lambda member1, member2: (member1, member2) if member1 < member2 else (member2, member1)
+            self._database.executemany(u"INSERT INTO double_signed_sync (sync, member1, member2) VALUES (?, ?, ?)",
+                                       [(message.packet_id,) + order(message.authentication.members[0].database_id,
+                                                                     message.authentication.members[1].database_id)
+                                        for message in messages])
 
         if __debug__ and highest_sequence_number:
             # when sequence numbers are enabled, we must have exactly
@@ -1555,6 +1761,9 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                                                 (message.database_id, member_id, max_sequence_number)).next()
                 assert count_ == max_sequence_number, [count_, max_sequence_number]
 
+        # keep the in-memory sync filters in line with the sync table
+        meta.community.sync_filters.add(messages)
+
         if isinstance(meta.distribution, LastSyncDistribution):
             # delete packets that have become obsolete
             items = set()
@@ -1562,32 +1771,56 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
             if meta.distribution.custom_callback:
                 items = meta.distribution.custom_callback[1](messages)
 
-            # default behaviour
+            # default behaviour.  select the history of all affected members (or member pairs) in one query and
+            # keep only the newest history_size packets of each
             else:
                 if is_double_member_authentication:
-                    order = lambda member1, member2: (member1, member2) if member1 < member2 else (member2, member1)
-                    for member1, member2 in set(order(message.authentication.members[0].database_id, message.authentication.members[1].database_id) for message in messages):
-                        assert member1 < member2, [member1, member2]
-                        all_items = list(self._database.execute(u"""
-SELECT sync.id, sync.global_time
+                    pairs = set(order(message.authentication.members[0].database_id, message.authentication.members[1].database_id) for message in messages)
+                    members = sorted(set(member1 for member1, _ in pairs))
+                    for offset in xrange(0, len(members), 256):
+                        placeholders, chunk = get_in_placeholders(members[offset:offset + 256])
+                        all_items = self._database.execute(u"""
+SELECT sync.id, sync.global_time, double_signed_sync.member1, double_signed_sync.member2
 FROM sync
 JOIN double_signed_sync ON double_signed_sync.sync = sync.id
-WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed_sync.member2 = ?
-ORDER BY sync.global_time, sync.packet""", (meta.database_id, member1, member2)))
-                        if len(all_items) > meta.distribution.history_size:
-                            items.update(all_items[:len(all_items) - meta.distribution.history_size])
+WHERE sync.meta_message = ? AND double_signed_sync.member1 IN (%s)
+ORDER BY double_signed_sync.member1, double_signed_sync.member2, sync.global_time, sync.packet""" % placeholders,
+                                                           [meta.database_id] + chunk)
+                        for pair, pair_items in groupby(all_items, key=lambda item: item[2:]):
+                            if pair in pairs:
+                                assert pair[0] < pair[1], pair
+                                pair_items = [item[:2] for item in pair_items]
+                                if len(pair_items) > meta.distribution.history_size:
+                                    items.update(pair_items[:len(pair_items) - meta.distribution.history_size])
 
                 else:
-                    for member_database_id in set(message.authentication.member.database_id for message in messages):
-                        all_items = list(self._database.execute(u"""
-SELECT id, global_time
+                    members = sorted(set(message.authentication.member.database_id for message in messages))
+                    for offset in xrange(0, len(members), 256):
+                        placeholders, chunk = get_in_placeholders(members[offset:offset + 256])
+                        all_items = self._database.execute(u"""
+SELECT id, global_time, member
 FROM sync
-WHERE meta_message = ? AND member = ?
-ORDER BY global_time""", (meta.database_id, member_database_id)))
-                        if len(all_items) > meta.distribution.history_size:
-                            items.update(all_items[:len(all_items) - meta.distribution.history_size])
+WHERE meta_message = ? AND member IN (%s)
+ORDER BY member, global_time""" % placeholders,
+                                                           [meta.database_id] + chunk)
+                        for _, member_items in groupby(all_items, key=lambda item: item[2]):
+                            member_items = [item[:2] for item in member_items]
+                            if len(member_items) > meta.distribution.history_size:
+                                items.update(member_items[:len(member_items) - meta.distribution.history_size])
 
             if items:
+                # LastSyncDistribution messages have no sequence numbers, the cached sequence numbers remain valid
+                if meta.distribution.custom_callback:
+                    # the custom callback does not necessarily provide the global times
+                    syncids = sorted(syncid for syncid, _ in items)
+                    removed = []
+                    for offset in xrange(0, len(syncids), 256):
+                        placeholders, chunk = get_in_placeholders(syncids[offset:offset + 256])
+                        removed.extend(self._database.execute(u"SELECT id, global_time FROM sync WHERE id IN (%s)" % placeholders,
+                                                              chunk))
+                    meta.community.sync_filters.remove(removed)
+                else:
+                    meta.community.sync_filters.remove(items)
                 self._database.executemany(u"DELETE FROM sync WHERE id = ?", [(syncid,) for syncid, _ in items])
 
                 if is_double_member_authentication:
@@ -1607,6 +1840,11 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
         meta.community.dispersy_store(messages)
 
+        if self._database_executor.threaded:
+            # the reader threads of the DatabaseExecutor only see committed packets.  commit now, allowing sync,
+            # missing-sequence, and missing-proof requests to be answered with MESSAGES immediately
+            self._database.commit()
+
         # if update_sync_range:
         # notify that global times have changed
         #     meta.community.update_sync_range(meta, update_sync_range)
@@ -1754,26 +1992,59 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         assert all(message.community == messages[0].community for message in messages)
         assert all(message.meta == messages[0].meta for message in messages)
 
-        result = True
         meta = messages[0].meta
-        if isinstance(meta.destination, (CommunityDestination, CandidateDestination)):
-            for message in messages:
-                # CandidateDestination.candidates may be empty
-                candidates = set(message.destination.candidates)
-                # CommunityDestination.node_count is allowed to be zero
-                if isinstance(meta.destination, CommunityDestination) and meta.destination.node_count > 0:
-                    max_candidates = meta.destination.node_count + len(candidates)
-                    for candidate in meta.community.dispersy_yield_verified_candidates():
-                        if len(candidates) < max_candidates:
-                            candidates.add(candidate)
-                        else:
-                            break
-                result = result and self._send(tuple(candidates), [message])
-        else:
+        if not isinstance(meta.destination, (CommunityDestination, CandidateDestination)):
             raise NotImplementedError(meta.destination)
 
+        # CommunityDestination.node_count is allowed to be zero
+        node_count = meta.destination.node_count if isinstance(meta.destination, CommunityDestination) else 0
+        # one snapshot of the verified candidates for the entire batch
+        verified_candidates = list(meta.community.dispersy_yield_verified_candidates()) if node_count > 0 else []
+
+        result = True
+        # sock_addr:(candidate, [message]) pairs, all messages for one peer are sent at once
+        grouped = OrderedDict()
+        for message in messages:
+            # CandidateDestination.candidates may be empty
+            candidates = set(message.destination.candidates)
+            if node_count > 0:
+                candidates.update(self._sample_candidates(verified_candidates, node_count, candidates))
+
+            if not candidates:
+                result = False
+
+            for candidate in candidates:
+                group = grouped.get(candidate.sock_addr)
+                if group is None:
+                    grouped[candidate.sock_addr] = (candidate, [message])
+                else:
+                    group[1].append(message)
+
+        if grouped:
+            # all peers in one endpoint call, a failure for one peer does not stop sending to the others
+            result = self._send_batch(grouped.values()) and result
+
         return result
 
+    @staticmethod
+    def _sample_candidates(candidates, count, exclude):
+        """
+        Returns up to COUNT random candidates from CANDIDATES that are not in EXCLUDE.
+
+        This is a partial Fisher-Yates shuffle that reorders CANDIDATES in place, hence the same list can be sampled
+        for every message in a batch without copying it.
+        """
+        sample = []
+        length = len(candidates)
+        for index in xrange(length):
+            if len(sample) >= count:
+                break
+            other = randint(index, length - 1)
+            candidates[index], candidates[other] = candidates[other], candidates[index]
+            if not candidates[index] in exclude:
+                sample.append(candidates[index])
+        return sample
+
     def _delay(self, delay, packet, candidate):
         for key in delay.match_info:
             assert len(key) == 5, key
@@ -1797,6 +2068,9 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         Send a list of messages to a list of candidates. If no candidates are specified or endpoint reported
         a failure this method will return False.
 
+        Introduction requests sent while the walk scheduler takes a slice are queued and sent at the end of the slice.
+        For these, True means that they were queued; a failure to send them is logged by the walk scheduler.
+
         @param candidates: A sequence with one or more candidates.
         @type candidates: [Candidate]
 
@@ -1811,27 +2085,65 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         assert len(messages) > 0
         assert all(isinstance(message, Message.Implementation) for message in messages)
 
+        # introduction requests sent by the walker are sent at the end of the walker's time slice
+        if messages[0].meta.name == u"dispersy-introduction-request" and \
+                self._walk_scheduler.queue_introduction_requests(candidates, messages):
+            return True
+
         messages_send = False
         if len(candidates) and len(messages):
             packets = [message.packet for message in messages]
             messages_send = self._endpoint.send(candidates, packets)
 
         if messages_send:
-            for message in messages:
-                if message.meta.name == u"dispersy-introduction-request":
-                    for candidate in candidates:
-                        message.community.statistics.msg_statistics.walk_attempt_count += 1
-                        message.community.statistics.increase_msg_count(u"outgoing_intro", candidate.sock_addr)
+            self._update_send_statistics(candidates, messages)
+
+        return messages_send
 
-                        self.statistics.walk_attempt_count += 1
-                        self.statistics.outgoing_intro_count += 1
-                        self.statistics.dict_inc(u"outgoing_intro_dict", candidate.sock_addr)
+    def _send_batch(self, batch):
+        """
+        Send, for every (candidate, messages) pair in BATCH, the messages to the candidate using a single endpoint
+        call.  If the endpoint reported a failure for any of the pairs this method will return False, the other pairs
+        are still sent.
+
+        @param batch: A sequence with one or more (candidate, messages) pairs.
+        @type batch: [(Candidate, [Message.Implementation])]
+        """
+        assert isinstance(batch, (tuple, list)), type(batch)
+        assert len(batch) > 0
+        assert all(isinstance(candidate, Candidate) for candidate, _ in batch)
+        assert all(len(messages) > 0 for _, messages in batch)
+        assert all(isinstance(message, Message.Implementation) for _, messages in batch for message in messages)
 
-                message.community.statistics.increase_msg_count(
-                    u"outgoing", message.meta.name, len(candidates))
+        # introduction requests sent by the walker are sent at the end of the walker's time slice
+        if batch[0][1][0].meta.name == u"dispersy-introduction-request" and \
+                all([self._walk_scheduler.queue_introduction_requests((candidate,), messages)
+                     for candidate, messages in batch]):
+            return True
+
+        messages_send = self._endpoint.send_batch([(candidate, [message.packet for message in messages])
+                                                   for candidate, messages in batch])
+
+        if messages_send:
+            for candidate, messages in batch:
+                self._update_send_statistics((candidate,), messages)
 
         return messages_send
 
+    def _update_send_statistics(self, candidates, messages):
+        for message in messages:
+            if message.meta.name == u"dispersy-introduction-request":
+                for candidate in candidates:
+                    message.community.statistics.msg_statistics.walk_attempt_count += 1
+                    message.community.statistics.increase_msg_count(u"outgoing_intro", candidate.sock_addr)
+
+                    self.statistics.walk_attempt_count += 1
+                    self.statistics.outgoing_intro_count += 1
+                    self.statistics.dict_inc(u"outgoing_intro_dict", candidate.sock_addr)
+
+            message.community.statistics.increase_msg_count(
+                u"outgoing", message.meta.name, len(candidates))
+
     def _send_packets(self, candidates, packets, community, msg_type):
         """A wrap method to use send() in endpoint.
         """
@@ -2080,9 +2392,10 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         """
         Starts Dispersy.
 
-        1. opens database
-        2. opens endpoint
-        3. loads the DiscoveryCommunity
+        1. starts the signature verification processes
+        2. opens database
+        3. opens endpoint
+        4. loads the DiscoveryCommunity
         """
 
         assert isInIOThread()
@@ -2094,15 +2407,24 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         self._logger.info("starting the Dispersy core...")
         results = []
 
+        # the signature verifier forks its worker processes, this must happen before any threads are started and
+        # before the database and endpoint are opened
+        results.append((u"signature verifier", self._signature_verifier.open()))
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
 
         results.append((u"database", self._database.open()))
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
 
+        results.append((u"database executor", self._database_executor.open()))
+        assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
+
         results.append((u"endpoint", self._endpoint.open(self)))
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
         self._endpoint_ready()
 
+        results.append((u"walk scheduler", self._walk_scheduler.open()))
+        assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
+
         # commit changes to the database periodically
         self.register_task("flush_database", LoopingCall(self._flush_database)).start(FLUSH_DATABASE_INTERVAL)
         # output candidate statistics
@@ -2190,10 +2512,18 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                                 in self._communities.itervalues()
                                 if community.get_classification() == classification])
 
+        # stop the walker, the communities no longer walk
+        results[u"walk scheduler"] = maybeDeferred(self._walk_scheduler.close)
+
+        # stop the database threads, the communities no longer schedule database operations
+        results[u"database executor"] = maybeDeferred(self._database_executor.close)
 
         # stop endpoint
         results[u"endpoint"] = maybeDeferred(self._endpoint.close, timeout)
 
+        # stop the signature verification processes
+        self._signature_verifier.close()
+
         # stop the database
         results[u"database"] = maybeDeferred(self._database.close)
 
@@ -2233,10 +2563,8 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                 if community.get_classification() == u"PreviewChannelCommunity":
                     continue
 
-                categories = {u"walk": [], u"stumble": [], u"intro": [], u"discovered": [], None: []}
-                for candidate in community.candidates.itervalues():
-                    if isinstance(candidate, WalkCandidate):
-                        categories[candidate.get_category(now)].append(candidate)
+                categories = dict((category, community.candidates.get_by_category(category, now))
+                                  for category in (u"walk", u"stumble", u"intro", u"discovered", None))
 
                 summary.debug("--- %s %s ---", community.cid.encode("HEX"), community.get_classification())
                 summary.debug("--- [%2d:%2d:%2d:%2d]", len(categories[u"walk"]), len(categories[u"stumble"]), len(categories[u"intro"]), len(categories[u"discovered"]))
@@ -2246,7 +2574,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                     for age, candidate in sorted(aged):
                         summary.debug("%5.1fs %s%s %-7s %-13s %s",
                                       min(age, 999.0),
-                                      "O" if candidate.get_category(now) is None else " ",
+                                      "O" if category is None else " ",
                                       "E" if candidate.is_eligible_for_walk(now) else " ",
                                       category,
                                       candidate.connection_type,
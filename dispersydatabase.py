@@ -12,7 +12,7 @@ from .database import Database
 from .distribution import FullSyncDistribution
 
 
-LATEST_VERSION = 21
+LATEST_VERSION = 22
 
 schema = u"""
 CREATE TABLE member(
@@ -62,6 +62,7 @@ CREATE TABLE sync(
  UNIQUE(community, member, global_time));
 CREATE INDEX sync_meta_message_undone_global_time_index ON sync(meta_message, undone, global_time);
 CREATE INDEX sync_meta_message_member ON sync(meta_message, member);
+CREATE INDEX sync_member_meta_message_sequence_index ON sync(member, meta_message, sequence, global_time);
 
 CREATE TABLE option(key TEXT PRIMARY KEY, value BLOB);
 INSERT INTO option(key, value) VALUES('database_version', '""" + str(LATEST_VERSION) + """');
@@ -491,10 +492,21 @@ UPDATE option SET value = '21' WHERE key = 'database_version';""")
                 self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
 
             new_db_version = 22
+            if database_version < new_db_version:
+                # add an index covering the sequence number lookups, i.e. the MAX(global_time), MAX(sequence), and
+                # COUNT(*) per member and meta message, and the missing sequence ranges
+                self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
+                self.executescript(u"""
+CREATE INDEX IF NOT EXISTS sync_member_meta_message_sequence_index ON sync(member, meta_message, sequence, global_time);
+UPDATE option SET value = '22' WHERE key = 'database_version';""")
+                self.commit()
+                self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
+
+            new_db_version = 23
             if database_version < new_db_version:
                 # there is no version new_db_version yet...
                 # self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
-                # self.executescript(u"""UPDATE option SET value = '22' WHERE key = 'database_version';""")
+                # self.executescript(u"""UPDATE option SET value = '23' WHERE key = 'database_version';""")
                 # self.commit()
                 # self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
                 pass
@@ -1,16 +1,20 @@
 import errno
 import logging
+import select
 import socket
 import sys
 import threading
 from abc import ABCMeta, abstractmethod
 from itertools import product
-from select import select
 from time import time
 
 from twisted.internet import reactor
+from twisted.internet.error import CannotListenError
+from twisted.internet.protocol import DatagramProtocol
+from twisted.python.threadable import isInIOThread
 
 from .candidate import Candidate
+from .mmsg import BatchSocket
 
 
 if sys.platform == 'win32':
@@ -41,6 +45,18 @@ class Endpoint(object):
     def send_packet(self, candidate, packet):
         pass
 
+    def send_batch(self, batch):
+        """
+        Sends, for every (candidate, packets) pair in BATCH, the packets to the candidate.
+
+        Returns False when sending failed for any of the pairs, the other pairs are still sent.  Endpoints that can hand
+        the packets for several candidates to their socket at once override this method.
+        """
+        result = True
+        for candidate, packets in batch:
+            result = self.send([candidate], packets) and result
+        return result
+
     def open(self, dispersy):
         self._dispersy = dispersy
         return True
@@ -109,9 +125,10 @@ class StandaloneEndpoint(Endpoint):
         self._sendqueue_lock = threading.RLock()
         self._sendqueue = []
 
-        # _THREAD and _THREAD are set during open(...)
+        # _THREAD, _SOCKET and _BATCH_SOCKET are set during open(...)
         self._thread = None
         self._socket = None
+        self._batch_socket = None
         self.packet_handlers = {}
 
     def listen_to(self, prefix, handler):
@@ -141,6 +158,8 @@ class StandaloneEndpoint(Endpoint):
                 continue
             break
 
+        self._batch_socket = BatchSocket(self._socket)
+
         self._running = True
         self._thread = threading.Thread(name="StandaloneEndpoint", target=self._loop)
         self._thread.daemon = True
@@ -171,44 +190,76 @@ class StandaloneEndpoint(Endpoint):
 
         return super(StandaloneEndpoint, self).close(timeout) and result
 
+    def _create_poller(self):
+        """
+        Returns a (wait, close) tuple.  wait(want_write, timeout) waits at most TIMEOUT seconds for the socket to become
+        readable, or writable when WANT_WRITE is True, and returns a (readable, writable) tuple.  Uses epoll when
+        available, otherwise select.
+        """
+        fileno = self._socket.fileno()
+
+        if hasattr(select, "epoll"):
+            poller = select.epoll()
+            poller.register(fileno, select.EPOLLIN)
+            registered = [select.EPOLLIN]
+
+            def wait(want_write, timeout):
+                eventmask = select.EPOLLIN | select.EPOLLOUT if want_write else select.EPOLLIN
+                if eventmask != registered[0]:
+                    poller.modify(fileno, eventmask)
+                    registered[0] = eventmask
+
+                events = 0
+                for _, event in poller.poll(timeout):
+                    events |= event
+                return bool(events & (select.EPOLLIN | select.EPOLLERR)), bool(events & select.EPOLLOUT)
+
+            return wait, poller.close
+
+        socket_list = [fileno]
+
+        def wait(want_write, timeout):
+            read_list, write_list, _ = select.select(socket_list, socket_list if want_write else [], [], timeout)
+            return bool(read_list), bool(write_list)
+
+        return wait, lambda: None
+
     def _loop(self):
         assert self._dispersy, "Should not be called before open(...)"
-        recvfrom = self._socket.recvfrom
-        socket_list = [self._socket.fileno()]
+        recv_batch = self._batch_socket.recv_batch
+        wait, close_poller = self._create_poller()
 
         prev_sendqueue = 0
         while self._running:
             # This is a tricky, if we are running on the DAS4 whenever a socket is ready for writing all processes of
             # this node will try to write. Therefore, we have to limit the frequency of trying to write a bit.
-            if self._sendqueue and (time() - prev_sendqueue) > 0.1:
-                read_list, write_list, _ = select(socket_list, socket_list, [], 0.1)
-            else:
-                read_list, write_list, _ = select(socket_list, [], [], 0.1)
+            readable, writable = wait(bool(self._sendqueue) and (time() - prev_sendqueue) > 0.1, 0.1)
 
             # Furthermore, if we are allowed to send, process sendqueue immediately
-            if write_list:
+            if writable:
                 self._process_sendqueue()
                 prev_sendqueue = time()
 
-            if read_list:
+            if readable:
                 packets = []
                 try:
                     while True:
-                        (data, sock_addr) = recvfrom(65535)
-                        if data:
-                            packets.append((sock_addr, data))
-                        else:
+                        batch = recv_batch()
+                        # zero-length datagrams carry nothing to process
+                        packets.extend((sock_addr, data) for sock_addr, data in batch if data)
+                        if len(batch) < self._batch_socket.batch_size:
                             break
 
                 except socket.error as e:
-                    if e.errno != errno.EAGAIN:
-                        self._dispersy.statistics.dict_inc(u"endpoint_recv", u"socket-error-'%s'" % repr(e))
+                    self._dispersy.statistics.dict_inc(u"endpoint_recv", u"socket-error-'%s'" % repr(e))
 
                 finally:
                     if packets:
                         self._logger.debug('%d came in, %d bytes in total', len(packets), sum(len(packet) for _, packet in packets))
                         self.data_came_in(packets)
 
+        close_poller()
+
     def data_came_in(self, packets, cache=True):
         assert self._dispersy, "Should not be called before open(...)"
         assert isinstance(packets, (list, tuple)), type(packets)
@@ -263,12 +314,47 @@ class StandaloneEndpoint(Endpoint):
         if any(len(packet) > 2 ** 16 - 60 for packet in packets):
             raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for packet in packets))
 
-        send_packet = False
-        for candidate, packet in product(candidates, packets):
-            if self.send_packet(candidate, packet):
-                send_packet = True
+        if not (candidates and packets):
+            return False
 
-        return send_packet
+        self._dispersy.statistics.total_up += sum(len(packet) for packet in packets) * len(candidates)
+        self._dispersy.statistics.total_send += len(packets) * len(candidates)
+
+        return self._send_batch([(candidate.sock_addr, TUNNEL_PREFIX + packet if candidate.tunnel else packet)
+                                 for candidate, packet in product(candidates, packets)])
+
+    def send_batch(self, batch, prefix=None):
+        assert self._dispersy, "Should not be called before open(...)"
+        assert isinstance(batch, (tuple, list)), type(batch)
+        assert all(isinstance(candidate, Candidate) for candidate, _ in batch), [type(candidate) for candidate, _ in batch]
+        assert all(isinstance(packet, str) for _, packets in batch for packet in packets)
+        assert all(len(packet) > 0 for _, packets in batch for packet in packets)
+
+        prefix = prefix or ''
+        result = True
+        total_up = 0
+        datagrams = []
+        for candidate, packets in batch:
+            packets = [prefix + packet for packet in packets]
+
+            if any(len(packet) > 2 ** 16 - 60 for packet in packets):
+                raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for packet in packets))
+
+            if not packets:
+                result = False
+
+            total_up += sum(len(packet) for packet in packets)
+            datagrams.extend((candidate.sock_addr, TUNNEL_PREFIX + packet if candidate.tunnel else packet)
+                             for packet in packets)
+
+        if not datagrams:
+            return False
+
+        self._dispersy.statistics.total_up += total_up
+        self._dispersy.statistics.total_send += len(datagrams)
+
+        # the packets for all candidates in one batch, i.e. a single sendmmsg call where available
+        return self._send_batch(datagrams) and result
 
     def send_packet(self, candidate, packet, prefix=None):
         assert self._dispersy, "Should not be called before open(...)"
@@ -284,22 +370,33 @@ class StandaloneEndpoint(Endpoint):
         self._dispersy.statistics.total_up += len(packet)
         self._dispersy.statistics.total_send += 1
 
-        data = TUNNEL_PREFIX + packet if candidate.tunnel else packet
+        return self._send_batch([(candidate.sock_addr, TUNNEL_PREFIX + packet if candidate.tunnel else packet)])
+
+    def _send_batch(self, packets):
+        """
+        Send (sock_addr, data) tuples, the packets that can not be sent right away are added to the sendqueue.
 
+        Returns True when all PACKETS were handed to the kernel, False when some of them had to be queued.
+        """
         try:
-            self._socket.sendto(data, candidate.sock_addr)
+            sent = self._batch_socket.send_batch(packets)
+        except socket.error:
+            sent = 0
 
-            if self._logger.isEnabledFor(logging.DEBUG):
-                self.log_packet(candidate.sock_addr, packet)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            for sock_addr, data in packets[:sent]:
+                self.log_packet(sock_addr, data[TUNNEL_PREFIX_LENGHT:] if data.startswith(TUNNEL_PREFIX) else data)
 
-        except socket.error:
+        if sent < len(packets):
+            now = time()
             with self._sendqueue_lock:
                 did_have_senqueue = bool(self._sendqueue)
-                self._sendqueue.append((time(), candidate.sock_addr, data))
+                self._sendqueue.extend((now, sock_addr, data) for sock_addr, data in packets[sent:])
 
             # If we did not have a sendqueue, then we need to call process_sendqueue in order send these messages
             if not did_have_senqueue:
                 self._process_sendqueue()
+            return False
 
         return True
 
@@ -314,27 +411,27 @@ class StandaloneEndpoint(Endpoint):
 
                 allowed_timestamp = time() - 300
 
-                for i in xrange(NUM_PACKETS):
-                    queued_at, sock_addr, data = self._sendqueue[i]
+                queued = []
+                for queued_at, sock_addr, data in self._sendqueue[:NUM_PACKETS]:
                     if queued_at > allowed_timestamp:
-                        try:
-                            self._socket.sendto(data, sock_addr)
-                            index += 1
-
-                            if self._logger.isEnabledFor(logging.DEBUG):
-                                self.log_packet(sock_addr, data)
-
-                        except socket.error as e:
-                            if e[0] != SOCKET_BLOCK_ERRORCODE:
-                                self._logger.warning("could not send %d to %s (%d in sendqueue)",
-                                                     len(data), sock_addr, len(self._sendqueue))
-                                self._dispersy.statistics.dict_inc(u"endpoint_send", u"socket-error")
-                            break
+                        queued.append((queued_at, sock_addr, data))
                     else:
                         self._dispersy.statistics.dict_inc(u"endpoint_send", u"packet-expired")
-                        index += 1
 
-                self._sendqueue = self._sendqueue[index:]
+                try:
+                    index = self._batch_socket.send_batch([(sock_addr, data) for _, sock_addr, data in queued])
+
+                except socket.error as e:
+                    if e[0] != SOCKET_BLOCK_ERRORCODE:
+                        self._logger.warning("could not send %d to %s (%d in sendqueue)",
+                                             len(queued[0][2]), queued[0][1], len(self._sendqueue))
+                        self._dispersy.statistics.dict_inc(u"endpoint_send", u"socket-error")
+
+                if self._logger.isEnabledFor(logging.DEBUG):
+                    for _, sock_addr, data in queued[:index]:
+                        self.log_packet(sock_addr, data)
+
+                self._sendqueue = queued[index:] + self._sendqueue[NUM_PACKETS:]
                 if self._sendqueue:
                     # And schedule a new attempt
                     self._add_task(self._process_sendqueue, 0.1, "process_sendqueue")
@@ -343,6 +440,166 @@ class StandaloneEndpoint(Endpoint):
                 self._dispersy.statistics.cur_sendqueue = len(self._sendqueue)
 
 
+class _DispersyDatagramProtocol(DatagramProtocol):
+
+    def __init__(self, endpoint):
+        self._endpoint = endpoint
+
+    def datagramReceived(self, data, sock_addr):
+        self._endpoint.datagram_received(sock_addr, data)
+
+
+class TwistedEndpoint(Endpoint):
+
+    """
+    TwistedEndpoint uses the UDP transport of the reactor instead of running its own thread.
+
+    Datagrams are received on the reactor thread.  All datagrams that arrive during one reactor iteration are
+    coalesced and given to Dispersy.on_incoming_packets as a single batch.
+    """
+
+    def __init__(self, port, ip="0.0.0.0"):
+        super(TwistedEndpoint, self).__init__()
+
+        self._port = port
+        self._ip = ip
+        self._protocol = _DispersyDatagramProtocol(self)
+        self._incoming = []
+        self._flush_call = None
+
+        # _LISTENING_PORT is set during open(...)
+        self._listening_port = None
+        self.packet_handlers = {}
+
+    def listen_to(self, prefix, handler):
+        self.packet_handlers[prefix] = handler
+
+    def stop_listen_to(self, prefix):
+        del self.packet_handlers[prefix]
+
+    def get_address(self):
+        assert self._dispersy, "Should not be called before open(...)"
+        address = self._listening_port.getHost()
+        return address.host, address.port
+
+    def open(self, dispersy):
+        assert isInIOThread(), "TwistedEndpoint must be opened on the reactor thread"
+        super(TwistedEndpoint, self).open(dispersy)
+
+        for _ in xrange(10000):
+            try:
+                self._logger.debug("Listening at %d", self._port)
+                self._listening_port = reactor.listenUDP(self._port, self._protocol, interface=self._ip)
+                self._listening_port.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+
+                self._port = self._listening_port.getHost().port
+            except CannotListenError:
+                self._port += 1
+                continue
+            break
+        else:
+            raise CannotListenError(self._ip, self._port, "no free port found after 10000 attempts")
+
+        return True
+
+    def close(self, timeout=0.0):
+        if self._flush_call and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        self._incoming = []
+
+        result = super(TwistedEndpoint, self).close(timeout)
+        if self._listening_port is None:
+            return result
+        deferred = self._listening_port.stopListening()
+        self._listening_port = None
+        if deferred is None:
+            return result
+        return deferred.addCallback(lambda _: result)
+
+    def datagram_received(self, sock_addr, data):
+        prefix = next((p for p in self.packet_handlers if data.startswith(p)), None)
+        if prefix:
+            self.packet_handlers[prefix](sock_addr, data[len(prefix):])
+            return
+
+        self._incoming.append((sock_addr, data))
+        if self._flush_call is None:
+            # the port reads all available datagrams before returning to the reactor, hence the delayed call runs
+            # once the burst has been received
+            self._flush_call = reactor.callLater(0, self._flush_incoming)
+
+    def _flush_incoming(self):
+        self._flush_call = None
+        packets, self._incoming = self._incoming, []
+        if not packets:
+            return
+
+        self._logger.debug('%d came in, %d bytes in total', len(packets), sum(len(data) for _, data in packets))
+        self._dispersy.statistics.total_down += sum(len(data) for _, data in packets)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            for sock_addr, data in packets:
+                self.log_packet(sock_addr, data, outbound=False)
+
+        self._dispersy.on_incoming_packets([(Candidate(sock_addr, True), data[TUNNEL_PREFIX_LENGHT:])
+                                            if data.startswith(TUNNEL_PREFIX) else
+                                            (Candidate(sock_addr, False), data)
+                                            for sock_addr, data in packets],
+                                           True,
+                                           time(),
+                                           u"twisted_ep")
+
+    def send(self, candidates, packets, prefix=None):
+        assert self._dispersy, "Should not be called before open(...)"
+        assert isinstance(candidates, (tuple, list, set)), type(candidates)
+        assert all(isinstance(candidate, Candidate) for candidate in candidates), [type(candidate) for candidate in candidates]
+        assert isinstance(packets, (tuple, list, set)), type(packets)
+        assert all(isinstance(packet, str) for packet in packets), [type(packet) for packet in packets]
+        assert all(len(packet) > 0 for packet in packets), [len(packet) for packet in packets]
+
+        prefix = prefix or ''
+        packets = [prefix + packet for packet in packets]
+
+        if any(len(packet) > 2 ** 16 - 60 for packet in packets):
+            raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for packet in packets))
+
+        if not (candidates and packets):
+            return False
+
+        for candidate, packet in product(candidates, packets):
+            self._write(candidate, packet)
+        return True
+
+    def send_packet(self, candidate, packet, prefix=None):
+        assert self._dispersy, "Should not be called before open(...)"
+        assert isinstance(candidate, Candidate), type(candidate)
+        assert isinstance(packet, str), type(packet)
+        assert len(packet) > 0
+
+        packet = (prefix or '') + packet
+
+        if len(packet) > 2 ** 16 - 60:
+            raise RuntimeError("UDP does not support %d byte packets" % len(packet))
+
+        self._write(candidate, packet)
+        return True
+
+    def _write(self, candidate, packet):
+        self._dispersy.statistics.total_up += len(packet)
+        self._dispersy.statistics.total_send += 1
+
+        try:
+            self._listening_port.write(TUNNEL_PREFIX + packet if candidate.tunnel else packet, candidate.sock_addr)
+
+            if self._logger.isEnabledFor(logging.DEBUG):
+                self.log_packet(candidate.sock_addr, packet)
+
+        except socket.error as e:
+            # UDP is unreliable anyway, there is no sendqueue to fall back to
+            self._logger.warning("could not send %d to %s (%s)", len(packet), candidate.sock_addr, e)
+            self._dispersy.statistics.dict_inc(u"endpoint_send", u"socket-error")
+
+
 class ManualEnpoint(StandaloneEndpoint):
 
     def __init__(self, *args, **kwargs):
@@ -1,9 +1,8 @@
-import logging
-
-
-
 class DummyMember(object):
 
+    # every community holds members for the candidates it meets, hence the slots
+    __slots__ = ("_database_id", "_mid")
+
     def __init__(self, dispersy, database_id, mid):
         from .dispersy import Dispersy
         assert isinstance(dispersy, Dispersy), type(dispersy)
@@ -11,8 +10,6 @@ class DummyMember(object):
         assert isinstance(mid, str), type(mid)
         assert len(mid) == 20, len(mid)
 
-        self._logger = logging.getLogger(self.__class__.__name__)
-
         self._database_id = database_id
         self._mid = mid
 
@@ -70,6 +67,8 @@ class DummyMember(object):
 
 class Member(DummyMember):
 
+    __slots__ = ("_crypto", "_database", "_public_key", "_private_key", "_ec", "_signature_length", "_has_identity")
+
     def __init__(self, dispersy, key, database_id, mid=None):
         """
         Create a new Member instance.
@@ -144,14 +143,14 @@ class Member(DummyMember):
         Verify that DATA, starting at OFFSET up to LENGTH bytes, was signed by this member and
         matches SIGNATURE.
 
-        DATA is the signed data and the signature concatenated.
+        DATA is the signed data and the signature concatenated, either a str or a buffer.
         OFFSET is the offset for the signed data.
         LENGTH is the number of bytes, starting at OFFSET, to be verified.  When this value is 0 it
                is set to len(data) - OFFSET.
 
         Returns True or False.
         """
-        assert isinstance(data, str), type(data)
+        assert isinstance(data, (str, buffer)), type(data)
         assert isinstance(signature, str), type(signature)
         assert isinstance(offset, (int, long)), type(offset)
         assert isinstance(length, (int, long)), type(length)
@@ -165,7 +164,10 @@ class Member(DummyMember):
             return False
 
         if self._public_key and self._signature_length == len(signature):
-            return self._crypto.is_valid_signature(self._ec, data[offset:offset + length], signature)
+            if offset or length < len(data):
+                # a buffer avoids copying the signed data
+                data = buffer(data, offset, length)
+            return self._crypto.is_valid_signature(self._ec, data, signature)
 
     def sign(self, data, offset=0, length=0):
         """
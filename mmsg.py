@@ -0,0 +1,201 @@
+"""
+This module provides batched UDP socket I/O.
+
+On Linux the recvmmsg(2) and sendmmsg(2) system calls are used, through ctypes, to receive or send many datagrams
+with a single system call.  On other platforms, or when libc does not provide these calls, the BatchSocket falls back
+to one recvfrom or sendto call per datagram.
+
+Only AF_INET sockets are supported.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import sys
+from struct import pack, unpack_from
+
+MSG_DONTWAIT = 0x40
+MAX_DATAGRAM_SIZE = 65535
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IOVec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+# sizeof(struct sockaddr_in)
+_SOCKADDR_IN_SIZE = 16
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None, None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None, None
+
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+_recvmmsg, _sendmmsg = _load_libc()
+HAS_MMSG = _recvmmsg is not None
+
+
+def _encode_sockaddr(sock_addr):
+    # sin_family is in host byte order, sin_port and sin_addr in network byte order
+    ip, port = sock_addr
+    return pack("=H", socket.AF_INET) + pack("!H4s8x", port, socket.inet_aton(ip))
+
+
+def _decode_sockaddr(data):
+    port, ip = unpack_from("!H4s", data, 2)
+    return socket.inet_ntoa(ip), port
+
+
+class BatchSocket(object):
+
+    """
+    Wraps a non-blocking AF_INET UDP socket and receives or sends datagrams in batches.
+
+    The receive buffers are allocated once, when the first batch is received, and reused for every following batch.
+    """
+
+    def __init__(self, sock, batch_size=32, use_mmsg=True):
+        assert isinstance(batch_size, int), type(batch_size)
+        assert batch_size > 0, batch_size
+        self._socket = sock
+        self._batch_size = batch_size
+        self._use_mmsg = use_mmsg and HAS_MMSG
+
+        # receive buffers, set on the first call to recv_batch
+        self._recv_headers = None
+        self._recv_addresses = None
+        self._recv_buffers = None
+        self._recv_iovecs = None
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def use_mmsg(self):
+        return self._use_mmsg
+
+    def _allocate_receive_buffers(self):
+        self._recv_headers = (_MMsgHdr * self._batch_size)()
+        self._recv_addresses = [ctypes.create_string_buffer(_SOCKADDR_IN_SIZE) for _ in xrange(self._batch_size)]
+        self._recv_buffers = [ctypes.create_string_buffer(MAX_DATAGRAM_SIZE) for _ in xrange(self._batch_size)]
+        self._recv_iovecs = (_IOVec * self._batch_size)()
+        for header, address, buf, iovec in zip(self._recv_headers, self._recv_addresses, self._recv_buffers,
+                                               self._recv_iovecs):
+            iovec.iov_base = ctypes.addressof(buf)
+            iovec.iov_len = MAX_DATAGRAM_SIZE
+            header.msg_hdr.msg_name = ctypes.addressof(address)
+            header.msg_hdr.msg_iov = ctypes.pointer(iovec)
+            header.msg_hdr.msg_iovlen = 1
+
+    def recv_batch(self):
+        """
+        Receive up to BATCH_SIZE datagrams without blocking.
+
+        Returns a list with (sock_addr, data) tuples, the list is empty when no datagram is available.  Raises
+        socket.error for errors other than EAGAIN.
+        """
+        if not self._use_mmsg:
+            packets = []
+            try:
+                for _ in xrange(self._batch_size):
+                    data, sock_addr = self._socket.recvfrom(MAX_DATAGRAM_SIZE)
+                    packets.append((sock_addr, data))
+            except socket.error as exception:
+                if exception.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            return packets
+
+        if self._recv_headers is None:
+            self._allocate_receive_buffers()
+
+        for header in self._recv_headers:
+            header.msg_hdr.msg_namelen = _SOCKADDR_IN_SIZE
+
+        count = _recvmmsg(self._socket.fileno(), self._recv_headers, self._batch_size, MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise socket.error(error, errno.errorcode.get(error, str(error)))
+
+        return [(_decode_sockaddr(self._recv_addresses[i].raw),
+                 ctypes.string_at(ctypes.addressof(self._recv_buffers[i]), self._recv_headers[i].msg_len))
+                for i in xrange(count)]
+
+    def send_batch(self, packets):
+        """
+        Send (sock_addr, data) tuples without blocking.
+
+        Returns the number of datagrams that were handed to the kernel, these are always the first datagrams in
+        PACKETS.  Raises socket.error when not even the first datagram could be sent.
+        """
+        assert isinstance(packets, (list, tuple)), type(packets)
+        if not self._use_mmsg:
+            for index, (sock_addr, data) in enumerate(packets):
+                try:
+                    self._socket.sendto(data, sock_addr)
+                except socket.error:
+                    if index == 0:
+                        raise
+                    return index
+            return len(packets)
+
+        sent = 0
+        while sent < len(packets):
+            batch = packets[sent:sent + self._batch_size]
+            headers = (_MMsgHdr * len(batch))()
+            iovecs = (_IOVec * len(batch))()
+            # keep references to the buffers until sendmmsg returns
+            buffers = []
+            for header, iovec, (sock_addr, data) in zip(headers, iovecs, batch):
+                address = ctypes.create_string_buffer(_encode_sockaddr(sock_addr), _SOCKADDR_IN_SIZE)
+                payload = ctypes.c_char_p(data)
+                buffers.append((address, payload))
+                iovec.iov_base = ctypes.cast(payload, ctypes.c_void_p)
+                iovec.iov_len = len(data)
+                header.msg_hdr.msg_name = ctypes.addressof(address)
+                header.msg_hdr.msg_namelen = _SOCKADDR_IN_SIZE
+                header.msg_hdr.msg_iov = ctypes.pointer(iovec)
+                header.msg_hdr.msg_iovlen = 1
+
+            count = _sendmmsg(self._socket.fileno(), headers, len(batch), MSG_DONTWAIT)
+            if count < 0:
+                error = ctypes.get_errno()
+                if sent == 0:
+                    raise socket.error(error, errno.errorcode.get(error, str(error)))
+                break
+
+            sent += count
+            if count < len(batch):
+                break
+
+        return sent
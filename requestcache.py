@@ -1,3 +1,4 @@
+from math import ceil
 from random import random
 import logging
 
@@ -6,6 +7,9 @@ from twisted.python.threadable import isInIOThread
 
 from .taskmanager import TaskManager
 
+# the resolution of the timer wheel in seconds, a cache times out at most this much later than its timeout_delay
+TIMER_WHEEL_RESOLUTION = 0.1
+
 
 class NumberCache(object):
 
@@ -130,6 +134,13 @@ class IntroductionRequestCache(RandomNumberCache):
 
 class RequestCache(TaskManager):
 
+    """
+    Keeps track of outstanding requests, i.e. NumberCache instances, until they are popped or time out.
+
+    The timeouts are kept in a timer wheel with TIMER_WHEEL_RESOLUTION second slots.  A single DelayedCall fires when
+    the earliest slot expires and times out all caches in that slot, rather than scheduling one DelayedCall per cache.
+    """
+
     def __init__(self):
         """
         Creates a new RequestCache instance.
@@ -142,6 +153,13 @@ class RequestCache(TaskManager):
 
         self._identifiers = dict()
 
+        # identifier: tick pairs, and tick: {identifier: cache} slots, where the cache times out at tick *
+        # TIMER_WHEEL_RESOLUTION
+        self._ticks = dict()
+        self._slots = dict()
+        # the tick that the timer wheel DelayedCall fires at, or None when it is not scheduled
+        self._next_tick = None
+
     def add(self, cache):
         """
         Add CACHE into this RequestCache instance.
@@ -163,7 +181,16 @@ class RequestCache(TaskManager):
         else:
             self._logger.debug("add %s", cache)
             self._identifiers[identifier] = cache
-            self.register_task(cache, reactor.callLater(cache.timeout_delay, self._on_timeout, cache))
+
+            tick = int(ceil((reactor.seconds() + cache.timeout_delay) / TIMER_WHEEL_RESOLUTION))
+            self._ticks[identifier] = tick
+            slot = self._slots.get(tick)
+            if slot is None:
+                slot = self._slots[tick] = dict()
+            slot[identifier] = cache
+
+            if self._next_tick is None or tick < self._next_tick:
+                self._schedule_timer_wheel(tick)
             return cache
 
     def has(self, prefix, number):
@@ -195,9 +222,50 @@ class RequestCache(TaskManager):
 
         identifier = self._create_identifier(number, prefix)
         cache = self._identifiers.pop(identifier)
-        self.cancel_pending_task(cache)
+        self._remove_timeout(identifier)
         return cache
 
+    def _remove_timeout(self, identifier):
+        """
+        Removes IDENTIFIER from the timer wheel.
+
+        The timer wheel DelayedCall is left as is, even when no timeouts remain, hence popping a cache does not call
+        the reactor.  When the DelayedCall fires for an empty slot it only reschedules itself for the remaining slots.
+        """
+        tick = self._ticks.pop(identifier, None)
+        # the slot is not available while its caches are timing out
+        slot = self._slots.get(tick)
+        if slot is not None:
+            del slot[identifier]
+            if not slot:
+                del self._slots[tick]
+
+    def _schedule_timer_wheel(self, tick):
+        self._next_tick = tick
+        self.replace_task(u"timer wheel", reactor.callLater(max(0.0, tick * TIMER_WHEEL_RESOLUTION - reactor.seconds()),
+                                                            self._on_timer_wheel))
+
+    def _on_timer_wheel(self):
+        """
+        Times out the caches in all slots that have expired and schedules the timer wheel for the next slot.
+        """
+        assert isInIOThread(), "RequestCache must be used on the reactor's thread"
+        self._next_tick = None
+
+        now = reactor.seconds()
+        for tick in sorted(tick for tick in self._slots if tick * TIMER_WHEEL_RESOLUTION <= now):
+            # on_timeout may pop or add caches, hence the slot is removed before the caches time out
+            for identifier, cache in self._slots.pop(tick, {}).iteritems():
+                # an earlier on_timeout call may have popped CACHE
+                if self._ticks.get(identifier) == tick:
+                    del self._ticks[identifier]
+                    self._on_timeout(cache)
+
+        if self._slots:
+            tick = min(self._slots)
+            if self._next_tick is None or tick < self._next_tick:
+                self._schedule_timer_wheel(tick)
+
     def _on_timeout(self, cache):
         """
         Called CACHE.timeout_delay seconds after CACHE was added to this RequestCache.
@@ -214,11 +282,9 @@ class RequestCache(TaskManager):
 
         # the on_timeout call could have already removed the identifier from the cache using pop
         identifier = self._create_identifier(cache.number, cache.prefix)
-        if identifier in self._identifiers:
+        if self._identifiers.get(identifier) is cache:
             del self._identifiers[identifier]
 
-        self.cancel_pending_task(cache)
-
     def _create_identifier(self, number, prefix):
         return u"%s:%d" % (prefix, number)
 
@@ -232,3 +298,6 @@ class RequestCache(TaskManager):
         self._logger.debug("Clearing %s [%s]", self, len(self._identifiers))
         self.cancel_all_pending_tasks()
         self._identifiers.clear()
+        self._ticks.clear()
+        self._slots.clear()
+        self._next_tick = None
@@ -1,5 +1,6 @@
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
+from math import frexp
 from threading import RLock
 from time import time
 
@@ -60,6 +61,7 @@ class MessageStatistics(object):
         self.drop_count = 0
         self.created_count = 0
         self.outgoing_count = 0
+        self.pruned_count = 0
 
         self.delay_received_count = 0
         self.delay_send_count = 0
@@ -71,6 +73,7 @@ class MessageStatistics(object):
         self.created_dict = None
         self.delay_dict = None
         self.outgoing_dict = None
+        self.pruned_dict = None
 
         self.walk_attempt_count = 0
         self.walk_success_count = 0
@@ -110,6 +113,7 @@ class MessageStatistics(object):
                 self.created_dict = assigned_value()
                 self.drop_dict = assigned_value()
                 self.delay_dict = assigned_value()
+                self.pruned_dict = assigned_value()
 
                 self.walk_failure_dict = assigned_value()
                 self.incoming_intro_dict = assigned_value()
@@ -122,6 +126,7 @@ class MessageStatistics(object):
             self.drop_count = 0
             self.created_count = 0
             self.outgoing_count = 0
+            self.pruned_count = 0
 
             self.delay_received_count = 0
             self.delay_send_count = 0
@@ -143,6 +148,7 @@ class MessageStatistics(object):
                 self.created_dict.clear()
                 self.delay_dict.clear()
                 self.outgoing_dict.clear()
+                self.pruned_dict.clear()
 
                 self.walk_failure_dict.clear()
                 self.incoming_intro_dict.clear()
@@ -170,6 +176,12 @@ class DispersyStatistics(Statistics):
         # nr of candidates introduced/stumbled upon
         self.total_candidates_discovered = 0
 
+        # member cache statistics
+        self.member_cache_hit_count = 0
+        self.dummy_member_cache_hit_count = 0
+        self.member_cache_miss_count = 0
+        self.member_cache_eviction_count = 0
+
         # walk statistics
         self.walk_attempt_count = 0
         self.walk_success_count = 0
@@ -201,6 +213,10 @@ class DispersyStatistics(Statistics):
     def database_version(self):
         return self._dispersy.database.database_version
 
+    @property
+    def pending_task_count(self):
+        return self._dispersy.get_pending_task_count()
+
     @property
     def lan_address(self):
         return self._dispersy.lan_address
@@ -257,6 +273,12 @@ class DispersyStatistics(Statistics):
         self.cur_sendqueue = 0
         self.start = self.timestamp = time()
 
+        # member cache statistics
+        self.member_cache_hit_count = 0
+        self.dummy_member_cache_hit_count = 0
+        self.member_cache_miss_count = 0
+        self.member_cache_eviction_count = 0
+
         # walk statistics
         self.walk_attempt_count = 0
         self.walk_success_count = 0
@@ -337,13 +359,21 @@ class CommunityStatistics(Statistics):
     def global_time(self):
         return self._community.global_time
 
+    @property
+    def pending_task_count(self):
+        return self._community.get_pending_task_count()
+
+    @property
+    def request_cache_pending_task_count(self):
+        return self._community.request_cache.get_pending_task_count()
+
     @property
     def candidates(self):
         now = time()
         return [(candidate.lan_address, candidate.wan_address, candidate.global_time,
                  candidate.get_member().mid if candidate.get_member() else None)
-                for candidate in self._community.candidates.itervalues()
-                if candidate.get_category(now) in [u'walk', u'stumble', u'intro']]
+                for category in (u'walk', u'stumble', u'intro')
+                for candidate in self._community.candidates.get_by_category(category, now)]
 
     def enable_debug_statistics(self, enabled):
         self.msg_statistics.enable(enabled)
@@ -390,4 +420,54 @@ class RuntimeStatistic(object):
         " Returns a dictionary with the statistics. "
         return dict(count=self.count, duration=self.duration, average=self.average, **kargs)
 
+
+class StatementStatistic(RuntimeStatistic):
+
+    """
+    Keeps track of how often and how long a SQL statement was executed, and how many rows it returned or changed.
+
+    The durations are counted in buckets of exponentially increasing size, the first bucket holds durations up to one
+    microsecond and bucket i holds durations up to 2**i microseconds.  Percentiles are estimated from these buckets.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        super(StatementStatistic, self).__init__()
+        self._rows = 0
+        self._buckets = [0] * self.BUCKETS
+
+    @property
+    def rows(self):
+        " Returns the number of rows returned or changed by the statement. "
+        return self._rows
+
+    def increment(self, duration):
+        " Increase self.count with 1 and self.duration with DURATION. "
+        super(StatementStatistic, self).increment(duration)
+        self._buckets[min(max(frexp(duration * 1000000.0)[1], 0), self.BUCKETS - 1)] += 1
+
+    def add_rows(self, rows):
+        " Increase self.rows with ROWS. "
+        self._rows += rows
+
+    def get_percentile(self, percentile):
+        " Returns an upper bound, in seconds, on the duration of PERCENTILE percent of the calls. "
+        assert 0 < percentile <= 100, percentile
+        threshold = self._count * percentile / 100.0
+        seen = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if seen >= threshold:
+                return 2 ** index / 1000000.0
+        return 2 ** (self.BUCKETS - 1) / 1000000.0
+
+    def get_dict(self, **kargs):
+        " Returns a dictionary with the statistics. "
+        return super(StatementStatistic, self).get_dict(rows=self.rows,
+                                                        p50=self.get_percentile(50),
+                                                        p90=self.get_percentile(90),
+                                                        p99=self.get_percentile(99),
+                                                        **kargs)
+
 _runtime_statistics = defaultdict(RuntimeStatistic)
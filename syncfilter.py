@@ -0,0 +1,374 @@
+"""
+The syncfilter module provides the SyncFilterManager that keeps track of the syncable packets of a community.
+
+Claiming a sync bloom filter used to require a database query to select the global time range and a second query to
+hash every packet in that range into a new bloom filter, for every walker step.  The SyncFilterManager keeps the
+global times of all syncable packets in memory to select the range, and caches one bloom filter for every bucket of
+BUCKET_SIZE consecutive global times.  A claimed bloom filter is filled by merging the cached bucket filters, only the
+buckets at the edges of the range and buckets that are not cached yet are read from the database.
+
+All cached bucket filters share the same prefix.  The prefix changes, and the cached filters are discarded, after
+PREFIX_LIFETIME bloom filters have been claimed, ensuring that false positives do not persist.
+
+The SyncFilterManager also caches the sha1 digests of recently used packets, allowing u"digest" mode bloom filters to
+be filled and checked without hashing the (possibly large) packets again.  And it caches the most recent global time
+and sequence number of every member and sequence enabled meta message, allowing the sequence numbers of a batch of
+incoming messages to be checked without counting the packets of each member in the database.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, defaultdict
+from hashlib import sha1
+import logging
+from random import random
+
+from .bloomfilter import BloomFilter
+from .database import get_in_placeholders
+from .distribution import FullSyncDistribution, SyncDistribution
+
+# the number of consecutive global times that share one cached bloom filter
+BUCKET_SIZE = 128
+
+# the maximum number of bucket bloom filters that are cached
+MAX_CACHED_BUCKETS = 256
+
+# the number of claimed bloom filters that use the same prefix
+PREFIX_LIFETIME = 16
+
+# the maximum number of packet digests that are cached
+MAX_CACHED_DIGESTS = 16384
+
+# the maximum number of (member, meta message) sequence numbers that are cached
+MAX_CACHED_SEQUENCE_NUMBERS = 4096
+
+
+class SyncFilterManager(object):
+
+    """
+    Keeps the global times of all syncable packets, i.e. packets with a SyncDistribution and a priority higher than 32
+    that have not been undone, and the bloom filters for recently used global time buckets.
+
+    The syncable packets are loaded from the database when they are first needed.  Afterwards the community must report
+    every change to the sync table using add, remove, invalidate, or reset, and the pruned packets using prune.
+    """
+
+    def __init__(self, community):
+        super(SyncFilterManager, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._community = community
+
+        # the database ids of the syncable meta messages, or None when nothing is loaded
+        self._meta_ids = None
+
+        # sorted global times of all syncable packets and the packet ids they belong to
+        self._global_times = []
+        self._packet_ids = set()
+
+        # bucket: BloomFilter pairs, in least recently used order
+        self._buckets = OrderedDict()
+        self._bloom_arguments = None
+        self._prefix = None
+        self._prefix_claims = 0
+
+        # packet_id: sha1 digest pairs, in least recently used order
+        self._digests = OrderedDict()
+
+        # (member_id, meta_id): (global_time, sequence_number) pairs, in least recently used order
+        self._sequence_numbers = OrderedDict()
+
+        # meta_id: global_time pairs, the packets up to this global time have been removed by prune
+        self._pruned_global_times = {}
+
+    def _load(self):
+        self._meta_ids = set(meta.database_id
+                             for meta in self._community.get_meta_messages()
+                             if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
+        self._global_times = []
+        self._packet_ids = set()
+        self._buckets.clear()
+        self._digests.clear()
+        self._pruned_global_times.clear()
+
+        if self._meta_ids:
+            placeholders, bindings = get_in_placeholders(self._meta_ids)
+            for packet_id, global_time in self._community.dispersy.database.execute(
+                    u"SELECT id, global_time FROM sync WHERE meta_message IN (%s) AND undone = 0 ORDER BY global_time"
+                    % placeholders, bindings):
+                self._global_times.append(global_time)
+                self._packet_ids.add(packet_id)
+
+        self._logger.debug("loaded %d syncable packets", len(self._global_times))
+
+    def __len__(self):
+        """
+        Returns the number of syncable packets.
+        @rtype: int
+        """
+        if self._meta_ids is None:
+            self._load()
+        return len(self._global_times)
+
+    def __contains__(self, packet_id):
+        """
+        Returns True when PACKET_ID is a syncable packet.
+        @rtype: bool
+        """
+        if self._meta_ids is None:
+            self._load()
+        return packet_id in self._packet_ids
+
+    def select(self, global_time, limit, higher=True):
+        """
+        Returns the global times of at most LIMIT syncable packets.
+
+        When HIGHER is True the global times higher than GLOBAL_TIME are returned in ascending order, otherwise the
+        global times lower than GLOBAL_TIME are returned in descending order.
+
+        @rtype: [int or long]
+        """
+        assert isinstance(global_time, (int, long)), type(global_time)
+        assert isinstance(limit, (int, long)), type(limit)
+        assert limit >= 0, limit
+        if self._meta_ids is None:
+            self._load()
+
+        global_times = self._global_times
+        if higher:
+            index = bisect_right(global_times, global_time)
+            return global_times[index:index + limit]
+
+        index = bisect_left(global_times, global_time)
+        selection = global_times[max(0, index - limit):index]
+        selection.reverse()
+        return selection
+
+    def create_bloom_filter(self, m_size, f_error_rate, mode=u"plain"):
+        """
+        Returns a new, empty, BloomFilter that can be filled using fill.
+
+        A new prefix is chosen every PREFIX_LIFETIME calls.
+        @rtype: BloomFilter
+        """
+        self._prefix_claims += 1
+        if self._prefix_claims > PREFIX_LIFETIME or self._bloom_arguments != (m_size, f_error_rate, mode):
+            self._bloom_arguments = (m_size, f_error_rate, mode)
+            self._prefix = chr(int(random() * 256))
+            self._prefix_claims = 1
+            self._buckets.clear()
+
+        return self._create_bloom_filter()
+
+    def _create_bloom_filter(self):
+        m_size, f_error_rate, mode = self._bloom_arguments
+        return BloomFilter(m_size, f_error_rate, prefix=self._prefix, mode=mode)
+
+    def get_digests(self, rows):
+        """
+        Yields a (digest, packet) tuple for every (packet, packet_id) tuple in ROWS, where digest is the sha1 digest of
+        packet.
+
+        The digests are cached by packet id.
+        """
+        digests = self._digests
+        for packet, packet_id in rows:
+            digest = digests.pop(packet_id, None)
+            if digest is None:
+                digest = sha1(packet).digest()
+                if len(digests) >= MAX_CACHED_DIGESTS:
+                    digests.popitem(last=False)
+            digests[packet_id] = digest
+            yield digest, packet
+
+    def get_sequence_number(self, member_id, meta_id):
+        """
+        Returns the (global_time, sequence_number) of the stored packet with the highest sequence number created by
+        MEMBER_ID using meta message META_ID, or (0, 0) when there is no such packet.
+        @rtype: (int or long, int)
+        """
+        key = (member_id, meta_id)
+        sequence_numbers = self._sequence_numbers
+        highest = sequence_numbers.pop(key, None)
+        if highest is None:
+            last_global_time, last_sequence_number, count = self._community.dispersy.database.execute(
+                u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
+                key).next()
+            assert (last_sequence_number or 0) == count, [last_sequence_number, count, meta_id]
+            highest = (last_global_time or 0, last_sequence_number or 0)
+            if len(sequence_numbers) >= MAX_CACHED_SEQUENCE_NUMBERS:
+                sequence_numbers.popitem(last=False)
+        sequence_numbers[key] = highest
+        return highest
+
+    def fill(self, bloom_filter, time_low, time_high):
+        """
+        Adds all syncable packets with a global time between TIME_LOW and TIME_HIGH (inclusive) to BLOOM_FILTER.
+
+        BLOOM_FILTER must be the result of the most recent create_bloom_filter call.
+        """
+        assert isinstance(bloom_filter, BloomFilter), type(bloom_filter)
+        assert bloom_filter.prefix == self._prefix, "BLOOM_FILTER must be created using create_bloom_filter"
+        if self._meta_ids is None:
+            self._load()
+
+        global_times = self._global_times
+        buckets = self._buckets
+
+        # only buckets that are completely within [TIME_LOW, TIME_HIGH] are cached
+        first_bucket = (time_low + BUCKET_SIZE - 1) // BUCKET_SIZE
+        last_bucket = (time_high + 1) // BUCKET_SIZE - 1
+
+        cached = []
+        missing = {}
+        ranges = []
+        append_to_range = False
+
+        # visit every non-empty bucket in the range, jumping over empty global times
+        index = bisect_left(global_times, time_low)
+        end = bisect_right(global_times, time_high)
+        while index < end:
+            global_time = global_times[index]
+            bucket = global_time // BUCKET_SIZE
+            low = bucket * BUCKET_SIZE
+            high = low + BUCKET_SIZE - 1
+
+            if first_bucket <= bucket <= last_bucket and bucket in buckets:
+                # move to the end, i.e. most recently used
+                cached.append(buckets.pop(bucket))
+                buckets[bucket] = cached[-1]
+                append_to_range = False
+
+            else:
+                if first_bucket <= bucket <= last_bucket:
+                    missing[bucket] = self._create_bloom_filter()
+                else:
+                    low = max(low, time_low)
+                    high = min(high, time_high)
+
+                if append_to_range:
+                    ranges[-1][1] = high
+                else:
+                    ranges.append([low, high])
+                append_to_range = True
+
+            index = bisect_right(global_times, high, index, end)
+
+        if ranges:
+            placeholders, bindings = get_in_placeholders(self._meta_ids)
+            sql = u"SELECT global_time, packet, id FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time BETWEEN ? AND ?" % placeholders
+            keys = defaultdict(list)
+            for low, high in ranges:
+                for global_time, packet, packet_id in self._community.dispersy.database.execute(sql, bindings + [low, high]):
+                    bucket = global_time // BUCKET_SIZE
+                    keys[bucket if bucket in missing else None].append((str(packet), packet_id))
+
+            for bucket, rows in keys.iteritems():
+                target = bloom_filter if bucket is None else missing[bucket]
+                if bloom_filter.mode == u"digest":
+                    target.add_digests(digest for digest, _ in self.get_digests(rows))
+                else:
+                    target.add_keys(packet for packet, _ in rows)
+
+            for bucket, bucket_filter in missing.iteritems():
+                buckets[bucket] = bucket_filter
+                cached.append(bucket_filter)
+            while len(buckets) > MAX_CACHED_BUCKETS:
+                buckets.popitem(last=False)
+
+        self._logger.debug("filled [%d:%d] using %d cached and %d new buckets and %d database ranges",
+                           time_low, time_high, len(cached) - len(missing), len(missing), len(ranges))
+        bloom_filter.merge(*cached)
+
+    def add(self, messages):
+        """
+        Adds the syncable MESSAGES that have been stored in the database.
+        """
+        sequence_numbers = self._sequence_numbers
+        if sequence_numbers:
+            for message in messages:
+                if isinstance(message.distribution, FullSyncDistribution.Implementation) and \
+                        message.distribution.enable_sequence_number:
+                    key = (message.authentication.member.database_id, message.database_id)
+                    highest = sequence_numbers.get(key)
+                    if highest is not None and highest[1] < message.distribution.sequence_number:
+                        sequence_numbers[key] = (message.distribution.global_time, message.distribution.sequence_number)
+
+        if self._meta_ids:
+            buckets = self._buckets
+            for message in messages:
+                if message.database_id in self._meta_ids and not message.packet_id in self._packet_ids:
+                    self._packet_ids.add(message.packet_id)
+                    insort(self._global_times, message.distribution.global_time)
+
+                    bucket_filter = buckets.get(message.distribution.global_time // BUCKET_SIZE)
+                    if bucket_filter is not None:
+                        bucket_filter.add(message.packet)
+
+    def remove(self, items, keys=()):
+        """
+        Removes the packets that have been removed from the database or that have been undone.
+
+        @param items: The (packet_id, global_time) pairs of the removed packets.
+        @type items: iterable
+
+        @param keys: The (member_id, meta_id) pairs whose highest sequence number may have changed, i.e. the members
+         and sequence enabled meta messages of the packets that were deleted from the sync table.  Undone packets
+         remain in the sync table and do not change the sequence numbers.
+        @type keys: iterable
+        """
+        for key in keys:
+            self._sequence_numbers.pop(key, None)
+
+        if self._meta_ids:
+            global_times = self._global_times
+            for packet_id, global_time in items:
+                self._digests.pop(packet_id, None)
+                if packet_id in self._packet_ids:
+                    self._packet_ids.remove(packet_id)
+                    index = bisect_left(global_times, global_time)
+                    assert global_times[index] == global_time, [global_times[index], global_time]
+                    del global_times[index]
+                    self._buckets.pop(global_time // BUCKET_SIZE, None)
+
+    def prune(self, pruned_global_times):
+        """
+        Removes the pruned packets that have not been removed from the database yet.
+
+        @param pruned_global_times: meta_id: global_time pairs, the packets of meta message meta_id with a global time
+         lower or equal to global_time are pruned.
+        @type pruned_global_times: dict
+        """
+        if self._meta_ids is None:
+            self._load()
+
+        for meta_id, global_time in pruned_global_times.iteritems():
+            low = self._pruned_global_times.get(meta_id, 0)
+            if meta_id in self._meta_ids and low < global_time:
+                items = list(self._community.dispersy.database.execute(
+                    u"SELECT id, global_time FROM sync WHERE meta_message = ? AND global_time > ? AND global_time <= ? AND undone = 0",
+                    (meta_id, low, global_time)))
+                if items:
+                    self.remove(items)
+                self._pruned_global_times[meta_id] = global_time
+
+    def invalidate(self, packet_id, global_time, keys=()):
+        """
+        Discards the cached digest of PACKET_ID and the cached bloom filter that contains GLOBAL_TIME, i.e. because the
+        binary packet has been replaced.  KEYS are the (member_id, meta_id) pairs whose highest sequence number may
+        have changed, i.e. when the packet has been replaced by a packet from another member.
+        """
+        for key in keys:
+            self._sequence_numbers.pop(key, None)
+        self._digests.pop(packet_id, None)
+        self._buckets.pop(global_time // BUCKET_SIZE, None)
+
+    def reset(self):
+        """
+        Discards everything.  The syncable packets will be loaded from the database when they are needed again.
+        """
+        self._meta_ids = None
+        self._global_times = []
+        self._packet_ids = set()
+        self._buckets.clear()
+        self._digests.clear()
+        self._sequence_numbers.clear()
+        self._pruned_global_times.clear()
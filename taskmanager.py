@@ -7,20 +7,19 @@ from twisted.internet.defer import Deferred
 from twisted.internet.task import LoopingCall
 
 
-CLEANUP_FREQUENCY = 100
-
-
 class TaskManager(object):
 
     """
     Provides a set of tools to mantain a list of twisted "tasks" (Deferred, LoopingCall, DelayedCall) that are to be
     executed during the lifetime of an arbitrary object, usually getting killed with it.
+
+    DelayedCalls and Deferreds remove themselves from the list once they have fired, LoopingCalls remain in the list
+    until they are canceled or replaced.
     """
     _reactor = reactor
 
     def __init__(self):
         self._pending_tasks = {}
-        self._cleanup_counter = CLEANUP_FREQUENCY
         self._task_lock = Lock()
 
     def replace_task(self, name, task):
@@ -49,23 +48,48 @@ class TaskManager(object):
             else:
                 raise ValueError("Expecting Deferred or LoopingCall if task is delayed")
 
-            task = (dc, task)
+            registered = (dc, task)
+        else:
+            registered = task
+
+        with self._task_lock:
+            self._pending_tasks[name] = registered
+
+        if isinstance(task, Deferred):
+            task.addBoth(self._on_task_finished, name, registered)
+        elif isinstance(task, DelayedCall):
+            func = task.func
+
+            def call_and_remove(*args, **kargs):
+                self._remove_finished_task(name, registered)
+                return func(*args, **kargs)
+            task.func = call_and_remove
+
+        return registered
+
+    def _on_task_finished(self, result, name, task):
+        self._remove_finished_task(name, task)
+        return result
 
-        self._maybe_clean_task_list()
+    def _remove_finished_task(self, name, task):
+        """
+        Removes the named task, unless it has been replaced by another task in the meantime.
+        """
         with self._task_lock:
-            self._pending_tasks[name] = task
-        return task
+            if self._pending_tasks.get(name) is task:
+                del self._pending_tasks[name]
 
     @blocking_call_on_reactor_thread
     def cancel_pending_task(self, name):
         """
         Cancels the named task
         """
-        self._maybe_clean_task_list()
-        is_active, stopfn = self._get_isactive_stopper(name)
+        with self._task_lock:
+            task = self._pending_tasks.pop(name, None)
+
+        is_active, stopfn = self._get_isactive_stopper(task)
         if is_active and stopfn:
             stopfn()
-            self._pending_tasks.pop(name)
 
     def cancel_all_pending_tasks(self):
         """
@@ -82,43 +106,32 @@ class TaskManager(object):
         """
         Return a boolean determining if a task is active.
         """
-        return self._get_isactive_stopper(name)[0]
+        return self._get_isactive_stopper(self._pending_tasks.get(name, None))[0]
 
-    def _get_isactive_stopper(self, name):
+    def get_pending_task_count(self):
         """
-        Return a boolean determining if a task is active and its cancel/stop method if the task is registered.
+        Return the number of tasks that are registered with this TaskManager and have not finished yet.
         """
-        task = self._pending_tasks.get(name, None)
-
-        def do_get(task):
-            if isinstance(task, Deferred):
-                # Have in mind that any deferred in the pending tasks list should have been constructed with a
-                # canceller function.
-                return not task.called, getattr(task, 'cancel', None)
-            elif isinstance(task, DelayedCall):
-                return task.active(), task.cancel
-            elif isinstance(task, LoopingCall):
-                return task.running, task.stop
-            elif isinstance(task, tuple):
-                if task[0].active():
-                    return task[0].active(), task[0].cancel
-                else:
-                    return do_get(task[1])
-            else:
-                return False, None
+        return len(self._pending_tasks)
 
-        return do_get(task)
-
-    def _maybe_clean_task_list(self):
+    def _get_isactive_stopper(self, task):
         """
-        Removes finished tasks from the task list.
+        Return a boolean determining if TASK is active and its cancel/stop method if the task is registered.
         """
-        if self._cleanup_counter:
-            self._cleanup_counter -= 1
+        if isinstance(task, Deferred):
+            # Have in mind that any deferred in the pending tasks list should have been constructed with a
+            # canceller function.
+            return not task.called, getattr(task, 'cancel', None)
+        elif isinstance(task, DelayedCall):
+            return task.active(), task.cancel
+        elif isinstance(task, LoopingCall):
+            return task.running, task.stop
+        elif isinstance(task, tuple):
+            if task[0].active():
+                return task[0].active(), task[0].cancel
+            else:
+                return self._get_isactive_stopper(task[1])
         else:
-            self._cleaup_counter = CLEANUP_FREQUENCY
-            for name in self._pending_tasks.keys():
-                if not self.is_pending_task_active(name):
-                    self._pending_tasks.pop(name)
+            return False, None
 
 __all__ = ["TaskManager"]
@@ -9,6 +9,8 @@ class DebugCommunityConversion(BinaryConversion):
     """
     DebugCommunityConversion is used to convert messages to and from binary while performing unittests.
     """
+    decode_from_buffer = True
+
     def __init__(self, community, version="\x01"):
         assert isinstance(version, str), type(version)
         assert len(version) == 1, len(version)
@@ -297,6 +297,14 @@ class DebugNode(object):
 
         returnValue(messages)
 
+    @blocking_call_on_reactor_thread
+    def prune_sync_table(self):
+        """
+        Removes all pruned packets from the database, rather than waiting for the periodic pruning.
+        """
+        while not self._community.prune_sync_table():
+            pass
+
     @blocking_call_on_reactor_thread
     def decode_message(self, candidate, packet):
         return self._community.get_conversion_for_packet(packet).decode_message(candidate, packet)
@@ -595,7 +603,7 @@ class DebugNode(object):
         return meta.impl(distribution=(global_time,), payload=(member, global_time))
 
     @blocking_call_on_reactor_thread
-    def create_introduction_request(self, destination, source_lan, source_wan, advice, connection_type, sync, identifier, global_time=None):
+    def create_introduction_request(self, destination, source_lan, source_wan, advice, connection_type, sync, identifier, global_time=None, bloom_filter_mode=u"plain"):
         """
         Returns a new dispersy-introduction-request message.
         """
@@ -614,7 +622,7 @@ class DebugNode(object):
             assert isinstance(offset, int)
             assert isinstance(bloom_packets, list)
             assert all(isinstance(packet, str) for packet in bloom_packets)
-            bloom_filter = BloomFilter(512 * 8, 0.001, prefix="x")
+            bloom_filter = BloomFilter(512 * 8, 0.001, prefix="x", mode=bloom_filter_mode)
             for packet in bloom_packets:
                 bloom_filter.add(packet)
             sync = (time_low, time_high, modulo, offset, bloom_filter)
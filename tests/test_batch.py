@@ -87,3 +87,20 @@ class TestBatch(DispersyTestFunc):
 
         if self._big_batch_took and self._small_batches_took:
             self.assertSmaller(self._big_batch_took, self._small_batches_took * 1.1)
+
+    def test_prefetch_members(self):
+        """
+        The members of a batch must be resolved to the same members that get_member returns.
+        """
+        node, other, unknown = self.create_nodes(3)
+        other.send_identity(node)
+
+        messages = [node.create_full_sync_text("prefetch", 10), unknown.create_full_sync_text("prefetch", 10),
+                    node.create_bin_key_text("prefetch", 11)]
+        conversion = other.call(other.community.get_conversion_for_packet, messages[0].packet)
+        batch = [(node.my_candidate, message.packet, conversion, u"test") for message in messages]
+
+        prefetched = other.call(other.community._prefetch_members, batch)
+        self.assertEqual(prefetched, {node.my_mid: other.call(other.community.get_member, mid=node.my_mid),
+                                      unknown.my_mid: None})
+        self.assertIsNotNone(prefetched[node.my_mid])
@@ -1,3 +1,4 @@
+from hashlib import sha1
 from unittest import TestCase
 
 from ..bloomfilter import BloomFilter
@@ -116,3 +117,74 @@ class TestBloomFilter(TestCase):
             self.assertTrue(all(str(i) in bloom for i in xrange(n_capacity)))
             false_positives = sum(str(i) in bloom for i in xrange(n_capacity, n_capacity + 10000))
             self.assertAlmostEqual(1.0 * false_positives / 10000, f_error_rate, delta=0.05)
+
+    def test_binary_representation(self):
+        """
+        Testing that BloomFilter.bytes matches the representation of a python long bit set.
+        """
+        bloom = BloomFilter(128 * 8, 0.25, "p")
+        keys = [str(i) for i in xrange(100)]
+        bloom.add_keys(keys)
+
+        # build the same filter using a python long, i.e. the original representation
+        filter_ = 0
+        for key in keys:
+            hash_ = bloom._salt.copy()
+            hash_.update(key)
+            for pos in bloom._fmt_unpack(hash_.digest()):
+                filter_ |= 1 << (pos % bloom.size)
+        hex_ = "%x" % filter_
+        bytes_ = ("0" * (bloom.size / 4 - len(hex_)) + hex_).decode("HEX")[::-1]
+
+        self.assertEqual(bloom.bytes, bytes_)
+        self.assertEqual(bloom.bits_checked, bin(filter_).count("1"))
+
+        # add and add_keys must set the same bits
+        single = BloomFilter(128 * 8, 0.25, "p")
+        for key in keys:
+            single.add(key)
+        self.assertEqual(single.bytes, bytes_)
+
+    def test_merge(self):
+        """
+        Testing that merging bloom filters results in the same bits as adding all keys to one filter.
+        """
+        keys = [str(i) for i in xrange(300)]
+        expected = BloomFilter(128 * 8, 0.25, "p")
+        expected.add_keys(keys)
+
+        bloom = BloomFilter(128 * 8, 0.25, "p")
+        bloom.add_keys(keys[:100])
+        others = [BloomFilter(128 * 8, 0.25, "p") for _ in xrange(2)]
+        others[0].add_keys(keys[100:200])
+        others[1].add_keys(keys[200:])
+        bloom.merge(*others)
+
+        self.assertEqual(bloom.bytes, expected.bytes)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_digest_mode(self):
+        """
+        Testing that a u"digest" mode bloom filter derives the bit positions from the sha1 digests of the keys.
+        """
+        keys = [str(i) * 100 for i in xrange(100)]
+        digests = [sha1(key).digest() for key in keys]
+
+        bloom = BloomFilter(128 * 8, 0.25, "p", mode=u"digest")
+        bloom.add_keys(keys[:50])
+        bloom.add_digests(digests[50:])
+        self.assertEqual(bloom.mode, u"digest")
+        self.assertTrue(all(key in bloom for key in keys))
+
+        # the same bits as a u"plain" bloom filter filled with the digests
+        plain = BloomFilter(128 * 8, 0.25, "p")
+        plain.add_keys(digests)
+        self.assertEqual(bloom.bytes, plain.bytes)
+
+        # the mode must survive serialisation
+        clone = BloomFilter(bloom.bytes, bloom.functions, bloom.prefix, mode=bloom.mode)
+        others = [str(i) * 100 for i in xrange(100, 200)]
+        self.assertEqual(list(clone.not_filter((key,) for key in keys)), [])
+        self.assertEqual(list(clone.not_filter_digests((digest, key) for digest, key in zip(digests, keys))), [])
+        self.assertEqual(list(clone.not_filter((key,) for key in others)),
+                         [(key,) for key in others if not key in clone])
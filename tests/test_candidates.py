@@ -10,7 +10,7 @@
 from itertools import combinations, islice
 from time import time
 
-from ..candidate import CANDIDATE_ELIGIBLE_DELAY
+from ..candidate import CANDIDATE_ELIGIBLE_DELAY, CANDIDATE_INTRO_LIFETIME, CANDIDATE_WALK_LIFETIME
 from ..tracker.community import TrackerCommunity
 from ..util import blocking_call_on_reactor_thread
 from .debugcommunity.community import DebugCommunity
@@ -649,3 +649,33 @@ class TestCandidates(DispersyTestFunc):
             got.append(candidate.wan_address)
 
         self.assertEquals(expected, got)
+
+    @blocking_call_on_reactor_thread
+    def test_registry_categories(self):
+        """
+        The categories maintained by the candidate registry must equal candidate.get_category when time passes.
+        """
+        all_flags = ["", "s", "i", "d", "wr", "si", "sd", "id", "wrsid"]
+        candidates = self.create_candidates(self._community, all_flags)
+        now = self.set_timestamps(candidates, all_flags)
+        registry = self._community.candidates
+
+        for offset in (0.0, 1.0, CANDIDATE_INTRO_LIFETIME, 30.0, CANDIDATE_WALK_LIFETIME, 60.0, 200.0):
+            for category in (u"walk", u"stumble", u"intro", u"discovered", None):
+                expected = [candidate for candidate in candidates if candidate.get_category(now + offset) == category]
+                self.assertEqual(sorted(registry.get_by_category(category, now + offset)), sorted(expected))
+
+            # updating a timestamp moves the candidate back into an active category
+            if offset == 60.0:
+                candidates[0].intro(now + offset)
+                self.assertEqual(registry.get_category(candidates[0], now + offset), u"intro")
+
+    @blocking_call_on_reactor_thread
+    def test_slots(self):
+        """
+        WalkCandidate instances must not have an instance dictionary.
+        """
+        candidate, = self.create_candidates(self._community, [""])
+        self.assertFalse(hasattr(candidate, "__dict__"))
+        with self.assertRaises(AttributeError):
+            candidate.unknown_attribute = None
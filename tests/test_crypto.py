@@ -1,6 +1,9 @@
 from unittest import TestCase
 
-from ..crypto import ECCrypto
+from nose.twistedtools import deferred
+from twisted.internet.defer import Deferred, inlineCallbacks
+
+from ..crypto import ECCrypto, SignatureVerifier
 
 
 class TestLowLevelCrypto(TestCase):
@@ -76,3 +79,93 @@ class TestLowLevelCrypto(TestCase):
             # print >> sys.stderr, curve, "verify", time() - t3, "sign", t3 - t2, "genkey", t2 - t1
 
             assert all(verfified)
+
+
+class _VerifyingMember(object):
+
+    def __init__(self, crypto, ec):
+        self._crypto = crypto
+        self._ec = ec
+        self.public_key = crypto.key_to_bin(ec.pub())
+        self.signature_length = crypto.get_signature_length(ec)
+
+    def verify(self, data, signature):
+        return self._crypto.is_valid_signature(self._ec, data, signature)
+
+
+class TestSignatureVerifier(TestCase):
+
+    def _create_checks(self):
+        crypto = ECCrypto()
+        ec = crypto.generate_key(u"very-low")
+        member = _VerifyingMember(crypto, ec)
+
+        checks = []
+        for i in xrange(20):
+            data = "data-%d" % i
+            signature = crypto.create_signature(ec, data)
+            if i % 2:
+                # the signed data is often a buffer, these must also be verified by the worker processes
+                data = buffer("--" + data, 2)
+            if i % 3 == 0:
+                signature = "-" * len(signature)
+            checks.append((member, data, signature))
+        # a signature with an invalid length
+        checks.append((member, "data", "-"))
+        return checks, [i % 3 != 0 for i in xrange(20)] + [False]
+
+    def _verify_batch(self, verifier):
+        checks, expected = self._create_checks()
+        self.assertEqual(verifier.verify(checks), expected)
+
+    def test_inline(self):
+        self._verify_batch(SignatureVerifier(ECCrypto()))
+
+    def test_processes(self):
+        verifier = SignatureVerifier(ECCrypto(), processes=2, threshold=1)
+        verifier.open()
+        try:
+            self._verify_batch(verifier)
+        finally:
+            verifier.close()
+
+    @deferred(timeout=10)
+    @inlineCallbacks
+    def test_processes_async(self):
+        """
+        Batches verified by the worker processes do not block the calling thread.
+        """
+        verifier = SignatureVerifier(ECCrypto(), processes=2, threshold=1)
+        verifier.open()
+        try:
+            checks, expected = self._create_checks()
+            deferred = verifier.verify_async(checks)
+            self.assertIsInstance(deferred, Deferred)
+            results = yield deferred
+            self.assertEqual(results, expected)
+        finally:
+            verifier.close()
+
+    def test_inline_async(self):
+        """
+        Small batches are verified immediately.
+        """
+        checks, expected = self._create_checks()
+        self.assertEqual(SignatureVerifier(ECCrypto()).verify_async(checks), expected)
+
+    def test_verified_packets(self):
+        """
+        Packets are only considered verified when the same members were used.
+        """
+        crypto = ECCrypto()
+        member = _VerifyingMember(crypto, crypto.generate_key(u"very-low"))
+        member.database_id = 1
+        other = _VerifyingMember(crypto, crypto.generate_key(u"very-low"))
+        other.database_id = 2
+
+        verifier = SignatureVerifier(crypto)
+        self.assertFalse(verifier.is_verified("packet", [(member, "data", "signature")]))
+        verifier.set_verified("packet", [(member, "data", "signature")])
+        self.assertTrue(verifier.is_verified("packet", [(member, "data", "signature")]))
+        self.assertFalse(verifier.is_verified("packet", [(other, "data", "signature")]))
+        self.assertFalse(verifier.is_verified("other packet", [(member, "data", "signature")]))
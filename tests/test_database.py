@@ -0,0 +1,218 @@
+import os
+import shutil
+from sqlite3 import OperationalError
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from nose.twistedtools import reactor, threaded_reactor
+
+from ..database import Database, DatabaseExecutor, StatementCursor, get_in_placeholders, normalize_statement
+from ..dispersydatabase import LATEST_VERSION, DispersyDatabase
+from ..statistics import StatementStatistic, _runtime_statistics
+from ..util import blockingCallFromThread
+
+
+class ItemDatabase(Database):
+
+    def check_database(self, database_version):
+        self.executescript(u"CREATE TABLE IF NOT EXISTS item(id INTEGER PRIMARY KEY, value TEXT UNIQUE);")
+        return 1
+
+
+class TestDatabase(TestCase):
+
+    def setUp(self):
+        super(TestDatabase, self).setUp()
+        self.database = ItemDatabase(u":memory:")
+        self.database.open()
+
+    def tearDown(self):
+        super(TestDatabase, self).tearDown()
+        self.database.close()
+
+    def test_in_placeholders(self):
+        self.assertEqual(get_in_placeholders([1]), (u"?", [1]))
+        self.assertEqual(get_in_placeholders(xrange(3)), (u"?, ?, ?, ?", [0, 1, 2, 2]))
+        self.assertEqual(len(set(get_in_placeholders(xrange(count))[0] for count in xrange(129, 257))), 1)
+
+        self.database.executemany(u"INSERT INTO item (value) VALUES (?)", [(u"item-%d" % i,) for i in xrange(10)])
+        placeholders, bindings = get_in_placeholders([1, 3, 5])
+        self.assertEqual(list(self.database.execute(u"SELECT id FROM item WHERE id IN (%s) ORDER BY id" % placeholders,
+                                                    bindings)),
+                         [(1,), (3,), (5,)])
+
+    def test_normalize_statement(self):
+        self.assertEqual(normalize_statement(u"SELECT *\n  FROM item WHERE id IN (?, ?,?) AND value = ?"),
+                         u"SELECT * FROM item WHERE id IN (?...) AND value = ?")
+
+    def test_statement_statistics(self):
+        """
+        Statements are counted per normalized statement, including the number of rows they return or change.
+        """
+        def get_counts(function_name, statement):
+            statistic = _runtime_statistics[u"ItemDatabase.%s %s [:memory:]" % (function_name, statement)]
+            return statistic.count, getattr(statistic, "rows", 0)
+
+        statements = [(u"executemany", u"INSERT INTO item (value) VALUES (?)"),
+                      (u"execute", u"SELECT id FROM item WHERE id IN (?...)"),
+                      (u"execute", u"UPDATE item SET value = value || '!' WHERE id > 7")]
+        before = [get_counts(*statement) for statement in statements]
+
+        self.database.executemany(u"INSERT INTO item (value) VALUES (?)", [(u"item-%d" % i,) for i in xrange(10)])
+        for count in xrange(2, 6):
+            placeholders, bindings = get_in_placeholders(xrange(1, count + 1))
+            self.assertEqual(len(self.database.execute(u"SELECT id FROM item WHERE id IN (%s)" % placeholders,
+                                                       bindings).fetchall()), count)
+        self.database.execute(u"UPDATE item SET value = value || '!' WHERE id > 7")
+
+        after = [get_counts(*statement) for statement in statements]
+        self.assertEqual([(count - count_before, rows - rows_before)
+                          for (count_before, rows_before), (count, rows) in zip(before, after)],
+                         [(1, 10), (4, 14), (1, 3)])
+
+    def test_statement_cursor(self):
+        """
+        Every execution is counted once, when its rows are exhausted or its cursor is closed.
+        """
+        statistic = self.database._get_statement_statistic(u"execute", u"SELECT value FROM item ORDER BY id")
+        self.database.executemany(u"INSERT INTO item (value) VALUES (?)", [(u"item-%d" % i,) for i in xrange(10)])
+        count_before, rows_before = statistic.count, statistic.rows
+
+        cursor = self.database.execute(u"SELECT value FROM item ORDER BY id")
+        self.assertIsInstance(cursor, StatementCursor)
+        self.assertEqual(cursor.next(), (u"item-0",))
+        self.assertEqual(cursor.fetchmany(2), [(u"item-1",), (u"item-2",)])
+        self.assertEqual(statistic.count, count_before)
+        cursor.close()
+        cursor.close()
+        self.assertEqual((statistic.count - count_before, statistic.rows - rows_before), (1, 3))
+
+        self.assertEqual(len(list(self.database.execute(u"SELECT value FROM item ORDER BY id"))), 10)
+        self.assertEqual((statistic.count - count_before, statistic.rows - rows_before), (2, 13))
+
+        self.assertIsInstance(self.database.execute(u"UPDATE item SET value = value || '!'"), StatementCursor)
+
+    def test_statement_statistic_percentiles(self):
+        statistic = StatementStatistic()
+        for _ in xrange(90):
+            statistic.increment(0.000003)
+        for _ in xrange(10):
+            statistic.increment(0.1)
+
+        self.assertEqual(statistic.get_percentile(50), 0.000004)
+        self.assertEqual(statistic.get_percentile(90), 0.000004)
+        self.assertGreaterEqual(statistic.get_percentile(99), 0.1)
+        self.assertLess(statistic.get_percentile(99), 0.2)
+        self.assertEqual(sorted(statistic.get_dict()), [u"average", u"count", u"duration", u"p50", u"p90", u"p99", u"rows"])
+
+
+class TestDatabaseExecutor(TestCase):
+
+    def setUp(self):
+        super(TestDatabaseExecutor, self).setUp()
+        threaded_reactor()
+        self.directory = mkdtemp(suffix="_dispersy_test_database")
+        self.database = ItemDatabase(unicode(os.path.join(self.directory, "test.db")))
+        self.database.open()
+        self.executor = DatabaseExecutor(self.database, readers=2)
+        self.executor.open()
+
+    def tearDown(self):
+        super(TestDatabaseExecutor, self).tearDown()
+        self.executor.close()
+        self.database.close()
+        shutil.rmtree(self.directory)
+
+    def wait(self, deferred):
+        return blockingCallFromThread(reactor, lambda: deferred)
+
+    def test_read_committed_changes(self):
+        """
+        Reads on the executor threads see the changes once the database connection has committed them, reads never
+        commit the database connection.
+        """
+        self.assertTrue(self.executor.threaded)
+        self.database.executemany(u"INSERT INTO item (value) VALUES (?)", [(u"item-%d" % i,) for i in xrange(10)])
+        self.assertEqual(self.wait(self.executor.fetchone(u"SELECT COUNT(*) FROM item")), (0,))
+
+        self.database.commit()
+        self.assertEqual(self.wait(self.executor.fetchone(u"SELECT COUNT(*) FROM item")), (10,))
+        self.assertEqual(self.wait(self.executor.fetchall(u"SELECT value FROM item WHERE id <= 2 ORDER BY id")),
+                         [(u"item-0",), (u"item-1",)])
+        self.assertIsNone(self.wait(self.executor.fetchone(u"SELECT value FROM item WHERE id = 42")))
+
+    def test_run_interaction(self):
+        def select(execute, limit):
+            # stop halfway, the unfinished cursor is closed by the executor
+            return [value for value, in execute(u"SELECT value FROM item ORDER BY id LIMIT ?", (limit,))][:limit // 2]
+
+        self.database.executemany(u"INSERT INTO item (value) VALUES (?)", [(u"item-%d" % i,) for i in xrange(10)])
+        self.database.commit()
+        self.assertEqual(self.wait(self.executor.run_interaction(select, 4)), [u"item-0", u"item-1"])
+
+    def test_readers_are_read_only(self):
+        self.assertRaises(OperationalError, self.wait, self.executor.fetchall(u"INSERT INTO item (value) VALUES ('x')"))
+
+    def test_memory_database(self):
+        """
+        Operations on an in-memory database run on the database connection and have already fired.
+        """
+        database = ItemDatabase(u":memory:")
+        database.open()
+        executor = DatabaseExecutor(database)
+        executor.open()
+        try:
+            self.assertFalse(executor.threaded)
+
+            # the reads see the uncommitted changes of the database connection
+            database.execute(u"INSERT INTO item (value) VALUES (?)", (u"item",))
+            deferred = executor.fetchall(u"SELECT id, value FROM item")
+            self.assertTrue(deferred.called)
+            self.assertEqual(deferred.result, [(1, u"item")])
+
+        finally:
+            executor.close()
+            database.close()
+
+
+class TestDispersyDatabase(TestCase):
+
+    def setUp(self):
+        super(TestDispersyDatabase, self).setUp()
+        self.directory = mkdtemp(suffix="_dispersy_test_database")
+        self.file_path = unicode(os.path.join(self.directory, "dispersy.db"))
+
+    def tearDown(self):
+        super(TestDispersyDatabase, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def get_sequence_index(self, database):
+        return list(database.execute(u"SELECT name FROM sqlite_master WHERE type = 'index' AND "
+                                     u"name = 'sync_member_meta_message_sequence_index'"))
+
+    def test_upgrade_sequence_index(self):
+        """
+        Upgrading a version 21 database adds the index used by the sequence number lookups.
+        """
+        database = DispersyDatabase(self.file_path)
+        database.open()
+        database.executescript(u"""
+DROP INDEX sync_member_meta_message_sequence_index;
+UPDATE option SET value = '21' WHERE key = 'database_version';""")
+        database.commit()
+        self.assertEqual(self.get_sequence_index(database), [])
+        database.close()
+
+        database = DispersyDatabase(self.file_path)
+        database.open()
+        try:
+            self.assertEqual(database.database_version, LATEST_VERSION)
+            self.assertEqual(self.get_sequence_index(database), [(u"sync_member_meta_message_sequence_index",)])
+
+            plan = u" ".join(row[-1] for row in database.execute(
+                u"EXPLAIN QUERY PLAN SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync "
+                u"WHERE member = ? AND meta_message = ?", (1, 1)))
+            self.assertIn(u"COVERING INDEX sync_member_meta_message_sequence_index", plan)
+
+        finally:
+            database.close()
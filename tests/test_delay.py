@@ -0,0 +1,134 @@
+from ..message import DelayPacket
+from .dispersytestclass import DispersyTestFunc
+
+
+class RecordingDelay(DelayPacket):
+
+    """
+    Delays a packet until messages matching all MATCH_INFO keys are received, counting the callbacks.
+    """
+
+    def __init__(self, community, match_info, resume_immediately=False):
+        super(RecordingDelay, self).__init__(community, "Recording delay")
+        self._match_info = match_info
+        self._resume_immediately = resume_immediately
+        self.requests = 0
+        self.successes = 0
+        self.timeouts = 0
+
+    @property
+    def match_info(self):
+        return self._match_info
+
+    @property
+    def resume_immediately(self):
+        return self._resume_immediately
+
+    def send_request(self, community, candidate):
+        self.requests += 1
+
+    def on_success(self):
+        self.successes += 1
+        return super(RecordingDelay, self).on_success()
+
+    def on_timeout(self):
+        self.timeouts += 1
+
+
+class TestDelay(DispersyTestFunc):
+
+    def _delay(self, node, source, message, match_info, resume_immediately=False, age=0.0):
+        """
+        Delays the packet of MESSAGE, received by NODE from SOURCE AGE seconds ago, until messages matching MATCH_INFO
+        are received.
+        """
+        def delay():
+            community = node._community
+            delay = RecordingDelay(community, [(community.cid,) + key for key in match_info], resume_immediately)
+            delay._timestamp -= age
+            node._dispersy._delay(delay, message.packet, source.my_candidate)
+            return delay
+        return node.call(delay)
+
+    def _assert_no_delays(self, node):
+        community = node._community
+        self.assertEqual(dict(community._delayed_key), {})
+        self.assertEqual(dict(community._delayed_value), {})
+        self.assertEqual(dict(community._delayed_patterns), {})
+
+    def test_resume_wildcard(self):
+        """
+        A packet that waits for any full-sync-text message is resumed by the full-sync-text message of another
+        member at another global time.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        delayed = other.create_full_sync_text("Delayed", 10)
+        delay = self._delay(node, other, delayed, [(u"full-sync-text", None, None, [])])
+        self.assertEqual(delay.requests, 1)
+        node.assert_not_stored(delayed)
+
+        # a different message does not match the pattern
+        node.give_message(other.create_last_1_test("Unrelated", 20), other)
+        self.assertEqual(delay.successes, 0)
+        node.assert_not_stored(delayed)
+
+        node.give_message(node.create_full_sync_text("Resume", 30), node)
+        self.assertEqual(delay.successes, 1)
+        node.assert_is_stored(delayed)
+        node.call(self._assert_no_delays, node)
+
+    def test_timeout(self):
+        """
+        Delayed packets are dropped once they have been delayed for more than ten seconds, the others remain.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        expired_message = other.create_full_sync_text("Expired", 10)
+        expired = self._delay(node, other, expired_message, [(u"full-sync-text", None, 100, [])], age=20.0)
+        waiting_message = other.create_full_sync_text("Waiting", 11)
+        waiting = self._delay(node, other, waiting_message, [(u"full-sync-text", None, 101, [])])
+
+        node.call(node._community._periodically_clean_delayed)
+        self.assertEqual(expired.timeouts, 1)
+        self.assertEqual(waiting.timeouts, 0)
+
+        # only WAITING can be resumed
+        node.give_message(other.create_full_sync_text("Resume #100", 100), other)
+        node.give_message(other.create_full_sync_text("Resume #101", 101), other)
+        self.assertEqual(expired.successes, 0)
+        self.assertEqual(waiting.successes, 1)
+        node.assert_not_stored(expired_message)
+        node.assert_is_stored(waiting_message)
+        node.call(self._assert_no_delays, node)
+
+        # the heap entry of EXPIRED is gone, it must not time out again
+        node.call(node._community._periodically_clean_delayed)
+        self.assertEqual(expired.timeouts, 1)
+
+    def test_resume_once(self):
+        """
+        A packet that waits for messages matching several patterns is resumed only once, even when one message
+        matches all of them.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        immediate_message = other.create_full_sync_text("Immediately", 10)
+        immediate = self._delay(node, other, immediate_message,
+                                [(u"full-sync-text", None, None, []),
+                                 (None, node.my_member.mid, 30, []),
+                                 (u"full-sync-text", node.my_member.mid, None, [])],
+                                resume_immediately=True)
+        all_message = other.create_full_sync_text("All patterns", 11)
+        all_ = self._delay(node, other, all_message,
+                           [(u"full-sync-text", None, None, []),
+                            (None, node.my_member.mid, 30, [])])
+
+        node.give_messages([node.create_full_sync_text("Resume", 30), node.create_full_sync_text("Again", 31)], node)
+        self.assertEqual(immediate.successes, 1)
+        self.assertEqual(all_.successes, 1)
+        node.assert_is_stored(messages=[immediate_message, all_message])
+        node.call(self._assert_no_delays, node)
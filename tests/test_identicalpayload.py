@@ -42,3 +42,25 @@ class TestIdenticalPayload(DispersyTestFunc):
         other.give_message(message, node)
 
         other.assert_is_stored(message)
+
+    def test_drop_identical_batch(self):
+        """
+        NODE sends OTHER a batch with messages that OTHER already has, a message with an identical payload but a
+        different signature, and new messages.  Only the new messages are stored, and only the highest binary packet
+        of the identical payload is kept.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        messages = [node.create_full_sync_text("Message #%d" % i, 10 + i) for i in xrange(20)]
+        other.give_messages(messages[:10], node)
+
+        resigned = node.create_full_sync_text("Message #0", 10)
+        self.assertNotEqual(messages[0].packet, resigned.packet, "the signature must make the messages unique")
+        other.give_messages([resigned] + messages[5:], node)
+
+        other.assert_is_stored(messages=messages[1:])
+        dropped, kept = sorted([messages[0], resigned], key=lambda message: message.packet)
+        other.assert_is_stored(kept)
+        other.assert_not_stored(dropped)
+        self.assertEqual(other.count_messages(messages[0]), 20)
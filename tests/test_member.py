@@ -1,5 +1,6 @@
 from .dispersytestclass import DispersyTestFunc
-from ..util import call_on_reactor_thread
+from ..member import Member
+from ..util import blocking_call_on_reactor_thread, call_on_reactor_thread
 
 
 class TestMember(DispersyTestFunc):
@@ -68,6 +69,11 @@ class TestMember(DispersyTestFunc):
         self.assertFalse(member.verify("0123456789", self._dispersy.crypto.create_signature(ec, "12345678"), offset=1, length=666))
         self.assertFalse(member.verify("0123456789E", self._dispersy.crypto.create_signature(ec, "12345678"), offset=1, length=666))
 
+        # sign and verify a buffer over "0123456789"[1:9], as used while decoding a packet
+        self.assertTrue(member.verify(buffer("0123456789", 1, 8), self._dispersy.crypto.create_signature(ec, "12345678")))
+        self.assertTrue(member.verify(buffer("0123456789E", 0, 10), self._dispersy.crypto.create_signature(ec, "12345678"), offset=1, length=8))
+        self.assertFalse(member.verify(buffer("0123456789", 1, 8), self._dispersy.crypto.create_signature(ec, "1234567")))
+
 
     def test_sign(self):
         self._test_sign(u"medium")
@@ -132,3 +138,79 @@ class TestMember(DispersyTestFunc):
         self.assertFalse(self._dispersy.crypto.is_valid_signature(ec, "12345678", member.sign("0123456789E", offset=1, length=9)))
         with self.assertRaises(ValueError): self._dispersy.crypto.is_valid_signature(ec, "12345678", member.sign("0123456789", offset=1, length=666))
         with self.assertRaises(ValueError): self._dispersy.crypto.is_valid_signature(ec, "12345678", member.sign("0123456789E", offset=1, length=666))
+
+    @blocking_call_on_reactor_thread
+    def test_slots(self):
+        """
+        Member instances must not have an instance dictionary.
+        """
+        member = self._dispersy.get_new_member(u"very-low")
+        self.assertFalse(hasattr(member, "__dict__"))
+        with self.assertRaises(AttributeError):
+            member.unknown_attribute = None
+
+    @blocking_call_on_reactor_thread
+    def test_member_cache(self):
+        """
+        The member cache must evict the least recently used member.
+        """
+        self._dispersy._member_cache_size = 2
+        first = self._dispersy.get_new_member(u"very-low")
+        second = self._dispersy.get_new_member(u"very-low")
+
+        hit_count = self._dispersy.statistics.member_cache_hit_count
+        self.assertIs(self._dispersy.get_member(mid=first.mid), first)
+        self.assertEqual(self._dispersy.statistics.member_cache_hit_count, hit_count + 1)
+
+        eviction_count = self._dispersy.statistics.member_cache_eviction_count
+        third = self._dispersy.get_new_member(u"very-low")
+        self.assertEqual(self._dispersy.statistics.member_cache_eviction_count, eviction_count + 1)
+        self.assertEqual(self._dispersy._member_cache_by_hash.keys(), [first.mid, third.mid])
+
+        # the evicted member is loaded from the database
+        miss_count = self._dispersy.statistics.member_cache_miss_count
+        self.assertEqual(self._dispersy.get_member(mid=second.mid), second)
+        self.assertEqual(self._dispersy.statistics.member_cache_miss_count, miss_count + 1)
+
+    @blocking_call_on_reactor_thread
+    def test_dummy_member_cache(self):
+        """
+        Members without a known public key must be cached until the public key becomes known.
+        """
+        member = self._dispersy.get_new_member(u"very-low")
+        self._dispersy._member_cache_by_hash.clear()
+        self._dispersy.database.execute(u"UPDATE member SET public_key = NULL, private_key = NULL WHERE id = ?",
+                                        (member.database_id,))
+
+        dummy = self._dispersy.get_member(mid=member.mid)
+        self.assertNotIsInstance(dummy, Member)
+        self.assertEqual(dummy.database_id, member.database_id)
+
+        hit_count = self._dispersy.statistics.dummy_member_cache_hit_count
+        self.assertIs(self._dispersy.get_member(mid=member.mid), dummy)
+        self.assertEqual(self._dispersy.statistics.dummy_member_cache_hit_count, hit_count + 1)
+
+        # once the public key is given the member replaces the dummy
+        real = self._dispersy.get_member(public_key=member.public_key)
+        self.assertIsInstance(real, Member)
+        self.assertIs(self._dispersy.get_member(mid=member.mid), real)
+
+    @blocking_call_on_reactor_thread
+    def test_get_members(self):
+        """
+        get_members must return the same members as get_member.
+        """
+        members = [self._dispersy.get_new_member(u"very-low") for _ in xrange(3)]
+        self._dispersy._member_cache_by_hash.pop(members[0].mid)
+        unknown_mid = "1" * 20
+        miss_count = self._dispersy.statistics.member_cache_miss_count
+
+        result = self._dispersy.get_members([member.mid for member in members] + [unknown_mid, members[1].mid])
+        self.assertEqual(sorted(result.keys()), sorted([member.mid for member in members] + [unknown_mid]))
+        # only members[0] and the unknown mid were not cached, each is counted once
+        self.assertEqual(self._dispersy.statistics.member_cache_miss_count, miss_count + 2)
+        for member in members:
+            self.assertEqual(result[member.mid], member)
+        self.assertIs(result[members[1].mid], members[1])
+        self.assertNotIsInstance(result[unknown_mid], Member)
+        self.assertIs(self._dispersy.get_member(mid=unknown_mid), result[unknown_mid])
@@ -0,0 +1,57 @@
+import socket
+from time import sleep
+from unittest import TestCase
+
+from ..mmsg import BatchSocket, HAS_MMSG
+
+
+class TestBatchSocket(TestCase):
+
+    def setUp(self):
+        super(TestBatchSocket, self).setUp()
+        self.sockets = []
+
+    def tearDown(self):
+        super(TestBatchSocket, self).tearDown()
+        for sock in self.sockets:
+            sock.close()
+
+    def create_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(0)
+        self.sockets.append(sock)
+        return sock
+
+    def send_and_receive(self, use_mmsg):
+        """
+        Send more packets than fit in one batch and ensure they all arrive, in order, with the correct source.
+        """
+        sender = BatchSocket(self.create_socket(), batch_size=8, use_mmsg=use_mmsg)
+        receiver_socket = self.create_socket()
+        receiver = BatchSocket(receiver_socket, batch_size=8, use_mmsg=use_mmsg)
+
+        self.assertEqual(receiver.recv_batch(), [])
+
+        packets = [(receiver_socket.getsockname(), "packet-%d\x00" % i * (i + 1)) for i in xrange(20)]
+        self.assertEqual(sender.send_batch(packets), len(packets))
+        sleep(0.1)
+
+        received = []
+        while True:
+            batch = receiver.recv_batch()
+            self.assertLessEqual(len(batch), 8)
+            if not batch:
+                break
+            received.extend(batch)
+
+        self.assertEqual([data for _, data in received], [data for _, data in packets])
+        self.assertTrue(all(sock_addr == self.sockets[0].getsockname() for sock_addr, _ in received))
+
+    def test_fallback(self):
+        self.send_and_receive(False)
+
+    def test_mmsg(self):
+        if not HAS_MMSG:
+            self.skipTest("recvmmsg and sendmmsg are not available")
+        self.send_and_receive(True)
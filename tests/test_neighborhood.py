@@ -83,3 +83,68 @@ class TestNeighborhood(DispersyTestFunc):
 
         # We should never send to more than node_count + targeted_node_count nodes
         self.assertEqual(forwarded_node_count, min(total_node_count, meta.destination.node_count + targeted_node_count))
+
+    def test_sample_candidates(self):
+        """
+        _sample_candidates returns at most COUNT unique candidates that are not excluded.
+        """
+        candidates = range(20)
+        exclude = set(range(0, 20, 2))
+        for count in (0, 1, 5, 10, 15):
+            sample = self._dispersy._sample_candidates(candidates, count, exclude)
+            self.assertEqual(len(sample), min(count, 10))
+            self.assertEqual(len(set(sample)), len(sample))
+            self.assertFalse(exclude.intersection(sample))
+        # the candidates are reordered, never removed or duplicated
+        self.assertEqual(sorted(candidates), range(20))
+
+    def forward_batches(self, messages, send_batch_result=True):
+        """
+        Forwards MESSAGES without verified candidates, returns the result and the batches given to the endpoint.
+        """
+        batches = []
+
+        def send_batch(batch):
+            batches.append(batch)
+            return send_batch_result
+
+        self._community.dispersy_yield_verified_candidates = lambda: iter([])
+        self._dispersy.endpoint.send_batch = send_batch
+        return self._dispersy._forward(messages), batches
+
+    def test_forward_grouped_per_peer(self):
+        """
+        All messages for one peer are given to the endpoint together, all peers in a single call.
+        """
+        nodes = self.create_nodes(2)
+        candidates = tuple(node.my_candidate for node in nodes)
+        messages = [self._mm.create_targeted_full_sync_text("Hello World #%d" % i, destination=candidates, global_time=42 + i)
+                    for i in xrange(3)]
+
+        result, batches = self.forward_batches(messages)
+
+        self.assertTrue(result)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(sorted(candidate.sock_addr for candidate, _ in batches[0]),
+                         sorted(candidate.sock_addr for candidate in candidates))
+        for _, packets in batches[0]:
+            self.assertEqual(packets, [message.packet for message in messages])
+
+    def test_forward_continues_after_failure(self):
+        """
+        A message without candidates makes _forward return False, the other messages are still sent.
+        """
+        node, = self.create_nodes(1)
+        messages = [self._mm.create_targeted_full_sync_text("Hello World #1", destination=(), global_time=42),
+                    self._mm.create_targeted_full_sync_text("Hello World #2", destination=(node.my_candidate,), global_time=43)]
+
+        result, batches = self.forward_batches(messages)
+
+        self.assertFalse(result)
+        self.assertEqual([[(candidate.sock_addr, packets) for candidate, packets in batch] for batch in batches],
+                         [[(node.my_candidate.sock_addr, [messages[1].packet])]])
+
+        # an endpoint failure is reported as well
+        result, batches = self.forward_batches(messages[1:], send_batch_result=False)
+        self.assertFalse(result)
+        self.assertEqual(len(batches), 1)
@@ -51,6 +51,7 @@ class TestPruning(DispersyTestFunc):
         self.assertTrue(all(message.distribution.pruning.is_active() for message in messages), "all messages should be active")
 
         # pruned messages should no longer exist in the database
+        node.prune_sync_table()
         node.assert_not_stored(messages=pruned)
 
     def test_local_creation_of_other_messages_causes_pruning(self):
@@ -81,6 +82,7 @@ class TestPruning(DispersyTestFunc):
         self.assertTrue(all(message.distribution.pruning.is_pruned() for message in messages), "all messages should be pruned")
 
         # pruned messages should no longer exist in the database
+        node.prune_sync_table()
         node.assert_not_stored(messages=messages)
 
     def test_remote_creation_causes_pruning(self):
@@ -127,6 +129,7 @@ class TestPruning(DispersyTestFunc):
         self.assertTrue(all(message.distribution.pruning.is_active() for message in should_be_active), "all messages should be active")
 
         # pruned messages should no longer exist in the database
+        other.prune_sync_table()
         other.assert_not_stored(messages=should_be_pruned)
 
     def test_remote_creation_of_other_messages_causes_pruning(self):
@@ -164,6 +167,7 @@ class TestPruning(DispersyTestFunc):
         self.assertTrue(all(message.distribution.pruning.is_pruned() for message in messages), "all messages should be pruned")
 
         # pruned messages should no longer exist in the database
+        other.prune_sync_table()
         other.assert_not_stored(messages=messages)
 
     def test_sync_response_response_filtering_inactive(self):
@@ -215,3 +219,29 @@ class TestPruning(DispersyTestFunc):
         responses = [response for _, response in node.receive_messages(names=[u"full-sync-global-time-pruning-text"])]
         self.assertEqual(len(responses), 5)
         self.assertTrue(all(message.packet == response.packet for message, response in zip(messages[15:20], responses)))
+
+    def test_pruned_packets_are_not_offered(self):
+        """
+        Pruned messages that prune_sync_table did not remove yet are not claimed and are not sent.
+
+        - NODE creates 30 pruning messages [11:40].  Messages [11:20] will be pruned but remain in the database.
+        - The sync filters of NODE only contain the messages [21:40].
+        - OTHER requests [15:25] using a missing-message and receives only [21:25].
+        """
+        node, other = self.create_nodes(2)
+        node.send_identity(other)
+
+        messages = self._create_prune(node, 11, 40)
+        self.assertTrue(all(message.distribution.pruning.is_pruned() for message in messages[0:10]), "all messages should be pruned")
+        node.assert_is_stored(messages=messages[0:10])
+
+        def get_syncable():
+            community = node._community
+            community.sync_filters.prune(community._get_pruned_global_times())
+            return [message.packet_id in community.sync_filters for message in messages]
+        self.assertEqual(node.call(get_syncable), [False] * 10 + [True] * 20)
+
+        global_times = range(15, 26)
+        node.give_message(other.create_missing_message(node.my_member, global_times), other)
+        responses = [response for _, response in other.receive_messages(names=[u"full-sync-global-time-pruning-text"])]
+        self.assertEqual(sorted(response.distribution.global_time for response in responses), range(21, 26))
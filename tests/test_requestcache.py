@@ -1,8 +1,25 @@
+from time import sleep
+
 from ..requestcache import RequestCache, NumberCache, RandomNumberCache
 from ..util import blocking_call_on_reactor_thread
 from .dispersytestclass import DispersyTestFunc
 
 
+class TimeoutCache(RandomNumberCache):
+
+    def __init__(self, request_cache, timeout_delay, timed_out):
+        super(TimeoutCache, self).__init__(request_cache, u"timeout")
+        self._timeout_delay = timeout_delay
+        self._timed_out = timed_out
+
+    @property
+    def timeout_delay(self):
+        return self._timeout_delay
+
+    def on_timeout(self):
+        self._timed_out.append(self)
+
+
 class TestRequestCache(DispersyTestFunc):
 
     @blocking_call_on_reactor_thread
@@ -94,3 +111,63 @@ class TestRequestCache(DispersyTestFunc):
 
         # request_cache is not bound to any Community so we need to clean up ourselves
         request_cache.clear()
+
+    def test_timeouts(self):
+        """
+        Caches time out after their timeout_delay, except for the caches that have been popped.
+        """
+        timed_out = []
+
+        @blocking_call_on_reactor_thread
+        def add():
+            request_cache = RequestCache()
+            caches = [request_cache.add(TimeoutCache(request_cache, timeout_delay, timed_out))
+                      for timeout_delay in (0.3, 0.3, 0.35, 0.6, 5.0)]
+            request_cache.pop(u"timeout", caches[1].number)
+            return request_cache, caches
+
+        @blocking_call_on_reactor_thread
+        def check(timed_out_caches, pending_caches):
+            self.assertEqual(sorted(timed_out), sorted(timed_out_caches))
+            for cache in timed_out_caches:
+                self.assertFalse(request_cache.has(u"timeout", cache.number))
+            for cache in pending_caches:
+                self.assertTrue(request_cache.has(u"timeout", cache.number))
+
+        request_cache, caches = add()
+        check([], [caches[0], caches[2], caches[3], caches[4]])
+
+        sleep(0.5)
+        check([caches[0], caches[2]], [caches[3], caches[4]])
+
+        sleep(0.3)
+        check([caches[0], caches[2], caches[3]], [caches[4]])
+
+        # request_cache is not bound to any Community so we need to clean up ourselves
+        blocking_call_on_reactor_thread(request_cache.clear)()
+
+    def test_pop_keeps_timer_wheel(self):
+        """
+        Popping the last cache leaves the timer wheel scheduled, it fires without timing out any cache.
+        """
+        timed_out = []
+
+        @blocking_call_on_reactor_thread
+        def add_and_pop():
+            request_cache = RequestCache()
+            cache = request_cache.add(TimeoutCache(request_cache, 0.1, timed_out))
+            request_cache.pop(u"timeout", cache.number)
+            self.assertTrue(request_cache.is_pending_task_active(u"timer wheel"))
+            return request_cache
+
+        request_cache = add_and_pop()
+        sleep(0.3)
+
+        @blocking_call_on_reactor_thread
+        def check():
+            self.assertEqual(timed_out, [])
+            self.assertFalse(request_cache.is_pending_task_active(u"timer wheel"))
+        check()
+
+        # request_cache is not bound to any Community so we need to clean up ourselves
+        blocking_call_on_reactor_thread(request_cache.clear)()
@@ -51,6 +51,45 @@ class TestSync(DispersyTestFunc):
                 self.assertEqual(sorted(global_times), sorted(response_times))
 
 
+    def test_digest_mode(self):
+        """
+        NODE sends a u"digest" mode bloom filter containing half of the messages that OTHER has, only the other half
+        may be sent back.  The second time the cached packet digests are used.
+        """
+        node, other, messages = self._create_nodes_messages()
+        packets = [message.packet for message in messages[::2]]
+        global_times = [message.distribution.global_time for message in messages[1::2]]
+
+        for _ in xrange(2):
+            sync = (1, 0, 1, 0, packets)
+            other.give_message(node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, False, u"unknown", sync, 42, bloom_filter_mode=u"digest"), node)
+
+            responses = node.receive_messages(names=[u"full-sync-text"], return_after=len(global_times))
+            response_times = [message.distribution.global_time for _, message in responses]
+
+            self.assertEqual(sorted(global_times), sorted(response_times))
+
+    def test_file_database(self):
+        """
+        With a database file the sync response is selected on the reader threads of the DatabaseExecutor, the messages
+        that OTHER just stored must be included.
+        """
+        node, other = self.create_nodes(2, memory_database=False)
+        self.assertTrue(other._dispersy.database_executor.threaded)
+        other.send_identity(node)
+
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(30)]
+        other.store(messages)
+        global_times = [message.distribution.global_time for message in messages[1::2]]
+
+        sync = (1, 0, 1, 0, [message.packet for message in messages[::2]])
+        other.give_message(node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, False, u"unknown", sync, 42), node)
+
+        responses = node.receive_messages(names=[u"full-sync-text"], return_after=len(global_times))
+        response_times = [message.distribution.global_time for _, message in responses]
+
+        self.assertEqual(sorted(global_times), sorted(response_times))
+
     def test_in_order(self):
         node, other, messages = self._create_nodes_messages('create_in_order_text')
         global_times = [message.distribution.global_time for message in messages]
@@ -220,6 +259,24 @@ class TestSync(DispersyTestFunc):
         for _, message in messages_so_far:
             node.assert_is_stored(message)
 
+    def test_last_9_batch(self):
+        """
+        Several members send many last-9-test messages in one batch, only the 9 most recent messages of each member
+        may remain.
+        """
+        node, other, another = self.create_nodes(3)
+        other.send_identity(node)
+        another.send_identity(node)
+
+        messages = [other.create_last_9_test(str(global_time), global_time) for global_time in xrange(10, 30)]
+        messages.extend(another.create_last_9_test(str(global_time), global_time) for global_time in xrange(15, 25))
+        node.give_messages(messages, other)
+
+        node.assert_is_stored(messages=messages[11:20])
+        node.assert_not_stored(messages=messages[:11])
+        node.assert_is_stored(messages=messages[21:])
+        node.assert_not_stored(message=messages[20])
+
     def test_last_1_doublemember(self):
         """
         Normally the LastSyncDistribution policy stores the last N messages for each member that
@@ -0,0 +1,154 @@
+from ..bloomfilter import BloomFilter
+from ..distribution import SyncDistribution
+from ..syncfilter import BUCKET_SIZE
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestSyncFilter(DispersyTestFunc):
+
+    def _count_syncable(self, node):
+        syncable_messages = u", ".join(unicode(meta.database_id) for meta in node._community.get_meta_messages()
+                                       if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
+        count, = node._dispersy.database.execute(u"SELECT COUNT(*) FROM sync WHERE meta_message IN (%s) AND undone = 0"
+                                                 % syncable_messages).next()
+        return count
+
+    def _claim_and_verify(self, node, time_low, time_high, mode=u"plain"):
+        """
+        Claims a bloom filter from the sync filter manager of NODE and verifies that it is identical to a bloom filter
+        that is built from all syncable packets in the database.
+        """
+        def claim():
+            community = node._community
+            sync_filters = community.sync_filters
+            bloom_filter = sync_filters.create_bloom_filter(community.dispersy_sync_bloom_filter_bits,
+                                                            community.dispersy_sync_bloom_filter_error_rate,
+                                                            mode)
+            sync_filters.fill(bloom_filter, time_low, time_high)
+
+            _, packets = community._get_packets_for_bloomfilters([[None, time_low, time_high, 0, 1]], include_inactive=True).next()
+            expected = BloomFilter(community.dispersy_sync_bloom_filter_bits,
+                                   community.dispersy_sync_bloom_filter_error_rate,
+                                   prefix=bloom_filter.prefix,
+                                   mode=mode)
+            expected.add_keys(packet for packet, _ in packets)
+            return bloom_filter.bytes, expected.bytes
+
+        bytes_, expected = node.call(claim)
+        self.assertEqual(bytes_, expected)
+
+    def test_fill(self):
+        """
+        NODE stores messages spread over several buckets, claiming (partially) overlapping ranges must always result
+        in the same bloom filter as hashing all packets in the range.
+        """
+        node, = self.create_nodes(1)
+        messages = [node.create_full_sync_text("Message #%d" % i, 10 + i * 7) for i in xrange(100)]
+        node.give_messages(messages, node)
+        self.assertEqual(node.call(len, node._community.sync_filters), node.call(self._count_syncable, node))
+
+        for time_low, time_high in [(1, 1000), (1, 1000), (BUCKET_SIZE, 3 * BUCKET_SIZE - 1),
+                                    (BUCKET_SIZE + 5, 4 * BUCKET_SIZE + 5), (1, 1000), (200, 210)]:
+            self._claim_and_verify(node, time_low, time_high)
+
+        # new messages must be added to the cached buckets
+        messages = [node.create_full_sync_text("Message #%d" % i, 11 + i * 7) for i in xrange(100)]
+        node.give_messages(messages, node)
+        self.assertEqual(node.call(len, node._community.sync_filters), node.call(self._count_syncable, node))
+        self._claim_and_verify(node, 1, 1000)
+
+    def test_fill_digest_mode(self):
+        """
+        Claiming u"digest" mode bloom filters must result in the same bloom filter as hashing all packets in the range.
+        """
+        node, = self.create_nodes(1)
+        messages = [node.create_full_sync_text("Message #%d" % i, 10 + i * 7) for i in xrange(100)]
+        node.give_messages(messages, node)
+
+        for time_low, time_high in [(1, 1000), (1, 1000), (BUCKET_SIZE + 5, 4 * BUCKET_SIZE + 5)]:
+            self._claim_and_verify(node, time_low, time_high, u"digest")
+
+    def test_undo(self):
+        """
+        NODE undoes some of its messages, these must no longer be part of the claimed bloom filters.
+        """
+        node, = self.create_nodes(1)
+        messages = [node.create_full_sync_text("Should undo #%d" % i, 10 + i * 7) for i in xrange(50)]
+        node.give_messages(messages, node)
+        self._claim_and_verify(node, 1, 1000)
+
+        undoes = [node.create_undo_own(message, 1000 + i, i + 1) for i, message in enumerate(messages[::2])]
+        node.give_messages(undoes, node)
+        node.assert_is_undone(messages=messages[::2])
+
+        self.assertEqual(node.call(len, node._community.sync_filters), node.call(self._count_syncable, node))
+        self._claim_and_verify(node, 1, 2000)
+
+    def test_last_sync(self):
+        """
+        Messages that are replaced by newer LastSyncDistribution messages must be removed.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        self._claim_and_verify(node, 1, 1000)
+
+        for global_time in xrange(10, 300, 10):
+            node.give_message(other.create_last_9_test(str(global_time), global_time), other)
+
+        self.assertEqual(node.call(len, node._community.sync_filters), node.call(self._count_syncable, node))
+        self._claim_and_verify(node, 1, 1000)
+
+    def test_sequence_numbers(self):
+        """
+        The cached sequence numbers must follow the messages that NODE stores, drops, and replaces.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        def get_sequence_number():
+            community = node._community
+            member = community.dispersy.get_member(public_key=other.my_member.public_key)
+            meta = community.get_meta_message(u"sequence-text")
+            return community.sync_filters.get_sequence_number(member.database_id, meta.database_id)
+
+        self.assertEqual(node.call(get_sequence_number), (0, 0))
+        messages = [other.create_sequence_text("Sequence message #%d" % i, i * 10, i) for i in xrange(1, 11)]
+        node.give_messages(messages[:5], other)
+        self.assertEqual(node.call(get_sequence_number), (50, 5))
+
+        # duplicates are dropped while the new messages are stored
+        node.give_messages(messages[3:8], other)
+        node.assert_is_stored(messages=messages[:8])
+        self.assertEqual(node.call(get_sequence_number), (80, 8))
+
+        # a different message with sequence number 7 and a lower global time replaces #7 and #8
+        conflict = other.create_sequence_text("Conflicting message #7", 65, 7)
+        node.give_message(conflict, other)
+        node.assert_is_stored(conflict)
+        node.assert_not_stored(messages=messages[6:8])
+        self.assertEqual(node.call(get_sequence_number), (65, 7))
+
+    def test_sequence_numbers_after_last_sync(self):
+        """
+        Replacing the LastSyncDistribution messages of one member must not discard the cached sequence numbers of
+        other members.
+        """
+        node, other, third = self.create_nodes(3)
+        other.send_identity(node)
+        third.send_identity(node)
+
+        def get_key():
+            community = node._community
+            member = community.dispersy.get_member(public_key=other.my_member.public_key)
+            meta = community.get_meta_message(u"sequence-text")
+            return member.database_id, meta.database_id
+
+        messages = [other.create_sequence_text("Sequence message #%d" % i, i * 10, i) for i in xrange(1, 4)]
+        node.give_messages(messages, other)
+        key = node.call(get_key)
+        self.assertEqual(node.call(node._community.sync_filters.get_sequence_number, *key), (30, 3))
+
+        # the second message of THIRD replaces the first one
+        node.give_message(third.create_last_1_test("first", 100), third)
+        node.give_message(third.create_last_1_test("second", 110), third)
+        self.assertIn(key, node.call(lambda: node._community.sync_filters._sequence_numbers.keys()))
@@ -85,6 +85,33 @@ class TaskManagerTestFunc(DispersyTestFunc):
         self.assertEquals(42, self.counter)
         self.assertFalse(self.tm.is_pending_task_active("test"))
 
+    def test_finished_tasks_are_removed(self):
+        self.tm.register_task("call later", self.tm._reactor.callLater(1, self.count))
+        self.tm.register_task("deferred", Deferred(), delay=2, value=42)
+        lc = LoopingCall(self.do_nothing)
+        lc.clock = self.tm._reactor
+        self.tm.register_task("looping call", lc, delay=1, interval=1)
+        self.assertEquals(3, self.tm.get_pending_task_count())
+        # The DelayedCall removes itself once it has fired, the LoopingCall remains until it is canceled
+        self.tm._reactor.advance(1)
+        self.assertEquals(1, self.counter)
+        self.assertEquals(2, self.tm.get_pending_task_count())
+        self.tm._reactor.advance(1)
+        self.assertEquals(1, self.tm.get_pending_task_count())
+        self.tm.cancel_pending_task("looping call")
+        self.assertEquals(0, self.tm.get_pending_task_count())
+
+    def test_replaced_task_is_not_removed(self):
+        self.tm.register_task("test", self.tm._reactor.callLater(1, self.count))
+        self.tm.replace_task("test", self.tm._reactor.callLater(2, self.count))
+        self.tm._reactor.advance(1)
+        self.assertEquals(0, self.counter)
+        self.assertTrue(self.tm.is_pending_task_active("test"))
+        self.tm._reactor.advance(1)
+        self.assertEquals(1, self.counter)
+        self.assertFalse(self.tm.is_pending_task_active("test"))
+        self.assertEquals(0, self.tm.get_pending_task_count())
+
     def count(self):
         self.counter += 1
 
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+from nose.twistedtools import deferred, reactor
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.error import CannotListenError
+
+from ..candidate import Candidate
+from ..endpoint import TwistedEndpoint
+from ..util import blocking_call_on_reactor_thread
+
+
+class FakeStatistics(object):
+
+    def __init__(self):
+        self.total_up = 0
+        self.total_down = 0
+        self.total_send = 0
+
+    def dict_inc(self, key, value, count=1):
+        pass
+
+
+class FakeDispersy(object):
+
+    def __init__(self):
+        self.statistics = FakeStatistics()
+        self.received = Deferred()
+
+    def on_incoming_packets(self, packets, cache=True, timestamp=0.0, source=u"unknown"):
+        self.received.callback(packets)
+
+
+class TestTwistedEndpoint(TestCase):
+
+    @deferred(timeout=5)
+    @inlineCallbacks
+    def test_send_and_receive(self):
+        """
+        Packets sent by one TwistedEndpoint are given to Dispersy.on_incoming_packets of the other.
+        """
+        sender_dispersy = FakeDispersy()
+        receiver_dispersy = FakeDispersy()
+        sender = TwistedEndpoint(0, ip="127.0.0.1")
+        receiver = TwistedEndpoint(0, ip="127.0.0.1")
+        self.assertTrue(sender.open(sender_dispersy))
+        self.assertTrue(receiver.open(receiver_dispersy))
+
+        try:
+            self.assertNotEqual(receiver.get_address()[1], 0)
+            self.assertTrue(sender.send([Candidate(receiver.get_address(), False)], ["packet #1", "packet #2"]))
+            self.assertEqual(sender_dispersy.statistics.total_send, 2)
+
+            packets = yield receiver_dispersy.received
+            self.assertEqual(sorted(data for _, data in packets), ["packet #1", "packet #2"])
+            self.assertTrue(all(candidate.sock_addr == sender.get_address() for candidate, _ in packets))
+            self.assertEqual(receiver_dispersy.statistics.total_down, len("packet #1") * 2)
+
+        finally:
+            yield sender.close()
+            yield receiver.close()
+
+    @blocking_call_on_reactor_thread
+    def test_open_fails(self):
+        """
+        TwistedEndpoint.open raises CannotListenError when no port is available.
+        """
+        def listenUDP(port, protocol, interface=""):
+            raise CannotListenError(interface, port, None)
+
+        endpoint = TwistedEndpoint(0)
+        original, reactor.listenUDP = reactor.listenUDP, listenUDP
+        try:
+            self.assertRaises(CannotListenError, endpoint.open, FakeDispersy())
+        finally:
+            reactor.listenUDP = original
+        self.assertTrue(endpoint.close())
@@ -0,0 +1,134 @@
+from ..util import blocking_call_on_reactor_thread
+from ..walkscheduler import WalkScheduler, WALK_SLICE_INTERVAL
+from .dispersytestclass import DispersyTestFunc
+
+
+class FakeCandidate(object):
+
+    def __init__(self, sock_addr):
+        self.sock_addr = sock_addr
+
+
+class FakeDispersy(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def _send_batch(self, batch):
+        self.sent.extend(batch)
+        return True
+
+
+class TestWalkScheduler(DispersyTestFunc):
+
+    def setUp(self):
+        super(TestWalkScheduler, self).setUp()
+        self.dispersy = FakeDispersy()
+
+    @blocking_call_on_reactor_thread
+    def test_coalesce_introduction_requests(self):
+        """
+        Introduction requests to the same peer, sent during one slice, are sent in one call.
+        """
+        scheduler = WalkScheduler(self.dispersy)
+
+        def step(community, sock_addr):
+            return lambda: scheduler.queue_introduction_requests([FakeCandidate(sock_addr)], [community])
+
+        scheduler.start_walking(u"A", step(u"A", ("1.1.1.1", 1)), WALK_SLICE_INTERVAL)
+        scheduler.start_walking(u"B", step(u"B", ("1.1.1.1", 1)), WALK_SLICE_INTERVAL)
+        scheduler.start_walking(u"C", step(u"C", ("2.2.2.2", 2)), WALK_SLICE_INTERVAL)
+        scheduler._take_slice()
+
+        self.assertEqual(sorted((candidate.sock_addr, sorted(messages)) for candidate, messages in self.dispersy.sent),
+                         [(("1.1.1.1", 1), [u"A", u"B"]), (("2.2.2.2", 2), [u"C"])])
+        # outside a slice the requests are sent immediately
+        self.assertFalse(scheduler.queue_introduction_requests([FakeCandidate(("1.1.1.1", 1))], [u"D"]))
+        scheduler.close()
+
+    @blocking_call_on_reactor_thread
+    def test_spread_steps(self):
+        """
+        A slice takes at most the average number of steps per slice, and no steps of stopped communities.
+        """
+        scheduler = WalkScheduler(self.dispersy)
+        steps = []
+        for community in xrange(20):
+            scheduler.start_walking(community, lambda community=community: steps.append(community), 1.0)
+        scheduler.stop_walking(0)
+        self.assertFalse(scheduler.is_walking(0))
+
+        # 19 steps per second, i.e. 1.9 steps per slice
+        scheduler._take_slice()
+        self.assertEqual(len(steps), 2)
+        scheduler._take_slice()
+        self.assertEqual(len(steps), 4)
+        self.assertNotIn(0, steps)
+        scheduler.close()
+
+    @blocking_call_on_reactor_thread
+    def test_packet_budget(self):
+        """
+        A slice stops taking steps once the introduction requests exceed the packet budget.
+        """
+        scheduler = WalkScheduler(self.dispersy, packets_per_second=3)
+
+        def step():
+            scheduler.queue_introduction_requests([FakeCandidate(("1.1.1.1", 1))], [u"request", u"request"])
+
+        for community in xrange(10):
+            scheduler.start_walking(community, step, WALK_SLICE_INTERVAL)
+        scheduler._take_slice()
+
+        # the second step exceeds the budget of three packets
+        self.assertEqual(sum(len(messages) for _, messages in self.dispersy.sent), 4)
+        scheduler.close()
+
+    @blocking_call_on_reactor_thread
+    def test_walk_only_while_walking(self):
+        """
+        The slices are only taken while at least one community is walking.
+        """
+        scheduler = WalkScheduler(self.dispersy)
+        self.assertTrue(scheduler.open())
+        self.assertFalse(scheduler.is_pending_task_active("walk"))
+
+        scheduler.start_walking(u"A", lambda: None, 1.0)
+        scheduler.start_walking(u"B", lambda: None, 1.0)
+        # replacing the step of a walking community keeps the slices going
+        scheduler.start_walking(u"A", lambda: None, 2.0)
+        self.assertTrue(scheduler.is_pending_task_active("walk"))
+
+        scheduler.stop_walking(u"A")
+        self.assertTrue(scheduler.is_pending_task_active("walk"))
+        scheduler.stop_walking(u"B")
+        self.assertFalse(scheduler.is_pending_task_active("walk"))
+        self.assertTrue(scheduler.close())
+
+    def test_community_start_walking(self):
+        """
+        Community.start_walking takes its steps through the walk scheduler of Dispersy.
+        """
+        node, = self.create_nodes(1)
+        scheduler = self._dispersy.walk_scheduler
+
+        @blocking_call_on_reactor_thread
+        def start_walking():
+            candidate = self._community.create_or_update_walkcandidate(node.lan_address, node.lan_address,
+                                                                       node.wan_address, False, u"unknown")
+            self._community.dispersy_get_walk_candidate = lambda: candidate
+            self._community.start_walking()
+            self.assertTrue(scheduler.is_walking(self._community))
+            self.assertTrue(scheduler.is_pending_task_active("walk"))
+            # take the first step now instead of waiting for the next slice
+            scheduler._take_slice()
+
+        @blocking_call_on_reactor_thread
+        def stop_walking():
+            scheduler.stop_walking(self._community)
+            self.assertFalse(scheduler.is_walking(self._community))
+
+        start_walking()
+        _, request = node.receive_message(names=[u"dispersy-introduction-request"]).next()
+        self.assertEqual(request.community.cid, self._community.cid)
+        stop_walking()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Report the memory used per Candidate, WalkCandidate, DummyMember, and Member instance.
+
+These classes use __slots__.  For every class the size of an instance is compared with a dict-backed instance that
+holds the same attributes, plus the per-instance logger that these classes used to have.  Finally COUNT WalkCandidate
+instances are created to measure the growth of the resident set size.
+"""
+
+import argparse
+import resource
+import sys
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.candidate import Candidate, WalkCandidate
+from dispersy.member import DummyMember, Member
+
+
+class DictBacked(object):
+    pass
+
+
+def get_slots(cls):
+    return [name for klass in cls.__mro__ for name in getattr(klass, "__slots__", ())]
+
+
+def slotted_size(cls):
+    instance = cls.__new__(cls)
+    for name in get_slots(cls):
+        setattr(instance, name, None)
+    return sys.getsizeof(instance)
+
+
+def dict_backed_size(cls):
+    instance = DictBacked()
+    for name in get_slots(cls):
+        setattr(instance, name, None)
+    instance._logger = None
+    return sys.getsizeof(instance) + sys.getsizeof(instance.__dict__)
+
+
+def get_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=200000, help="number of WalkCandidate instances to create")
+    args = parser.parse_args()
+
+    print "%-15s %8s %12s %8s" % ("class", "slotted", "dict-backed", "saving")
+    for cls in (Candidate, WalkCandidate, DummyMember, Member):
+        slotted = slotted_size(cls)
+        dict_backed = dict_backed_size(cls)
+        print "%-15s %8d %12d %8d" % (cls.__name__, slotted, dict_backed, dict_backed - slotted)
+
+    before = get_rss()
+    candidates = [WalkCandidate(("10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255), 7759), False,
+                                ("10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255), 7759), ("0.0.0.0", 0),
+                                u"unknown")
+                  for i in xrange(args.count)]
+    after = get_rss()
+    print
+    print "%d WalkCandidate instances: %d KiB resident, %.1f bytes per instance (including addresses)" % \
+        (len(candidates), after - before, (after - before) * 1024.0 / len(candidates))
+
+if __name__ == "__main__":
+    main()
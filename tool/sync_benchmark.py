@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""
+Report the latency of the sync table queries on a database with ROWS packets.
+
+A DispersyDatabase is filled with ROWS packets from MEMBERS members, all using a single sequence enabled
+FullSyncDistribution meta message.  The following queries are timed with and without the
+sync_member_meta_message_sequence_index:
+
+- sync answer: the packets selected for an introduction request with a Bloomfilter (Community.on_introduction_request)
+- sequence check: the highest global time and sequence number per member (_check_full_sync_distribution_batch)
+- missing sequence: a range of sequence numbers from one member (Community.on_missing_sequence)
+"""
+
+import argparse
+import os
+import random
+import shutil
+from tempfile import mkdtemp
+from time import time
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.community import _get_bloomfilter_statement
+from dispersy.dispersydatabase import DispersyDatabase
+
+
+def fill(database, rows, members, packet_size):
+    database.executemany(u"INSERT INTO member (mid, public_key) VALUES (?, ?)",
+                         ((buffer(os.urandom(20)), buffer(os.urandom(74))) for _ in xrange(members + 1)))
+    database.execute(u"INSERT INTO community (master, member, classification) VALUES (1, 1, 'BenchmarkCommunity')")
+    database.execute(u"INSERT INTO meta_message (community, name) VALUES (1, 'sequence-text')")
+
+    packet = buffer(os.urandom(packet_size))
+    per_member = rows // members
+
+    def get_rows():
+        for sequence in xrange(1, per_member + 1):
+            for member in xrange(2, members + 2):
+                # global times are unique per member, and interleaved between members
+                yield (1, member, sequence * members + member, 1, packet, sequence)
+
+    database.executemany(u"INSERT INTO sync (community, member, global_time, meta_message, packet, sequence) "
+                         u"VALUES (?, ?, ?, ?, ?, ?)", get_rows())
+    database.commit()
+    database.execute(u"ANALYZE")
+    database.commit()
+    return members * per_member
+
+
+def measure(func, repeat):
+    durations = []
+    for _ in xrange(repeat):
+        begin = time()
+        func()
+        durations.append(time() - begin)
+    durations.sort()
+    return durations[len(durations) // 2], durations[len(durations) * 9 // 10]
+
+
+def run(database, rows, members, repeat):
+    max_global_time = (rows // members + 1) * members + members + 1
+    sync_statement = _get_bloomfilter_statement((u"ASC",))
+
+    def sync_answer():
+        time_low = random.randint(1, max_global_time)
+        # a Bloomfilter covering 1/MODULO of roughly 10000 global time values, as the walker uses
+        modulo = 10
+        list(database.execute(sync_statement, (1, time_low, time_low + 10000, random.randint(0, modulo - 1), modulo)))
+
+    def sequence_check():
+        database.execute(u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
+                         (random.randint(2, members + 1), 1)).fetchall()
+
+    def missing_sequence():
+        low = random.randint(1, rows // members)
+        list(database.execute(u"SELECT packet FROM sync WHERE member = ? AND meta_message = ? AND sequence BETWEEN ? AND ? "
+                              u"ORDER BY sequence", (random.randint(2, members + 1), 1, low, low + 10)))
+
+    for name, func in ((u"sync answer", sync_answer),
+                       (u"sequence check", sequence_check),
+                       (u"missing sequence", missing_sequence)):
+        median, p90 = measure(func, repeat)
+        print "  %-20s median %8.3f ms   p90 %8.3f ms" % (name, median * 1000.0, p90 * 1000.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="number of packets in the sync table")
+    parser.add_argument("--members", type=int, default=1000, help="number of members creating the packets")
+    parser.add_argument("--packet-size", type=int, default=200, help="size of each packet in bytes")
+    parser.add_argument("--repeat", type=int, default=200, help="number of times each query is run")
+    args = parser.parse_args()
+
+    directory = mkdtemp(suffix="_dispersy_sync_benchmark")
+    try:
+        database = DispersyDatabase(unicode(os.path.join(directory, u"dispersy.db")))
+        database.open()
+        try:
+            begin = time()
+            rows = fill(database, args.rows, args.members, args.packet_size)
+            print "filled %d rows in %.1f seconds" % (rows, time() - begin)
+
+            print "with sync_member_meta_message_sequence_index"
+            run(database, rows, args.members, args.repeat)
+
+            database.execute(u"DROP INDEX sync_member_meta_message_sequence_index")
+            database.commit()
+            print "without sync_member_meta_message_sequence_index"
+            run(database, rows, args.members, args.repeat)
+
+        finally:
+            database.close()
+
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
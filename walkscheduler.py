@@ -0,0 +1,178 @@
+from heapq import heappush, heappop
+from math import ceil
+from time import time
+import logging
+
+from twisted.internet.task import LoopingCall
+from twisted.python.threadable import isInIOThread
+
+from .taskmanager import TaskManager
+
+# the number of seconds between two time slices
+WALK_SLICE_INTERVAL = 0.1
+
+
+class WalkScheduler(TaskManager):
+
+    """
+    Takes the walker steps of all communities of one Dispersy instance from a single LoopingCall.
+
+    Every WALK_SLICE_INTERVAL seconds the steps that are due are taken, earliest first.  To spread the steps evenly over
+    the slices, a slice takes at most as many steps as the communities take on average during one slice, steps that do
+    not fit are taken in the next slice.  When PACKETS_PER_SECOND is given, a slice also stops taking steps once the
+    introduction requests sent so far exceed this budget.
+
+    The introduction requests that are sent while taking the steps of a slice are queued and sent at the end of the
+    slice, the requests for all peers in a single endpoint call.  Sending these requests can no longer fail for the
+    community that took the step, a failure is logged and the request times out as if the packet was lost.
+
+    The LoopingCall only runs while at least one community is walking.
+    """
+
+    def __init__(self, dispersy, packets_per_second=None):
+        """
+        @param dispersy: the Dispersy instance whose endpoint sends the introduction requests.
+        @type dispersy: Dispersy
+
+        @param packets_per_second: the maximum number of introduction requests sent per second, or None for no limit.
+        @type packets_per_second: int or None
+        """
+        assert packets_per_second is None or isinstance(packets_per_second, int), type(packets_per_second)
+        assert packets_per_second is None or packets_per_second > 0, packets_per_second
+        super(WalkScheduler, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._dispersy = dispersy
+        self._packets_per_second = packets_per_second
+        # the number of packets that may still be sent, refilled at PACKETS_PER_SECOND up to PACKETS_PER_SECOND
+        self._packet_budget = float(packets_per_second or 0)
+        self._last_slice = time()
+
+        # community:[due, sequence, community, step, interval] pairs, and a heap with these same lists
+        self._walkers = {}
+        self._heap = []
+        self._sequence = 0
+        # the sum of 1.0 / interval over all walkers, i.e. the number of steps taken per second
+        self._step_rate = 0.0
+
+        # sock_addr:(candidate, [message]) pairs of the introduction requests queued during the current slice, or
+        # None when the requests are sent immediately
+        self._queue = None
+        self._queued_packets = 0
+
+    @property
+    def packets_per_second(self):
+        return self._packets_per_second
+
+    def open(self):
+        # the LoopingCall is started once the first community starts walking
+        return True
+
+    def close(self):
+        self.cancel_all_pending_tasks()
+        self._walkers.clear()
+        del self._heap[:]
+        self._step_rate = 0.0
+        return True
+
+    def start_walking(self, community, step, interval):
+        """
+        Calls STEP every INTERVAL seconds, starting in the next slice, until stop_walking(COMMUNITY) is called.
+
+        A community takes one kind of step at a time, hence this replaces any step that COMMUNITY currently takes.
+        """
+        assert isInIOThread(), "WalkScheduler must be used on the reactor's thread"
+        assert callable(step), type(step)
+        assert isinstance(interval, (int, float)), type(interval)
+        assert interval > 0, interval
+        self._remove_walker(community)
+
+        self._sequence += 1
+        entry = [time(), self._sequence, community, step, float(interval)]
+        self._walkers[community] = entry
+        heappush(self._heap, entry)
+        self._step_rate += 1.0 / interval
+
+        if not self.is_pending_task_active("walk"):
+            self._last_slice = time()
+            self.register_task("walk", LoopingCall(self._take_slice)).start(WALK_SLICE_INTERVAL, now=False)
+
+    def stop_walking(self, community):
+        """
+        Stops taking the steps of COMMUNITY.  Does nothing when COMMUNITY is not walking.
+        """
+        self._remove_walker(community)
+        if not self._walkers:
+            self.cancel_pending_task("walk")
+            del self._heap[:]
+            self._step_rate = 0.0
+
+    def _remove_walker(self, community):
+        entry = self._walkers.pop(community, None)
+        if entry:
+            self._step_rate -= 1.0 / entry[4]
+            # the entry is removed from the heap when it is due
+            entry[2] = None
+
+    def is_walking(self, community):
+        return community in self._walkers
+
+    def queue_introduction_requests(self, candidates, messages):
+        """
+        Queues MESSAGES for CANDIDATES when a slice is being taken.
+
+        Returns True when the messages are queued, False when they must be sent immediately.
+        """
+        if self._queue is None:
+            return False
+
+        for candidate in candidates:
+            # every community has its own candidate instances, hence the requests are grouped by address
+            queued = self._queue.get(candidate.sock_addr)
+            if queued is None:
+                self._queue[candidate.sock_addr] = (candidate, list(messages))
+            else:
+                queued[1].extend(messages)
+            self._queued_packets += len(messages)
+        return True
+
+    def _take_slice(self):
+        now = time()
+        if self._packets_per_second:
+            self._packet_budget = min(float(self._packets_per_second),
+                                      self._packet_budget + (now - self._last_slice) * self._packets_per_second)
+        self._last_slice = now
+
+        max_steps = int(ceil(self._step_rate * WALK_SLICE_INTERVAL))
+        steps = 0
+        self._queue = {}
+        self._queued_packets = 0
+        try:
+            while self._heap and self._heap[0][0] <= now and steps < max_steps:
+                if self._packets_per_second and self._packet_budget <= self._queued_packets:
+                    break
+
+                entry = heappop(self._heap)
+                _, _, community, step, interval = entry
+                if community is None:
+                    continue
+
+                # schedule the next step before taking this one, STEP may call start_walking or stop_walking
+                self._sequence += 1
+                entry[0] = max(entry[0] + interval, now)
+                entry[1] = self._sequence
+                heappush(self._heap, entry)
+
+                steps += 1
+                try:
+                    step()
+                except Exception:
+                    self._logger.exception("%s failed to take a step", community)
+
+        finally:
+            queue, self._queue = self._queue, None
+            self._packet_budget -= self._queued_packets
+
+            # send the queued requests for all peers in one endpoint call
+            if queue and not self._dispersy._send_batch(queue.values()):
+                self._logger.warning("unable to send %d queued introduction requests", self._queued_packets)